@@ -0,0 +1,76 @@
+"""
+Compares the codec with the mix of encoders the server used before (stdlib `json` with
+`PromisesEncoder` / `custom_default`, `ujson` for sanic responses).
+
+Usage:
+    $ python -m benchmarks.codec
+"""
+from server_logic.definitions.context import Context
+from strings.items import TextPromise
+from decimal import Decimal
+from copy import deepcopy
+import timeit
+import codec
+import ujson
+import json
+
+
+SOURCE = {"security_token": "XXX", "via_instance": "UNIQUE_ID", "service_in": "telegram",
+          "user": {"user_id": 1232131, "first_name": "Test"}, "chat": {"chat_id": 2131321},
+          "has_message": True, "message": {"text": "Hello there", "message_id": 10},
+          "has_buttons": True, "buttons": [{"text": f"button {i}"} for i in range(5)]}
+
+
+class PromisesEncoder(json.JSONEncoder):
+    def default(self, o):
+        if isinstance(o, TextPromise):
+            return str(o)
+        return json.JSONEncoder.default(self, o)
+
+
+def custom_default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    elif isinstance(obj, TextPromise):
+        return str(obj)
+    raise TypeError
+
+
+def payloads():
+    request = Context.from_json(deepcopy(SOURCE)).object['request']
+    # Outbound message: text is a filled promise
+    promise = TextPromise("greeting")
+    promise.fill("Hello there, how are you?")
+    outbound = deepcopy(request)
+    outbound['message']['text'] = promise
+    # Item read from the database: numbers are decimals
+    stored = deepcopy(request)
+    stored['user']['user_id'] = Decimal(1232131)
+    stored['chat']['chat_id'] = Decimal(2131321)
+    return request, outbound, stored
+
+
+def per_call(function, number):
+    return timeit.timeit(function, number=number) / number * 1e6
+
+
+def main(number=20000):
+    request, outbound, stored = payloads()
+    encoded = json.dumps(request)
+    rows = [
+        ("response (plain)", lambda: ujson.dumps(request), lambda: codec.dumps(request)),
+        ("outbound (promise)", lambda: json.dumps(outbound, cls=PromisesEncoder), lambda: codec.dumps(outbound)),
+        ("database (decimal)", lambda: json.dumps(stored, default=custom_default), lambda: codec.dumps(stored)),
+        ("decode", lambda: json.loads(encoded), lambda: codec.loads(encoded)),
+    ]
+    for backend in codec.BACKENDS:
+        codec.use(backend)
+        print(f"codec backend: {backend}, {number} calls, us/call")
+        for name, before, after in rows:
+            before_time = per_call(before, number)
+            after_time = per_call(after, number)
+            print(f"    {name:20} before: {before_time:7.2f}  codec: {after_time:7.2f}  speedup: {before_time / after_time:5.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""
+Compares compiled context validator with the jsonschema one.
+
+Usage:
+    $ python -m benchmarks.context_validation
+"""
+from server_logic.definitions.context import fast_validate, schema_validate, SCHEMA
+from copy import deepcopy
+import timeit
+
+
+SOURCE = {"security_token": "XXX", "via_instance": "UNIQUE_ID", "service_in": "telegram",
+          "user": {"user_id": 1232131, "first_name": "Test"}, "chat": {"chat_id": 2131321},
+          "has_message": True, "message": {"text": "Hello there", "message_id": 10}}
+
+
+def run(validate, number):
+    # Copy is made for every call, since validation fills defaults in place
+    copies = [deepcopy(SOURCE) for _ in range(number)]
+    iterator = iter(copies)
+    return timeit.timeit(lambda: validate(next(iterator)), number=number)
+
+
+def main(number=20000):
+    if fast_validate is None:
+        print("Schema can't be compiled, only jsonschema validation is available")
+        return
+    schema_time = run(schema_validate, number)
+    fast_time = run(fast_validate, number)
+    print(f"Validated {number} contexts ({len(SCHEMA['properties'])} top-level properties)")
+    print(f"    jsonschema: {schema_time / number * 1e6:8.2f} us/context")
+    print(f"    compiled:   {fast_time / number * 1e6:8.2f} us/context")
+    print(f"    speedup:    {schema_time / fast_time:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Latency of database requests under concurrent load: blocking boto3 calls made on the loop (as before)
+against the same calls made through `DatabaseExecutor`.
+
+The table is simulated, each request blocks its thread for a round trip to DynamoDB (`--latency` ms),
+so only the concurrency model is measured, not the database.
+
+Usage:
+    $ python -m benchmarks.database [--rate 500] [--seconds 2] [--latency 5] [--pool 32]
+"""
+from db.executor import DatabaseExecutor
+import statistics
+import argparse
+import asyncio
+import time
+
+
+class SimulatedTable:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def get_item(self, Key):
+        time.sleep(self.latency)
+        return {"Item": {"identity": Key['identity']}}
+
+
+async def request(call, identity: str, arrival: float, latencies: list):
+    await asyncio.sleep(max(arrival - time.perf_counter(), 0))
+    await call(Key={"identity": identity})
+    # From the moment the request arrived, so time spent waiting for the loop counts too
+    latencies.append(time.perf_counter() - arrival)
+
+
+async def run(call, rate: int, seconds: float) -> list:
+    """Requests arrive at a steady `rate` per second (messages of many users), regardless of the previous ones"""
+    latencies = list()
+    start = time.perf_counter()
+    await asyncio.gather(*[request(call, str(i), start + i / rate, latencies) for i in range(int(rate * seconds))])
+    return latencies
+
+
+def report(name: str, latencies: list):
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"    {name:9} p50 {quantiles[49] * 1e3:9.1f} ms, p99 {quantiles[98] * 1e3:9.1f} ms")
+
+
+def main(rate=500, seconds=2, latency=5, pool=32):
+    table = SimulatedTable(latency / 1000)
+
+    async def blocking(**kwargs):
+        return table.get_item(**kwargs)
+
+    executor = DatabaseExecutor(pool)
+
+    async def pooled(**kwargs):
+        return await executor.run(table.get_item, **kwargs)
+
+    print(f"{rate} requests/s for {seconds} s, {latency} ms per request")
+    for name, call in (("blocking", blocking), ("executor", pooled)):
+        report(name, asyncio.run(run(call, rate, seconds)))
+    executor.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=int, default=500, help="requests per second")
+    parser.add_argument("--seconds", type=float, default=2)
+    parser.add_argument("--latency", type=float, default=5, help="ms per request")
+    parser.add_argument("--pool", type=int, default=32)
+    args = parser.parse_args()
+    main(args.rate, args.seconds, args.latency, args.pool)
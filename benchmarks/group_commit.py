@@ -0,0 +1,86 @@
+"""
+User puts under concurrent load: one `PutItem` request per put against `GroupCommit` (`BatchWriteItem`).
+
+The table is simulated, each request blocks its thread for a round trip to DynamoDB (`--latency` ms)
+plus a little per item, so the cost of the requests themselves is what's compared.
+
+Usage:
+    $ python -m benchmarks.group_commit [--rate 5000] [--seconds 2] [--latency 5] [--pool 32] [--window 5]
+"""
+from db.group_commit import GroupCommit
+from db.executor import DatabaseExecutor
+import statistics
+import argparse
+import asyncio
+import time
+
+# Serializing and writing one more item of a request
+PER_ITEM = 0.00005
+
+
+class SimulatedTable:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.requests = 0
+
+    def put_item(self, Item):
+        self.requests += 1
+        time.sleep(self.latency + PER_ITEM)
+        return {}
+
+    def batch_write_item(self, RequestItems):
+        self.requests += 1
+        time.sleep(self.latency + PER_ITEM * sum(len(requests) for requests in RequestItems.values()))
+        return {"UnprocessedItems": {}}
+
+
+async def request(put, identity: str, arrival: float, latencies: list):
+    await asyncio.sleep(max(arrival - time.perf_counter(), 0))
+    await put({"identity": identity, "states": ["ENDState"]})
+    latencies.append(time.perf_counter() - arrival)
+
+
+async def run(put, rate: int, seconds: float) -> (list, float):
+    latencies = list()
+    start = time.perf_counter()
+    await asyncio.gather(*[request(put, str(i), start + i / rate, latencies) for i in range(int(rate * seconds))])
+    return latencies, time.perf_counter() - start
+
+
+def report(name: str, latencies: list, elapsed: float, requests: int):
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(f"    {name:12} {len(latencies) / elapsed:7.0f} puts/s, {requests:6} requests, "
+          f"p50 {quantiles[49] * 1e3:8.1f} ms, p99 {quantiles[98] * 1e3:8.1f} ms")
+
+
+def main(rate=5000, seconds=2, latency=5, pool=32, window=5):
+    print(f"{rate} puts/s for {seconds} s, {latency} ms per request, {pool} threads")
+    table = SimulatedTable(latency / 1000)
+    executor = DatabaseExecutor(pool)
+
+    async def single(item):
+        await executor.run(table.put_item, Item=item)
+
+    latencies, elapsed = asyncio.run(run(single, rate, seconds))
+    report("put_item", latencies, elapsed, table.requests)
+
+    table = SimulatedTable(latency / 1000)
+
+    async def grouped():
+        commit = GroupCommit(executor, table.batch_write_item, 'Users', 'identity', window / 1000)
+        return await run(commit.put, rate, seconds)
+
+    latencies, elapsed = asyncio.run(grouped())
+    report("group commit", latencies, elapsed, table.requests)
+    executor.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=int, default=5000, help="puts per second")
+    parser.add_argument("--seconds", type=float, default=2)
+    parser.add_argument("--latency", type=float, default=5, help="ms per request")
+    parser.add_argument("--pool", type=int, default=32)
+    parser.add_argument("--window", type=float, default=5, help="ms the puts are gathered for")
+    args = parser.parse_args()
+    main(args.rate, args.seconds, args.latency, args.pool, args.window)
@@ -0,0 +1,69 @@
+"""
+Compares request snapshots with deep copies, for a broadcast that changes only `chat.chat_id` per recipient.
+
+Usage:
+    $ python -m benchmarks.snapshot
+"""
+from server_logic.definitions.context import Context
+from server_logic.definitions import freeze
+from fsm.delivery import DeliveryQueue
+from copy import deepcopy
+import tracemalloc
+import timeit
+import json
+
+
+SOURCE = {"security_token": "XXX", "via_instance": "UNIQUE_ID", "service_in": "telegram",
+          "user": {"user_id": 1232131, "first_name": "Test"}, "chat": {"chat_id": 2131321},
+          "has_message": True, "message": {"text": "Hello there " * 20, "message_id": 10},
+          "has_buttons": True, "buttons": [{"text": f"button {i}"} for i in range(5)]}
+
+
+def broadcast_deepcopy(request, targets):
+    payloads = list()
+    for target in targets:
+        request['chat']['chat_id'] = target
+        payloads.append(deepcopy(request))
+    return payloads
+
+
+def broadcast_snapshot(request, targets):
+    payloads = list()
+    snapshot = None
+    for target in targets:
+        request['chat']['chat_id'] = target
+        snapshot = freeze(request, snapshot)
+        payloads.append(snapshot)
+    return payloads
+
+
+def measure(function, request, targets):
+    tracemalloc.start()
+    payloads = function(request, targets)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del payloads
+    seconds = timeit.timeit(lambda: function(request, targets), number=1)
+    return seconds, memory
+
+
+def main(number=50000):
+    request = Context.from_json(deepcopy(SOURCE)).object['request']
+    targets = list(range(number))
+    copy_time, copy_memory = measure(broadcast_deepcopy, request, targets)
+    snapshot_time, snapshot_memory = measure(broadcast_snapshot, request, targets)
+    print(f"Broadcast of one request to {number} chats")
+    print(f"    deepcopy: {copy_time / number * 1e6:8.2f} us/recipient, {copy_memory / number:8.0f} bytes/recipient")
+    print(f"    snapshot: {snapshot_time / number * 1e6:8.2f} us/recipient, {snapshot_memory / number:8.0f} bytes/recipient")
+
+    # Same payload sent twice is serialized once
+    snapshot = freeze(request)
+    encode_time = timeit.timeit(lambda: DeliveryQueue.encode(snapshot), number=number)
+    dumps_time = timeit.timeit(lambda: json.dumps(request), number=number)
+    print(f"Repeated serialization of the same payload")
+    print(f"    json.dumps: {dumps_time / number * 1e6:8.2f} us/message")
+    print(f"    snapshot:   {encode_time / number * 1e6:8.2f} us/message")
+
+
+if __name__ == '__main__':
+    main()
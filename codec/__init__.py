@@ -0,0 +1,86 @@
+"""
+Single place for the json encoding of everything that goes over the wire or to the database.
+
+Uses `orjson` when it's installed and the standard `json` module otherwise (or when `use("json")` is called).
+Besides plain json types it encodes `Decimal` (numbers read by boto3) and any type registered with
+`register` (`TextPromise` and `Button` register themselves in `strings.items`).
+"""
+from typing import Any, Callable, Dict, Union
+import decimal
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _encode_decimal(obj: decimal.Decimal):
+    # Integers (ids) must stay integers, `float(Decimal(1))` would be `1.0`
+    if obj == obj.to_integral_value():
+        return int(obj)
+    return float(obj)
+
+
+# type -> function that returns json-serializable replacement of the object
+ENCODERS: Dict[type, Callable[[Any], Any]] = {
+    decimal.Decimal: _encode_decimal,
+}
+
+
+def register(type_: type, encoder: Callable[[Any], Any]):
+    """Teaches codec to encode objects of `type_` (and its subclasses)"""
+    ENCODERS[type_] = encoder
+
+
+def default(obj):
+    for type_ in type(obj).__mro__:
+        encoder = ENCODERS.get(type_)
+        if encoder is not None:
+            return encoder(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _json_dumps(obj) -> str:
+    return json.dumps(obj, default=default)
+
+
+def _json_dumpb(obj) -> bytes:
+    return _json_dumps(obj).encode()
+
+
+if orjson is not None:
+    # Same output as `json` for our data: int keys are allowed (converted to strings)
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def _orjson_dumpb(obj) -> bytes:
+        return orjson.dumps(obj, default=default, option=ORJSON_OPTIONS)
+
+    def _orjson_dumps(obj) -> str:
+        return _orjson_dumpb(obj).decode()
+
+
+BACKENDS = {
+    "json": (_json_dumps, _json_dumpb, json.loads),
+}
+if orjson is not None:
+    BACKENDS["orjson"] = (_orjson_dumps, _orjson_dumpb, orjson.loads)
+
+backend = None
+dumps: Callable[[Any], str]
+dumpb: Callable[[Any], bytes]
+loads: Callable[[Union[str, bytes]], Any]
+
+
+def use(name: str):
+    """Switches backend of the module-level `dumps`, `dumpb` and `loads`"""
+    global backend, dumps, dumpb, loads
+    if name not in BACKENDS:
+        raise ValueError(f"json backend {name!r} is not available, choose one of {list(BACKENDS)}")
+    backend = name
+    dumps, dumpb, loads = BACKENDS[name]
+
+
+use("orjson" if orjson is not None else "json")
+
+__all__ = ['register', 'default', 'dumps', 'dumpb', 'loads', 'use', 'backend', 'BACKENDS']
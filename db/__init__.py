@@ -1,7 +1,13 @@
 from .typing_hints import User, ConversationRequest, Conversation, CheckBack, BroadcastMessage, Session, StringItem
-from .enums import AccountType, ServiceTypes
+from .typing_hints import LeaseItem, OutboundMessage
+from .lease import Lease, DatabaseLease, LocalLease, run_with_lease
+from .enums import AccountType, ServiceTypes, OutboundStatus
 from .db import Database
+from .planner import Target, QueryPlan, plan_targets
 
 __all__ = ['Database', 'AccountType', 'ServiceTypes', 'User', 'ConversationRequest',
-           'Conversation', 'CheckBack', 'Session', 'BroadcastMessage', 'StringItem',
+           'Conversation', 'CheckBack', 'Session', 'BroadcastMessage', 'StringItem', 'LeaseItem',
+           'OutboundMessage', 'OutboundStatus',
+           'Lease', 'DatabaseLease', 'LocalLease', 'run_with_lease',
+           'Target', 'QueryPlan', 'plan_targets',
            ]
\ No newline at end of file
@@ -0,0 +1,129 @@
+from typing import Awaitable, Callable, Dict, List, Optional
+from collections import Counter
+from .throttling import ThrottledClient
+import asyncio
+import random
+import copy
+
+
+class BatchReader(object):
+    """
+    Reads of the items of one table by their keys, coalesced.
+
+    Reads of a key that is already being read share its request (singleflight). Reads of different keys
+    made in the same iteration of the loop (`query_translations`, several users of one broadcast
+    page) go out as a single `BatchGetItem` of up to 100 keys. Unprocessed keys (the table is throttled)
+    are retried with jittered backoff.
+
+    @Important: write of a key has to `forget` it (after the write), so reads made after the write don't
+    @Important: join a request that was made before it
+    """
+    BATCH_SIZE = 100
+
+    def __init__(self, client: ThrottledClient, batch_get_item: Callable, table_name: str,
+                 key_names: List[str], max_retries: int = 8, backoff: float = 0.05,
+                 sleep: Callable[[float], Awaitable] = asyncio.sleep):
+        """
+        Args:
+            client (ThrottledClient): runs the requests
+            batch_get_item (Callable): `batch_get_item` of the boto3 resource
+            table_name (str): table the items are read from
+            key_names (List[str]): attributes of the key of the table (hash, range)
+            max_retries (int): attempts to read unprocessed keys, before their reads fail
+            backoff (float): base delay between the attempts, seconds
+        """
+        self.client = client
+        self.batch_get_item = batch_get_item
+        self.table_name = table_name
+        self.key_names = key_names
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.sleep = sleep
+        # key -> future of the read the new reads of the key join
+        self.futures: Dict[tuple, asyncio.Future] = dict()
+        # Keys waiting for the next request
+        self.pending: Dict[tuple, asyncio.Future] = dict()
+        self.scheduled = False
+        self.stats = Counter()
+
+    def key(self, item: dict) -> tuple:
+        return tuple(item[name] for name in self.key_names)
+
+    async def get(self, key: dict) -> Optional[dict]:
+        """Returns the item by its key (None, if there is no such item)"""
+        key = self.key(key)
+        self.stats['reads'] += 1
+        # Read that isn't sent yet sees the writes made so far, even if the key was forgotten since
+        future = self.futures.get(key) or self.pending.get(key)
+        if future is not None:
+            self.stats['coalesced'] += 1
+        else:
+            future = asyncio.get_event_loop().create_future()
+            self.futures[key] = future
+            self.pending[key] = future
+            if len(self.pending) >= self.BATCH_SIZE:
+                self.flush()
+            elif not self.scheduled:
+                self.scheduled = True
+                asyncio.get_event_loop().call_soon(self.flush)
+        # @Important: every reader gets an object of its own (the first one too, others may still be waiting)
+        return copy.deepcopy(await asyncio.shield(future))
+
+    def forget(self, key: dict):
+        self.futures.pop(self.key(key), None)
+
+    def flush(self):
+        self.scheduled = False
+        if self.pending:
+            asyncio.ensure_future(self.read(self.pending))
+            self.pending = dict()
+
+    async def read(self, batch: Dict[tuple, asyncio.Future]):
+        remaining = dict(batch)
+        self.stats['keys'] += len(remaining)
+        attempt = 0
+        try:
+            while remaining:
+                response = await self.client.run(
+                    self.batch_get_item,
+                    RequestItems={
+                        self.table_name: {
+                            'Keys': [dict(zip(self.key_names, key)) for key in remaining]
+                        }
+                    }
+                )
+                self.stats['requests'] += 1
+                for item in response.get('Responses', {}).get(self.table_name, []):
+                    self.done(self.key(item), remaining.pop(self.key(item)), item)
+                unprocessed = {self.key(key) for key in
+                               response.get('UnprocessedKeys', {}).get(self.table_name, {}).get('Keys', [])}
+                for key in list(remaining):
+                    if key not in unprocessed:
+                        # Not in the table
+                        self.done(key, remaining.pop(key), None)
+                if not remaining:
+                    break
+                attempt += 1
+                self.stats['unprocessed'] += len(remaining)
+                if attempt > self.max_retries:
+                    raise RuntimeError(f"{len(remaining)} keys weren't read from {self.table_name} "
+                                       f"after {self.max_retries} retries")
+                await self.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+        except Exception as e:
+            self.stats['failed'] += len(remaining)
+            for key, future in remaining.items():
+                self.done(key, future, error=e)
+
+    def done(self, key: tuple, future: asyncio.Future, item: Optional[dict] = None, error: Exception = None):
+        if self.futures.get(key) is future:
+            del self.futures[key]
+        if future.done():
+            return
+        if error is None:
+            future.set_result(item)
+        else:
+            future.set_exception(error)
+
+    def metrics(self) -> dict:
+        # Requests saved: reads that would have been a GetItem each
+        return {**self.stats, "saved": self.stats['reads'] - self.stats['requests']}
@@ -1,4 +1,120 @@
 from botocore.exceptions import ClientError
+from boto3.dynamodb.conditions import Attr
+from .planner import USER_INDEXES, USER_INDEX_PROJECTION
+from .enums import OutboundStatus
+from settings import USERS_INDEX_CAPACITY
+from typing import Callable, List
+import datetime
+import time
+
+
+# Indexes for the broadcast targeting (see `db/planner.py`)
+USERS_ATTRIBUTES = [
+    {
+        'AttributeName': attribute,
+        'AttributeType': 'S' if type_ is str else 'N'
+    }
+    for attribute, (_, type_) in USER_INDEXES.items()
+]
+USERS_INDEXES = [
+    {
+        'IndexName': index,
+        'KeySchema': [
+            {
+                'AttributeName': attribute,
+                'KeyType': 'HASH'
+            }
+        ],
+        'Projection': {
+            'ProjectionType': 'INCLUDE',
+            'NonKeyAttributes': [name for name in USER_INDEX_PROJECTION if name != attribute]
+        },
+        # @Important: user writes that change the key or projected attributes write to the index too, and
+        # @Important: a throttled index throttles the writes to the table (see db/README.md)
+        'ProvisionedThroughput': {
+            'ReadCapacityUnits': USERS_INDEX_CAPACITY,
+            'WriteCapacityUnits': USERS_INDEX_CAPACITY
+        }
+    }
+    for attribute, (index, _) in USER_INDEXES.items()
+]
+
+CHECKBACKS_ATTRIBUTES = [
+    {
+        'AttributeName': 'partition',
+        'AttributeType': 'S'
+    },
+    {
+        'AttributeName': 'send_at',
+        'AttributeType': 'S'
+    },
+]
+CHECKBACKS_INDEXES = [
+    {
+        'IndexName': 'partition_time',
+        'KeySchema': [
+            {
+                'AttributeName': 'partition',
+                'KeyType': "HASH"
+            },
+            {
+                'AttributeName': 'send_at',
+                'KeyType': 'RANGE'
+            }
+        ],
+        'Projection': {
+            'ProjectionType': 'KEYS_ONLY',
+        },
+        'ProvisionedThroughput': {
+            'ReadCapacityUnits': 1,
+            'WriteCapacityUnits': 1
+        }
+    }
+]
+
+# Sparse: dead-lettered messages drop `next_attempt_at`, so only pending ones are in the index
+OUTBOUND_ATTRIBUTES = [
+    {
+        'AttributeName': 'status',
+        'AttributeType': 'S'
+    },
+    {
+        'AttributeName': 'next_attempt_at',
+        'AttributeType': 'S'
+    },
+]
+OUTBOUND_INDEXES = [
+    {
+        'IndexName': 'status_next_attempt',
+        'KeySchema': [
+            {
+                'AttributeName': 'status',
+                'KeyType': "HASH"
+            },
+            {
+                'AttributeName': 'next_attempt_at',
+                'KeyType': 'RANGE'
+            }
+        ],
+        # Retry loop needs the whole message
+        'Projection': {
+            'ProjectionType': 'ALL',
+        },
+        'ProvisionedThroughput': {
+            'ReadCapacityUnits': 1,
+            'WriteCapacityUnits': 1
+        }
+    }
+]
+# Dead-lettered messages are deleted by DynamoDB after this time (epoch seconds)
+OUTBOUND_TIME_TO_LIVE = 'expires_at'
+
+# Indexes added after the tables were created, `python -m db.migrate` adds them to the existing tables
+INDEXES = {
+    'Users': (USERS_ATTRIBUTES, USERS_INDEXES),
+    'CheckBacks': (CHECKBACKS_ATTRIBUTES, CHECKBACKS_INDEXES),
+    'OutboundMessages': (OUTBOUND_ATTRIBUTES, OUTBOUND_INDEXES),
+}
 
 
 class TableStatus:
@@ -10,6 +126,141 @@ class TableStatus:
         return f"{self.name}: {self.status}"
 
 
+def wait_for_indexes(dynamodb, table_name: str, delay: float = 1):
+    """Blocks until all global secondary indexes of the table are built"""
+    while True:
+        description = dynamodb.meta.client.describe_table(TableName=table_name)['Table']
+        statuses = [index.get('IndexStatus') for index in description.get('GlobalSecondaryIndexes', [])]
+        if all(status == 'ACTIVE' for status in statuses):
+            return
+        time.sleep(delay)
+
+
+def missing_indexes(dynamodb, table_name: str) -> List[str]:
+    existing = {index['IndexName'] for index in (dynamodb.Table(table_name).global_secondary_indexes or [])}
+    return [index['IndexName'] for index in INDEXES[table_name][1] if index['IndexName'] not in existing]
+
+
+def existing_table_status(dynamodb, table_name: str) -> str:
+    """
+    Status of the table that was created before. Indexes introduced since aren't added here: building an index
+    of a big table takes hours, the server shouldn't wait for it on start (see `add_missing_indexes`)
+    """
+    missing = missing_indexes(dynamodb, table_name)
+    if missing:
+        return f"ALREADY EXISTS, MISSING INDEXES {', '.join(missing)} (run `python -m db.migrate`)"
+    return "ALREADY EXISTS"
+
+
+def add_missing_indexes(dynamodb, table_name: str) -> List[str]:
+    """Adds global secondary indexes, that were introduced after the table was created, waits till they are built"""
+    attributes, indexes = INDEXES[table_name]
+    missing = missing_indexes(dynamodb, table_name)
+    for index in indexes:
+        if index['IndexName'] not in missing:
+            continue
+        # @Important: DynamoDB allows only one index creation per update
+        dynamodb.meta.client.update_table(
+            TableName=table_name,
+            AttributeDefinitions=attributes,
+            GlobalSecondaryIndexUpdates=[{'Create': index}]
+        )
+        wait_for_indexes(dynamodb, table_name)
+    return missing
+
+
+def enable_time_to_live(dynamodb, table_name: str, attribute: str) -> bool:
+    """Turns on the expiration of the items by `attribute`, returns False if it was on already"""
+    description = dynamodb.meta.client.describe_time_to_live(TableName=table_name)['TimeToLiveDescription']
+    if description.get('TimeToLiveStatus') in ('ENABLED', 'ENABLING'):
+        return False
+    dynamodb.meta.client.update_time_to_live(
+        TableName=table_name,
+        TimeToLiveSpecification={
+            'Enabled': True,
+            'AttributeName': attribute
+        }
+    )
+    return True
+
+
+def migrate_dead_letters(dynamodb, expires_at: int) -> int:
+    """
+    Drops the dead-lettered outbound messages out of the `status_next_attempt` index (older versions kept
+    `next_attempt_at`), they expire at `expires_at` (epoch seconds). Returns amount of migrated messages.
+    """
+    table = dynamodb.Table('OutboundMessages')
+    migrated = 0
+    kwargs = dict()
+    while True:
+        response = table.scan(
+            FilterExpression=Attr('status').eq(OutboundStatus.DEAD) & Attr('next_attempt_at').exists(),
+            ProjectionExpression="id",
+            **kwargs
+        )
+        for item in response['Items']:
+            table.update_item(
+                Key={
+                    'id': item['id']
+                },
+                UpdateExpression="SET #exp = if_not_exists(#exp, :exp) REMOVE next_attempt_at",
+                ExpressionAttributeNames={
+                    "#exp": OUTBOUND_TIME_TO_LIVE
+                },
+                ExpressionAttributeValues={
+                    ":exp": expires_at
+                }
+            )
+            migrated += 1
+        if 'LastEvaluatedKey' not in response:
+            return migrated
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def migrate_checkbacks(dynamodb, partition_of: Callable[[str], str], now: datetime.datetime,
+                       grace: datetime.timedelta = datetime.timedelta(hours=1)) -> dict:
+    """
+    Moves checkbacks written before the partitions (they have `server_mac` instead of `partition`) to the
+    partitions, so their owners send them. Checkbacks due more than `grace` ago were handled (or lost) by
+    the old scheduler, they are marked sent instead of being sent this late. Safe to run again.
+    """
+    table = dynamodb.Table('CheckBacks')
+    counts = {"pending": 0, "sent": 0}
+    since = (now - grace).isoformat()
+    kwargs = dict()
+    while True:
+        response = table.scan(FilterExpression=Attr('server_mac').exists(), ProjectionExpression="id, send_at",
+                              **kwargs)
+        for item in response['Items']:
+            if item['send_at'] >= since:
+                update = "SET #prt = :p, was_sent = :f REMOVE server_mac"
+                values = {":p": partition_of(item['id']), ":f": False}
+                counted = "pending"
+            else:
+                update = "SET was_sent = :t REMOVE server_mac"
+                values = {":t": True}
+                counted = "sent"
+            try:
+                table.update_item(
+                    Key={
+                        'id': item['id']
+                    },
+                    UpdateExpression=update,
+                    # Could be migrated meanwhile by another run
+                    ConditionExpression=Attr('server_mac').exists(),
+                    **({"ExpressionAttributeNames": {"#prt": "partition"}} if counted == "pending" else {}),
+                    ExpressionAttributeValues=values
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] != "ConditionalCheckFailedException":
+                    raise
+                continue
+            counts[counted] += 1
+        if 'LastEvaluatedKey' not in response:
+            return counts
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
 def create_db(dynamodb):
     statuses = list()
 
@@ -27,8 +278,10 @@ def create_db(dynamodb):
                 {
                     'AttributeName': 'identity',
                     'AttributeType': 'S'
-                }
+                },
+                *USERS_ATTRIBUTES
             ],
+            GlobalSecondaryIndexes=USERS_INDEXES,
             ProvisionedThroughput={
                 'ReadCapacityUnits': 1,
                 'WriteCapacityUnits': 1
@@ -37,7 +290,7 @@ def create_db(dynamodb):
         status.status = table.table_status
     except ClientError as e:
         if e.response['Error']['Code'] == "ResourceInUseException":
-            status.status = "ALREADY EXISTS"
+            status.status = existing_table_status(dynamodb, 'Users')
         else:
             raise e
     statuses.append(status)
@@ -124,37 +377,9 @@ def create_db(dynamodb):
                     'AttributeName': "id",
                     'AttributeType': 'S'
                 },
-                {
-                    'AttributeName': 'server_mac',
-                    'AttributeType': 'S'
-                },
-                {
-                    'AttributeName': 'send_at',
-                    'AttributeType': 'S'
-                },
-            ],
-            GlobalSecondaryIndexes=[
-                {
-                    'IndexName': 'time',
-                    'KeySchema': [
-                        {
-                            'AttributeName': 'server_mac',
-                            'KeyType': "HASH"
-                        },
-                        {
-                            'AttributeName': 'send_at',
-                            'KeyType': 'RANGE'
-                        }
-                    ],
-                    'Projection': {
-                        'ProjectionType': 'KEYS_ONLY',
-                    },
-                    'ProvisionedThroughput': {
-                        'ReadCapacityUnits': 1,
-                        'WriteCapacityUnits': 1
-                    }
-                }
+                *CHECKBACKS_ATTRIBUTES
             ],
+            GlobalSecondaryIndexes=CHECKBACKS_INDEXES,
             ProvisionedThroughput={
                 'ReadCapacityUnits': 1,
                 'WriteCapacityUnits': 1
@@ -163,7 +388,7 @@ def create_db(dynamodb):
         status.status = table.table_status
     except ClientError as e:
         if e.response['Error']['Code'] == "ResourceInUseException":
-            status.status = "ALREADY EXISTS"
+            status.status = existing_table_status(dynamodb, 'CheckBacks')
         else:
             raise e
     statuses.append(status)
@@ -329,4 +554,64 @@ def create_db(dynamodb):
             raise e
     statuses.append(status)
 
+    status = TableStatus('Leases')
+    try:
+        table = dynamodb.create_table(
+            TableName='Leases',
+            KeySchema=[
+                {
+                    'AttributeName': 'name',
+                    'KeyType': 'HASH'
+                }
+            ],
+            AttributeDefinitions=[
+                {
+                    'AttributeName': 'name',
+                    'AttributeType': 'S'
+                }
+            ],
+            ProvisionedThroughput={
+                'ReadCapacityUnits': 1,
+                'WriteCapacityUnits': 1
+            }
+        )
+        status.status = table.table_status
+    except ClientError as e:
+        if e.response['Error']['Code'] == "ResourceInUseException":
+            status.status = "ALREADY EXISTS"
+        else:
+            raise e
+    statuses.append(status)
+
+    status = TableStatus('OutboundMessages')
+    try:
+        table = dynamodb.create_table(
+            TableName='OutboundMessages',
+            KeySchema=[
+                {
+                    'AttributeName': 'id',
+                    'KeyType': 'HASH'
+                }
+            ],
+            AttributeDefinitions=[
+                {
+                    'AttributeName': 'id',
+                    'AttributeType': 'S'
+                },
+                *OUTBOUND_ATTRIBUTES
+            ],
+            GlobalSecondaryIndexes=OUTBOUND_INDEXES,
+            ProvisionedThroughput={
+                'ReadCapacityUnits': 1,
+                'WriteCapacityUnits': 1
+            }
+        )
+        status.status = table.table_status
+    except ClientError as e:
+        if e.response['Error']['Code'] == "ResourceInUseException":
+            status.status = existing_table_status(dynamodb, 'OutboundMessages')
+        else:
+            raise e
+    statuses.append(status)
+
     print("Table statuses:\n   ", '\n    '.join(str(x) for x in statuses))
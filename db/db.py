@@ -1,29 +1,31 @@
 from .typing_hints import User, ConversationRequest, Conversation, CheckBack
-from settings import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, DATABASE_URL
-from .typing_hints import Optional, Session, BroadcastMessage, StringItem
+from settings import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, DATABASE_URL, CHECKBACK_PARTITIONS, DATABASE_POOL_SIZE
+from settings import DATABASE_BACKEND, USER_CACHE_SIZE, USER_CACHE_TTL, USER_CACHE_WRITE_BEHIND
+from settings import USER_GROUP_COMMIT_WINDOW, DATABASE_RETRIES, OUTBOUND_DEAD_LETTER_DAYS
+from .typing_hints import Optional, Session, BroadcastMessage, StringItem, LeaseItem, OutboundMessage
 from boto3.dynamodb.conditions import Key, Attr
 from server_logic.definitions import Context
 from botocore.exceptions import ClientError
 from typing import List, Dict, Iterable, AsyncGenerator, Generator
-from .create_db import create_db
-from .enums import AccountType
-from strings.items import TextPromise
+from .create_db import create_db, OUTBOUND_TIME_TO_LIVE
+from .enums import AccountType, OutboundStatus
+from .planner import USER_INDEXES
+from .executor import DatabaseExecutor
+from .throttling import ThrottledClient
+from .memory import MemoryDynamoDB
+from .tracking import changes, update_expression
+from .user_cache import UserCache
+from .group_commit import GroupCommit
+from .batch_reader import BatchReader
+from botocore.config import Config
 import datetime
 import asyncio
+import copy
 import logging
-import decimal
 import boto3
 import pytz
 import uuid
-import json
-
-
-def custom_default(obj):
-    if isinstance(obj, decimal.Decimal):
-        return float(obj)
-    elif isinstance(obj, TextPromise):
-        return str(obj)
-    raise TypeError
+import codec
 
 
 def singleton(cls, *args, **kw):
@@ -33,25 +35,42 @@ def singleton(cls, *args, **kw):
         if cls not in instances:
             instances[cls] = cls(*args, **kw)
         return instances[cls]
+    # Class itself, to create separate instances (tests, tools)
+    _singleton.__wrapped__ = cls
     return _singleton
 
 
-# TODO: Probably worth it to switch to async solution eventually but
-# TODO: right now, it's just PoC solution
+# @Important: boto3 is blocking, every request to the database runs in `self.executor` (own bounded
+# @Important: thread pool), never on the loop itself, so one slow request doesn't stall all other users
 @singleton
 class Database:
     types = AccountType
     LIMIT_CONCURRENT_CHATS = 100
+    # DynamoDB limit is 4KB, bigger updates are written as the whole item
+    MAX_UPDATE_EXPRESSION = 4000
     TZ = pytz.utc
 
-    def __init__(self, database_url=None, region_name='eu-center-1'):
-        self.dynamodb = boto3.resource(
-            'dynamodb',
-            region_name=region_name,
-            endpoint_url=database_url or DATABASE_URL,
-            aws_access_key_id=AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-        )
+    def __init__(self, database_url=None, region_name='eu-center-1', backend=None):
+        backend = backend or DATABASE_BACKEND
+        if backend == "dynamodb":
+            self.dynamodb = boto3.resource(
+                'dynamodb',
+                region_name=region_name,
+                endpoint_url=database_url or DATABASE_URL,
+                aws_access_key_id=AWS_ACCESS_KEY_ID,
+                aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+                # One connection per executor thread; throttled requests are retried by `ThrottledClient`,
+                # so it sees the throttling and slows the table down
+                config=Config(max_pool_connections=DATABASE_POOL_SIZE, retries={'mode': 'standard', 'max_attempts': 1})
+            )
+        elif backend in ("memory", "sqlite"):
+            # @Important: same tables in the process itself (see `db/memory.py`), for local load testing and CI;
+            # @Important: `sqlite` also saves them to the file at `DATABASE_URL`
+            self.dynamodb = MemoryDynamoDB(database_url or DATABASE_URL if backend == "sqlite" else None)
+        else:
+            raise ValueError(f"Unknown database backend: {backend}")
+        self.executor = DatabaseExecutor(DATABASE_POOL_SIZE)
+        self.client = ThrottledClient(self.executor, DATABASE_RETRIES)
         # Create db tables
         create_db(self.dynamodb)
         self.Users = self.dynamodb.Table('Users')
@@ -63,17 +82,50 @@ class Database:
         self.StringItems = self.dynamodb.Table('StringItems')
         self.WebCredentials = self.dynamodb.Table('WebCredentials')
         self.WebSessions = self.dynamodb.Table('WebSessions')
+        self.Leases = self.dynamodb.Table('Leases')
+        self.OutboundMessages = self.dynamodb.Table('OutboundMessages')
         # Cache
+        self.user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+        # Seconds user writes are held back, several messages of a user in a row are saved at once (0 - off)
+        self.write_behind = USER_CACHE_WRITE_BEHIND
+        # identity -> (user as it's in the database, user to be written)
+        self.pending_users: Dict[str, tuple] = dict()
+        # Reads by key, coalesced (same key - one request, keys of one loop iteration - one BatchGetItem)
+        self.user_reads = BatchReader(self.client, self.dynamodb.batch_get_item, 'Users', ['identity'])
+        self.session_reads = BatchReader(self.client, self.dynamodb.batch_get_item, 'Sessions', ['name'])
+        self.translation_reads = BatchReader(self.client, self.dynamodb.batch_get_item, 'StringItems',
+                                             ['language', 'string_key'])
+        # Puts of the users of concurrent messages go to the database together (None - one request per put)
+        self.user_writes: Optional[GroupCommit] = None
+        if USER_GROUP_COMMIT_WINDOW > 0:
+            self.user_writes = GroupCommit(self.client, self.dynamodb.batch_write_item, 'Users', 'identity',
+                                           USER_GROUP_COMMIT_WINDOW)
         self.active_conversations = 0
         self.requested_users = set()
         self.mac = str(uuid.getnode())
+        # Functions that get each newly created checkback
+        self.checkback_listeners = list()
         
         self.cached_websessions = set()
 
+    def metrics(self) -> dict:
+        return {
+            "executor": self.executor.metrics(),
+            "tables": self.client.metrics(),
+            "user_cache": {**self.user_cache.metrics(), "pending_writes": len(self.pending_users)},
+            "user_writes": self.user_writes.metrics() if self.user_writes is not None else None,
+            "reads": {reader.table_name: reader.metrics()
+                      for reader in (self.user_reads, self.session_reads, self.translation_reads)}
+        }
+
+    def close(self):
+        self.executor.shutdown()
+
     # High level methods
 
     async def create_creds(self, uname: str, token: str):
-        self.WebCredentials.put_item(
+        await self.client.run(
+            self.WebCredentials.put_item,
             Item={
                 "username": uname,
                 "token": token
@@ -82,16 +134,15 @@ class Database:
 
     async def verify_creds(self, uname: str, token: str):
         try:
-            response = self.WebCredentials.get_item(
+            response = await self.client.run(
+                self.WebCredentials.get_item,
                 Key={
                     'username': uname,
                     'token': token
                 }
             )
         except ClientError as e:
-            # TODO: @Important: Change all prints to logger.info or .error
-            # Print Error Message and return None
-            print(e.response['Error']['Message'])
+            self._error('WebCredentials', 'get_item', e)
             return False
         else:
             # If not exist -> return False
@@ -99,7 +150,8 @@ class Database:
             return bool(response.get('Item'))
 
     async def create_websession(self, token: str, new_session: str):
-        self.WebSessions.put_item(
+        await self.client.run(
+            self.WebSessions.put_item,
             Item={
                 "token": token,
                 "session_id": new_session
@@ -112,15 +164,14 @@ class Database:
         if session_id in self.cached_websessions:
             return True
         try:
-            response = self.WebSessions.get_item(
+            response = await self.client.run(
+                self.WebSessions.get_item,
                 Key={
                     'session_id': session_id
                 }
             )
         except ClientError as e:
-            # TODO: @Important: Change all prints to logger.info or .error
-            # Print Error Message and return None
-            print(e.response['Error']['Message'])
+            self._error('WebSessions', 'get_item', e)
             return False
         else:
             # If not exist -> return False
@@ -128,34 +179,48 @@ class Database:
             return bool(response.get('Item'))
 
     # User methods
+    @staticmethod
+    def _user_item(user: User) -> dict:
+        # @Important: index keys can't be null, user without a value is just not in the index
+        if any(user.get(attribute, '') is None for attribute in USER_INDEXES):
+            return {key: value for key, value in user.items() if value is not None or key not in USER_INDEXES}
+        return user
+
     async def create_user(self, item: User):
         """Creates User item in the according table"""
-        self.Users.put_item(
-            Item=item
-        )
+        await self._put_user(item)
+        self.user_cache.put(item['identity'], copy.deepcopy(item))
 
     async def get_user(self, identity: str) -> Optional[User]:
-        """Returns User item by the user identity"""
+        """Returns User item by the user identity (a copy, that can be changed freely)"""
+        # Written by this process, but not saved yet
+        if identity in self.pending_users:
+            return copy.deepcopy(self.pending_users[identity][1])
+        cached = self.user_cache.get(identity)
+        if cached is not None:
+            return copy.deepcopy(cached)
         try:
-            response = self.Users.get_item(
-                Key={
-                    'identity': identity
-                }
-            )
+            user = await self.user_reads.get({'identity': identity})
         except ClientError as e:
-            # TODO: @Important: Change all prints to logger.info or .error
-            # Print Error Message and return None
-            print(e.response['Error']['Message'])
+            self._error('Users', 'batch_get_item', e)
         else:
             # If not exist -> return None
-            if not response.get('Item'):
+            if not user:
                 return
-            # Return just item
-            return response['Item']
+            # Return just item (with nulls that weren't saved because of the indexes)
+            for attribute in USER_INDEXES:
+                user.setdefault(attribute, None)
+            self.user_cache.put(identity, copy.deepcopy(user))
+            return user
 
     async def update_user(self, identity: str, expression: str, values: Optional[dict], user: User = None) -> Optional[User]:
+        # @Important: held back changes go first, cached user doesn't know the result of the expression
+        await self.flush_user(identity)
+        await self._wait_user_put(identity)
+        self.user_cache.invalidate(identity)
         try:
-            response = self.Users.update_item(
+            response = await self.client.run(
+                self.Users.update_item,
                 Key={
                     'identity': identity
                 },
@@ -167,6 +232,9 @@ class Database:
             logging.exception(e)
             logging.info(user)
             response = None
+        # @Important: concurrent `get_user` could cache the old user while the update was in flight
+        self.user_cache.invalidate(identity)
+        self.user_reads.forget({'identity': identity})
 
         if user and response:
             # This is.. uh (since database returns only new value, not full object)
@@ -175,26 +243,178 @@ class Database:
 
     async def commit_user(self, user: User):
         # [DEBUG] logging.info(user)
-        self.Users.put_item(Item=user)
+        await self._put_user(user)
+        self.user_cache.put(user['identity'], copy.deepcopy(user))
 
-    async def scan_users(self, condition: Optional[Attr], projection_expression: Optional[str], page_size: int = 100):
-        kwargs = {"FilterExpression": condition} if condition else {}
-        while True:
-            response = self.Users.scan(
-                ProjectionExpression=projection_expression,
+    async def _put_user(self, user: User):
+        if self.user_writes is None:
+            await self.client.run(self.Users.put_item, Item=self._user_item(user))
+        else:
+            # @Important: the item is sent later, the caller's object may change meanwhile
+            await self.user_writes.put(copy.deepcopy(self._user_item(user)))
+        self.user_reads.forget(user)
+
+    async def _wait_user_put(self, identity: str):
+        """Update of the user mustn't overtake its put that is still gathered for a batch"""
+        if self.user_writes is not None:
+            await self.user_writes.wait(identity)
+
+    async def save_user(self, user: User, stored: Optional[User]) -> bool:
+        """
+        Writes only what changed in `user` since it was read as `stored` (None - user is new, written whole),
+        returns False if there was nothing to write. With `write_behind` the write is only scheduled.
+        """
+        if not self.write_behind:
+            return await self._write_user(user, stored)
+        identity = user['identity']
+        if identity in self.pending_users:
+            # Still not written, the database has what was there before the first of the changes
+            stored = self.pending_users[identity][0]
+        elif stored is not None and not changes(stored, user):
+            return False
+        latest = copy.deepcopy(user)
+        self.pending_users[identity] = (stored, latest)
+        # Neither of them is changed anymore, so they can share the object
+        self.user_cache.put(identity, latest)
+        return True
+
+    async def _write_user(self, user: User, stored: Optional[User]) -> bool:
+        if stored is None:
+            await self.commit_user(user)
+            return True
+        actions = changes(stored, user)
+        if not actions:
+            return False
+        # @Important: index keys can't be null, so they are removed instead
+        actions = [("REMOVE", path, None) if len(path) == 1 and path[0] in USER_INDEXES and value is None
+                   else (action, path, value) for action, path, value in actions]
+        expression, names, values = update_expression(actions)
+        if len(expression) > self.MAX_UPDATE_EXPRESSION:
+            # Most of the user changed anyway
+            await self.commit_user(user)
+            return True
+        kwargs = {"ExpressionAttributeValues": values} if values else {}
+        await self._wait_user_put(user['identity'])
+        try:
+            await self.client.run(
+                self.Users.update_item,
+                Key={
+                    'identity': user['identity']
+                },
+                UpdateExpression=expression,
+                ExpressionAttributeNames=names,
                 **kwargs
             )
-            for v in response.get("Items", []):
+        except Exception:
+            self.user_cache.invalidate(user['identity'])
+            raise
+        finally:
+            self.user_reads.forget(user)
+        self.user_cache.update(user['identity'], copy.deepcopy(user))
+        return True
+
+    async def flush_user(self, identity: str):
+        """Writes held back changes of the user right away"""
+        if identity not in self.pending_users:
+            return
+        stored, latest = self.pending_users.pop(identity)
+        try:
+            await self._write_user(latest, stored)
+        except Exception:
+            # Keep it for the next flush, unless it got newer changes meanwhile (they are on top of the same base)
+            if identity in self.pending_users:
+                self.pending_users[identity] = (stored, self.pending_users[identity][1])
+            else:
+                self.pending_users[identity] = (stored, latest)
+            raise
+
+    async def flush_users(self):
+        """Writes all held back changes (periodically and before shutdown)"""
+        for identity in list(self.pending_users):
+            try:
+                await self.flush_user(identity)
+            except Exception as e:
+                logging.exception(f"Failed to save user {identity}: {e}")
+        if self.user_writes is not None:
+            await self.user_writes.drain()
+
+    async def user_flush_loop(self):
+        if not self.write_behind:
+            return
+        try:
+            while True:
+                await asyncio.sleep(self.write_behind)
+                await self.flush_users()
+        except asyncio.CancelledError:
+            await self.flush_users()
+
+    async def scan_users(self, condition: Optional[Attr], projection_expression: Optional[str], page_size: int = 100):
+        async for page in self.iter_users_pages(condition, projection_expression, page_size=page_size):
+            for v in page:
                 yield v
-            kwargs["ExclusiveStartKey"] = response.get("LastEvaluatedKey", False)
-            if kwargs["ExclusiveStartKey"] is False:
-                return
 
+    async def iter_users_pages(self,
+                               condition: Optional[Attr],
+                               projection_expression: Optional[str],
+                               segment: int = 0,
+                               total_segments: int = 1,
+                               page_size: int = 100) -> AsyncGenerator[List[User], None]:
+        """
+        Scans `Users` page by page (at most `page_size` items are read per request), optionally only one of
+        `total_segments` segments, so the table can be scanned in parallel.
+        """
+        kwargs = {"Limit": page_size}
+        if condition:
+            kwargs["FilterExpression"] = condition
+        if projection_expression:
+            kwargs["ProjectionExpression"] = projection_expression
+        if total_segments > 1:
+            kwargs["Segment"] = segment
+            kwargs["TotalSegments"] = total_segments
+        while True:
+            response = await self.client.run(self.Users.scan, **kwargs)
+            yield response.get("Items", [])
+            if "LastEvaluatedKey" not in response:
+                return
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+    async def iter_users_index_pages(self,
+                                     index_name: str,
+                                     key_condition: Key,
+                                     condition: Optional[Attr],
+                                     projection_expression: Optional[str],
+                                     page_size: int = 100) -> AsyncGenerator[List[User], None]:
+        """Same as `iter_users_pages`, but queries one of the indexes of `Users` (see `db/planner.py`)"""
+        kwargs = {"IndexName": index_name, "KeyConditionExpression": key_condition, "Limit": page_size}
+        if condition:
+            kwargs["FilterExpression"] = condition
+        if projection_expression:
+            kwargs["ProjectionExpression"] = projection_expression
+        while True:
+            response = await self.client.run(self.Users.query, **kwargs)
+            yield response.get("Items", [])
+            if "LastEvaluatedKey" not in response:
+                return
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    async def users_table_stats(self) -> dict:
+        """Approximate size of `Users` and its indexes (DynamoDB updates these every ~6 hours)"""
+        description = (await self.client.run(self.dynamodb.meta.client.describe_table, TableName='Users'))['Table']
+        return {
+            "items": description.get('ItemCount', 0),
+            "bytes": description.get('TableSizeBytes', 0),
+            "indexes": {
+                index['IndexName']: {"items": index.get('ItemCount', 0), "bytes": index.get('IndexSizeBytes', 0),
+                                     "status": index.get('IndexStatus')}
+                for index in description.get('GlobalSecondaryIndexes', [])
+            }
+        }
 
     # Conversations
     async def create_conversation(self, user: User, users: dict, type_: AccountType):
         conv_id = str(uuid.uuid4())
-        self.Conversations.put_item(Item={
+        await self.client.run(self.Conversations.put_item, Item={
             "id": conv_id,
             "users": users,
             "type": type_,
@@ -205,7 +425,8 @@ class Database:
     async def get_conversation(self, user: User):
         """Returns Conversation item by the user identity"""
         try:
-            response = self.Conversations.get_item(
+            response = await self.client.run(
+                self.Conversations.get_item,
                 Key={
                     'id': user['conversation_id']
                 }
@@ -226,7 +447,8 @@ class Database:
         if identity in self.requested_users:
             raise ValueError("Identity is already in the conversation!")
         self.requested_users.add(identity)
-        self.ConversationRequests.put_item(
+        await self.client.run(
+            self.ConversationRequests.put_item,
             Item={
                 "identity": identity,
                 "type": type_,
@@ -240,7 +462,8 @@ class Database:
     async def get_request_by_user(self, identity: str):
         """Returns ConversationRequest item by the user identity"""
         try:
-            response = self.ConversationRequests.get_item(
+            response = await self.client.run(
+                self.ConversationRequests.get_item,
                 Key={
                     'identity': identity
                 }
@@ -256,7 +479,8 @@ class Database:
         """Remove ConversationRequest item by the user identity"""
         self.requested_users.remove(identity)
         try:
-            response = self.ConversationRequests.delete_item(
+            response = await self.client.run(
+                self.ConversationRequests.delete_item,
                 Key={
                     'identity': identity
                 }
@@ -265,7 +489,7 @@ class Database:
             # @Important: This exception is not really an error, just says that if we entered
             # @Important: some condition to check, before deleting item - the condition failed
             if e.response['Error']['Code'] == "ConditionalCheckFailedException":
-                print(e.response['Error']['Message'])
+                self._error('ConversationRequests', 'delete_item', e)
             else:
                 raise
         else:
@@ -275,7 +499,8 @@ class Database:
     async def get_waiting_requests(self, waiting: datetime.timedelta):
         now = self.now()
         condition = now - waiting
-        response = self.ConversationRequests.query(
+        response = await self.client.run(
+            self.ConversationRequests.query,
             FilterExpression="created_at > :c_at",
             ExpressionAttributeNames={
                 ":c_at": {"S": condition.isoformat()}
@@ -290,86 +515,401 @@ class Database:
         """Returns True if the number of current active conversations exceed the defined limit"""
         return self.active_conversations >= self.LIMIT_CONCURRENT_CHATS
 
+    def _error(self, table: str, operation: str, e: ClientError):
+        """Logs the error of a request that is handled (not raised), counts it in the table's metrics"""
+        logging.error(f"{table}.{operation} failed: {e.response['Error']['Code']}: {e.response['Error']['Message']}")
+        self.client.error(table, operation)
+
     def now(self) -> datetime.datetime:
         return datetime.datetime.now(self.TZ)
 
-    async def create_checkback(self, user: User, context: dict, send_in: datetime.timedelta):
+    def checkback_partition(self, checkback_id: str) -> str:
+        """Logical partition of the checkback, partitions are owned (and served) by the nodes through leases"""
+        return str(uuid.UUID(checkback_id).int % CHECKBACK_PARTITIONS)
+
+    async def create_checkback(self, user: User, context: dict, send_in: datetime.timedelta) -> CheckBack:
         """Creates Checkback item in the according table"""
-        self.CheckBacks.put_item(
+        checkback_id = str(uuid.uuid4())
+        item = {
+            "id": checkback_id,
+            "partition": self.checkback_partition(checkback_id),
+            "identity": context['user']['identity'],
+            "context": codec.dumps(context),
+            "send_at": (self.now() + send_in).isoformat(),
+            "was_sent": False
+        }
+        await self.client.run(
+            self.CheckBacks.put_item,
+            Item=item
+        )
+        # @Important: let the scheduler know right away, instead of it polling the table
+        for listener in self.checkback_listeners:
+            listener(item)
+        return item
+
+    async def get_checkback(self, checkback_id: str) -> Optional[CheckBack]:
+        try:
+            response = await self.client.run(
+                self.CheckBacks.get_item,
+                Key={
+                    'id': checkback_id
+                }
+            )
+        except ClientError as e:
+            logging.exception(e.response['Error']['Message'])
+        else:
+            return response.get('Item')
+
+    async def iter_pending_checkbacks(self,
+                                      partition: str,
+                                      until: Optional[datetime.datetime] = None) -> AsyncGenerator[CheckBack, None]:
+        """
+        Yields keys (`id`, `partition`, `send_at`) of all not yet sent checkbacks of the partition, optionally up to `until`.
+        Sent checkbacks are dropped out of the `partition_time` index (it's sparse on `partition`), so they are never returned.
+        """
+        condition = Key("partition").eq(partition)
+        if until is not None:
+            condition &= Key("send_at").lte(until.isoformat())
+        kwargs = {
+            "IndexName": "partition_time",
+            "KeyConditionExpression": condition
+        }
+        read = self.CheckBacks.query
+        while True:
+            try:
+                response = await self.client.run(read, **kwargs)
+            except ClientError as e:
+                if e.response['Error']['Code'] != "ValidationException" or "IndexName" not in kwargs:
+                    raise
+                # @Important: index isn't added yet (`python -m db.migrate`) or is still being built
+                logging.warning(f"CheckBacks index isn't ready, scanning the table: {e}")
+                read = self.CheckBacks.scan
+                condition = Attr("partition").eq(partition)
+                if until is not None:
+                    condition &= Attr("send_at").lte(until.isoformat())
+                kwargs = {
+                    "FilterExpression": condition,
+                    "ProjectionExpression": "id, #prt, send_at",
+                    "ExpressionAttributeNames": {"#prt": "partition"}
+                }
+                continue
+            for each_checkback in response['Items']:
+                yield each_checkback
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs["ExclusiveStartKey"] = response['LastEvaluatedKey']
+
+    async def claim_checkback(self, checkback: CheckBack, duration: datetime.timedelta) -> bool:
+        """
+        Reserves pending checkback for sending for `duration`, returns False if it was already sent or
+        is being sent by another process. If the process dies before `complete_checkback`, the claim
+        runs out and the checkback is picked up again (at-least-once delivery).
+        """
+        now = self.now()
+        try:
+            await self.client.run(
+                self.CheckBacks.update_item,
+                Key={
+                    'id': checkback['id']
+                },
+                UpdateExpression="SET claimed_until = :until, claimed_by = :mac",
+                ConditionExpression="attribute_exists(#prt) AND (attribute_not_exists(was_sent) OR was_sent = :f) "
+                                    "AND (attribute_not_exists(claimed_until) OR claimed_until < :now)",
+                # Hide from reserved db keywords
+                ExpressionAttributeNames={
+                    "#prt": "partition"
+                },
+                ExpressionAttributeValues={
+                    ":until": (now + duration).isoformat(),
+                    ":now": now.isoformat(),
+                    ":f": False,
+                    ":mac": self.mac
+                }
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == "ConditionalCheckFailedException":
+                return False
+            raise
+        return True
+
+    async def complete_checkback(self, checkback: CheckBack):
+        """Marks checkback as sent; removes `partition`, so the checkback leaves the `partition_time` index"""
+        await self.client.run(
+            self.CheckBacks.update_item,
+            Key={
+                'id': checkback['id']
+            },
+            UpdateExpression="SET was_sent = :t, sent_by = :mac REMOVE #prt, claimed_until, claimed_by",
+            ExpressionAttributeNames={
+                "#prt": "partition"
+            },
+            ExpressionAttributeValues={
+                ":t": True,
+                ":mac": self.mac
+            }
+        )
+
+    async def retry_checkback(self, checkback: CheckBack, error: str, send_at: datetime.datetime):
+        """
+        Gives up the claim of checkback that failed to be delivered and moves it to `send_at`, when the partition
+        owner picks it up again; counts the attempt
+        """
+        await self.client.run(
+            self.CheckBacks.update_item,
+            Key={
+                'id': checkback['id']
+            },
+            UpdateExpression="SET attempts = if_not_exists(attempts, :zero) + :one, last_error = :e, send_at = :at "
+                             "REMOVE claimed_until, claimed_by",
+            ExpressionAttributeValues={
+                ":zero": 0,
+                ":one": 1,
+                ":e": error,
+                ":at": send_at.isoformat()
+            }
+        )
+
+    async def dead_letter_checkback(self, checkback: CheckBack, error: str):
+        """
+        Gives up on the checkback, it stays in the table for the manual inspection; removes `partition`,
+        so the checkback leaves the `partition_time` index and can't be claimed anymore
+        """
+        await self.client.run(
+            self.CheckBacks.update_item,
+            Key={
+                'id': checkback['id']
+            },
+            UpdateExpression="SET dead = :t, attempts = if_not_exists(attempts, :zero) + :one, last_error = :e "
+                             "REMOVE #prt, claimed_until, claimed_by",
+            ExpressionAttributeNames={
+                "#prt": "partition"
+            },
+            ExpressionAttributeValues={
+                ":t": True,
+                ":zero": 0,
+                ":one": 1,
+                ":e": error
+            }
+        )
+
+    # Leases
+    async def acquire_lease(self, name: str, owner: str, duration: datetime.timedelta) -> bool:
+        """Takes (or prolongs) lease `name` for the `owner`, if it's free, expired or already theirs"""
+        now = self.now()
+        try:
+            await self.client.run(
+                self.Leases.put_item,
+                Item={
+                    "name": name,
+                    "owner": owner,
+                    "expires_at": (now + duration).isoformat()
+                },
+                # Hide from reserved db keywords
+                ExpressionAttributeNames={
+                    "#nm": "name",
+                    "#ownr": "owner"
+                },
+                ExpressionAttributeValues={
+                    ":now": now.isoformat(),
+                    ":owner": owner
+                },
+                ConditionExpression="attribute_not_exists(#nm) OR expires_at < :now OR #ownr = :owner"
+            )
+        except ClientError as e:
+            # Somebody else holds the lease
+            if e.response['Error']['Code'] == "ConditionalCheckFailedException":
+                return False
+            raise
+        return True
+
+    async def get_lease(self, name: str) -> Optional[LeaseItem]:
+        try:
+            response = await self.client.run(
+                self.Leases.get_item,
+                Key={
+                    'name': name
+                }
+            )
+        except ClientError as e:
+            logging.exception(e.response['Error']['Message'])
+        else:
+            return response.get('Item')
+
+    async def release_lease(self, name: str, owner: str):
+        """Gives lease `name` away, if it's still held by the `owner`"""
+        try:
+            await self.client.run(
+                self.Leases.delete_item,
+                Key={
+                    'name': name
+                },
+                ExpressionAttributeNames={
+                    "#ownr": "owner"
+                },
+                ExpressionAttributeValues={
+                    ":owner": owner
+                },
+                ConditionExpression="#ownr = :owner"
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != "ConditionalCheckFailedException":
+                raise
+
+    # Outbound messages (failed deliveries to the frontends)
+    async def create_outbound(self, service: str, context: dict, error: str, retry_in: datetime.timedelta):
+        """Saves message that couldn't be delivered to the frontend for the later retry"""
+        now = self.now()
+        await self.client.run(
+            self.OutboundMessages.put_item,
             Item={
                 "id": str(uuid.uuid4()),
-                "server_mac": str(uuid.getnode()),
-                "identity": context['user']['identity'],
-                "context": json.dumps(context, default=custom_default),
-                "send_at": (self.now() + send_in).isoformat()
+                "service": service,
+                "context": codec.dumps(context),
+                "status": OutboundStatus.PENDING,
+                "attempts": 1,
+                "last_error": error,
+                "created_at": now.isoformat(),
+                "next_attempt_at": (now + retry_in).isoformat()
+            }
+        )
+
+    async def iter_due_outbound(self) -> AsyncGenerator[OutboundMessage, None]:
+        """
+        Yields pending outbound messages, whose next attempt is due. Reads only them: dead-lettered messages
+        aren't in the `status_next_attempt` index (it's sparse on `next_attempt_at`).
+        """
+        now = self.now().isoformat()
+        kwargs = {
+            "IndexName": "status_next_attempt",
+            "KeyConditionExpression": Key("status").eq(OutboundStatus.PENDING) & Key("next_attempt_at").lte(now)
+        }
+        read = self.OutboundMessages.query
+        while True:
+            try:
+                response = await self.client.run(read, **kwargs)
+            except ClientError as e:
+                if e.response['Error']['Code'] != "ValidationException" or "IndexName" not in kwargs:
+                    raise
+                # @Important: index isn't added yet (`python -m db.migrate`) or is still being built
+                logging.warning(f"OutboundMessages index isn't ready, scanning the table: {e}")
+                read = self.OutboundMessages.scan
+                kwargs = {
+                    "FilterExpression": Attr("status").eq(OutboundStatus.PENDING) & Attr("next_attempt_at").lte(now)
+                }
+                continue
+            for each_message in response['Items']:
+                yield each_message
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs["ExclusiveStartKey"] = response['LastEvaluatedKey']
+
+    async def reschedule_outbound(self, item: OutboundMessage, error: str, retry_in: datetime.timedelta):
+        await self.client.run(
+            self.OutboundMessages.update_item,
+            Key={
+                'id': item['id']
+            },
+            UpdateExpression="SET attempts = attempts + :one, last_error = :e, next_attempt_at = :n",
+            ExpressionAttributeValues={
+                ":one": 1,
+                ":e": error,
+                ":n": (self.now() + retry_in).isoformat()
             }
         )
 
-    async def all_checkbacks_in_range(self, now: datetime.datetime, until: datetime.datetime):
-        # TODO: @Important: query is limited to 1MB, so need to move to pagination eventually 
-        response = self.CheckBacks.query(
-            IndexName="time",
-            ProjectionExpression="id, server_mac, send_at, context, #idtt",
+    async def dead_letter_outbound(self, item: OutboundMessage, error: str):
+        """
+        Gives up on the message, it stays in the table for the manual inspection for `OUTBOUND_DEAD_LETTER_DAYS`,
+        then DynamoDB deletes it (time to live). Without `next_attempt_at` it's out of the retry loop's index.
+        """
+        expires_at = self.now() + datetime.timedelta(days=OUTBOUND_DEAD_LETTER_DAYS)
+        await self.client.run(
+            self.OutboundMessages.update_item,
+            Key={
+                'id': item['id']
+            },
+            UpdateExpression="SET #st = :s, attempts = attempts + :one, last_error = :e, #exp = :exp "
+                             "REMOVE next_attempt_at",
             # Hide from reserved db keywords
             ExpressionAttributeNames={
-                "#idtt": "identity"
+                "#st": "status",
+                "#exp": OUTBOUND_TIME_TO_LIVE
             },
-            KeyConditionExpression=Key("server_mac").eq(self.mac) & Key("send_at").between(now.isoformat(),
-                                                                                           until.isoformat())
+            ExpressionAttributeValues={
+                ":s": OutboundStatus.DEAD,
+                ":one": 1,
+                ":e": error,
+                ":exp": int(expires_at.timestamp())
+            }
+        )
+
+    async def remove_outbound(self, item: OutboundMessage):
+        await self.client.run(
+            self.OutboundMessages.delete_item,
+            Key={
+                'id': item['id']
+            }
         )
-        # TODO: 1) Remove old checkbacks, BUT only after 1 hour or so (see 2)
-        # TODO: 2) Eventually (after 10-45 minutes, *randomly*) look for checkbacks,
-        # TODO:    that are not sent, from all possible server_mac addresses; 
-        # TODO:    basically if one server dies -> others should pick up checkback 
-        # TODO:    requests and manage them; why *randomly*, to avoid different servers
-        # TODO:    querying at exact same minute -> for that also probably worth to add
-        # TODO:    "was_sent" bool to the structure.
-        return response['Count'], response['Items']
 
     # Sessions
     async def create_session(self, item: Session):
         """Creates Session  item in the according table"""
-        self.Sessions.put_item(
+        await self.client.run(
+            self.Sessions.put_item,
             Item=item
         )
+        self.session_reads.forget(item)
+
+    async def update_session_bulk(self, instance_name: str, bulk: bool):
+        await self.client.run(
+            self.Sessions.update_item,
+            Key={
+                'name': instance_name
+            },
+            UpdateExpression="SET bulk = :b",
+            ExpressionAttributeValues={
+                ':b': bulk
+            }
+        )
+        self.session_reads.forget({'name': instance_name})
 
     async def get_session(self, instance_name: str) -> Optional[Session]:
         """Returns User item by the user identity"""
         try:
-            response = self.Sessions.get_item(
-                Key={
-                    'name': instance_name
-                }
-            )
+            item = await self.session_reads.get({'name': instance_name})
         except ClientError as e:
-            # TODO: @Important: Change all prints to logger.info or .error
-            # Print Error Message and return None
-            print(e.response['Error']['Message'])
+            self._error('Sessions', 'batch_get_item', e)
         else:
             # If not exist -> return None
-            if not response.get('Item'):
+            if not item:
                 return
             # Return just item
-            return response['Item']
+            return item
 
     async def all_frontend_sessions(self):
-        response = self.Sessions.scan()
-        return response['Items']
+        response = await self.client.run(self.Sessions.scan)
+        items = response['Items']
+        while 'LastEvaluatedKey' in response:
+            response = await self.client.run(self.Sessions.scan, ExclusiveStartKey=response['LastEvaluatedKey'])
+            items.extend(response['Items'])
+        return items
 
     async def create_broadcast(self, context: Context):
-        self.BroadcastMessages.put_item(
+        await self.client.run(
+            self.BroadcastMessages.put_item,
             Item={
                 "id": str(uuid.uuid4()),
-                "context": json.dumps(context.__dict__['request'], default=custom_default)
+                "context": codec.dumps(context.__dict__['request'])
             }
         )
 
     async def all_new_broadcasts(self):
-        response = self.BroadcastMessages.scan()
+        response = await self.client.run(self.BroadcastMessages.scan)
         return response['Count'], response['Items']
 
     async def remove_broadcast(self, item: BroadcastMessage):
-        self.BroadcastMessages.delete_item(
+        await self.client.run(
+            self.BroadcastMessages.delete_item,
             Key={
                 'id': item['id']
             }
@@ -378,31 +918,28 @@ class Database:
     # Translation
 
     async def create_translation(self, item: StringItem):
-        self.StringItems.put_item(
+        await self.client.run(
+            self.StringItems.put_item,
             Item=item
         )
+        self.translation_reads.forget(item)
 
     async def get_translation(self, lang: str, key: str):
         """Returns User item by the user identity"""
         try:
-            response = self.StringItems.get_item(
-                Key={
-                    'language': lang,
-                    'string_key': key
-                }
-            )
+            item = await self.translation_reads.get({'language': lang, 'string_key': key})
         except ClientError as e:
             # Print Error Message and return None
             logging.exception(e.response['Error']['Message'])
         else:
             # If not exist -> return None
-            if not response.get('Item'):
+            if not item:
                 return
             # Return just item
-            return response['Item']
+            return item
 
     async def query_translations(self, lang: str, keys: Iterable[str]) -> List[StringItem]:
-        # A hack for the lack of better way
+        # Reads of the same loop iteration, so they go out as BatchGetItem requests (see `BatchReader`)
         query = await asyncio.gather(*[self.get_translation(lang, key) for key in keys])
         return query
 
@@ -410,11 +947,11 @@ class Database:
         await asyncio.gather(*[self.create_translation(item) for item in items])
 
     async def iter_all_translation(self) -> AsyncGenerator[StringItem, None]:
-        response = self.StringItems.scan()
+        response = await self.client.run(self.StringItems.scan)
         for each_translation in response['Items']:
             yield each_translation
 
         while 'LastEvaluatedKey' in response:
-            response = self.StringItems.scan(ExclusiveStartKey=response['LastEvaluatedKey'])
+            response = await self.client.run(self.StringItems.scan, ExclusiveStartKey=response['LastEvaluatedKey'])
             for each_translation in response['Items']:
                 yield each_translation
@@ -17,3 +17,8 @@ class ServiceTypes:
     TELEGRAM = "telegram"
     FACEBOOK = "facebook"
     WEBSITE = "website"
+
+
+class OutboundStatus:
+    PENDING = "pending"
+    DEAD = "dead"
@@ -0,0 +1,71 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+import functools
+import asyncio
+import os
+
+
+class DatabaseExecutor(object):
+    """
+    Runs blocking boto3 calls in a dedicated, bounded pool of threads, so the event loop keeps serving
+    other users (and the reminder, broadcast loops) while a request to the database is in flight.
+
+    The pool is separate from the default executor (used by translation, file io), so a slow database
+    can't starve them and vice versa. Calls over `size` wait for a free thread, the http connection
+    pool of boto3 should be of the same size (see `Database.__init__`), otherwise threads wait for
+    a connection instead.
+
+    @Important: threads don't survive `fork` (sanic starts its workers after `Database` was used on
+    @Important: import), so the pool is created on first use in each process
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._pool = None
+        self._pid = None
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        if self._pid != os.getpid():
+            # Pool of the parent process (if any) has no threads here
+            self._pool = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="dynamodb")
+            self._pid = os.getpid()
+            self.in_flight = 0
+        return self._pool
+
+    async def run(self, method: Callable, *args, **kwargs):
+        """Calls `method(*args, **kwargs)` in the pool, returns its result (or raises its exception)"""
+        pool = self.pool
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return await asyncio.get_event_loop().run_in_executor(
+                pool, functools.partial(method, *args, **kwargs)
+            )
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+    def metrics(self) -> dict:
+        return {
+            "size": self.size,
+            "calls": self.calls,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            # Calls waiting for a free thread
+            "waiting": max(self.in_flight - self.size, 0),
+            "max_in_flight": self.max_in_flight
+        }
+
+    def shutdown(self):
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.shutdown(wait=False)
+            self._pool = None
+            self._pid = None
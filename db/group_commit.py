@@ -0,0 +1,147 @@
+from typing import Awaitable, Callable, Dict, Optional
+from collections import OrderedDict, Counter
+from .throttling import ThrottledClient
+import logging
+import asyncio
+import random
+
+
+class GroupCommit(object):
+    """
+    Puts of the items of one table, gathered from the concurrent handlers over `window` seconds and
+    written together with `BatchWriteItem` (up to 25 items per request).
+
+    `put` returns once the item is durable (the batch reported it processed), or raises the error of
+    its batch. Unprocessed items (the table is throttled) are retried with jittered exponential
+    backoff. Puts of the same key in one window are merged, the last one is written. An item whose
+    previous write is still in flight waits for the next window, so writes of a key keep their order.
+    """
+    BATCH_SIZE = 25
+
+    def __init__(self, client: ThrottledClient, batch_write_item: Callable, table_name: str, key_name: str,
+                 window: float, max_retries: int = 8, backoff: float = 0.05,
+                 sleep: Callable[[float], Awaitable] = asyncio.sleep):
+        """
+        Args:
+            client (ThrottledClient): runs the requests
+            batch_write_item (Callable): `batch_write_item` of the boto3 resource
+            table_name (str): table the items go to
+            key_name (str): hash key of the table
+            window (float): seconds the puts are gathered for (0 - only puts of the same loop iteration)
+            max_retries (int): attempts to write unprocessed items, before their puts fail
+            backoff (float): base delay between the attempts, seconds
+        """
+        self.client = client
+        self.batch_write_item = batch_write_item
+        self.table_name = table_name
+        self.key_name = key_name
+        self.window = window
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.sleep = sleep
+        # key -> (item, future shared by the merged puts)
+        self.pending: "OrderedDict[str, tuple]" = OrderedDict()
+        # key -> future of the batch the key is written with
+        self.in_flight: Dict[str, asyncio.Future] = dict()
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.stats = Counter()
+
+    async def put(self, item: dict):
+        key = item[self.key_name]
+        self.stats['puts'] += 1
+        if key in self.pending:
+            self.stats['merged'] += 1
+            future = self.pending[key][1]
+        else:
+            future = asyncio.get_event_loop().create_future()
+        self.pending[key] = (item, future)
+        if len(self.pending) >= self.BATCH_SIZE:
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_event_loop().call_later(self.window, self.flush)
+        # @Important: cancelled caller doesn't cancel the write of the others merged with it
+        await asyncio.shield(future)
+
+    async def wait(self, key: str):
+        """Waits till the put of the key (if any) is done, before the key is written some other way"""
+        while key in self.pending or key in self.in_flight:
+            future = self.pending[key][1] if key in self.pending else self.in_flight[key]
+            try:
+                await asyncio.shield(future)
+            except Exception:
+                pass
+
+    def flush(self):
+        """Sends the gathered items right away"""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, waiting = list(), OrderedDict()
+        for key, (item, future) in self.pending.items():
+            if key in self.in_flight:
+                waiting[key] = (item, future)
+                continue
+            batch.append((key, item, future))
+            if len(batch) == self.BATCH_SIZE:
+                asyncio.ensure_future(self.write(batch))
+                batch = list()
+        if batch:
+            asyncio.ensure_future(self.write(batch))
+        self.pending = waiting
+        if waiting:
+            self.timer = asyncio.get_event_loop().call_later(self.window, self.flush)
+
+    async def drain(self):
+        """Writes everything gathered so far (before shutdown)"""
+        self.flush()
+        for key in list(self.pending) + list(self.in_flight):
+            await self.wait(key)
+
+    async def write(self, batch: list):
+        remaining = {key: (item, future) for key, item, future in batch}
+        for key, (_, future) in remaining.items():
+            self.in_flight[key] = future
+        self.stats['batches'] += 1
+        attempt = 0
+        try:
+            while remaining:
+                response = await self.client.run(
+                    self.batch_write_item,
+                    RequestItems={
+                        self.table_name: [{'PutRequest': {'Item': item}} for item, _ in remaining.values()]
+                    }
+                )
+                self.stats['requests'] += 1
+                unprocessed = {request['PutRequest']['Item'][self.key_name]
+                               for request in response.get('UnprocessedItems', {}).get(self.table_name, [])}
+                for key in list(remaining):
+                    if key not in unprocessed:
+                        self.done(key, remaining.pop(key)[1])
+                if not remaining:
+                    break
+                attempt += 1
+                self.stats['unprocessed'] += len(remaining)
+                if attempt > self.max_retries:
+                    raise RuntimeError(f"{len(remaining)} items weren't written to {self.table_name} "
+                                       f"after {self.max_retries} retries")
+                # Full jitter, so the throttled processes don't retry in lockstep
+                await self.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+        except Exception as e:
+            logging.exception(e)
+            self.stats['failed'] += len(remaining)
+            for key, (_, future) in remaining.items():
+                self.done(key, future, e)
+
+    def done(self, key: str, future: asyncio.Future, error: Exception = None):
+        if self.in_flight.get(key) is future:
+            del self.in_flight[key]
+        if future.done():
+            return
+        if error is None:
+            self.stats['written'] += 1
+            future.set_result(None)
+        else:
+            future.set_exception(error)
+
+    def metrics(self) -> dict:
+        return {**self.stats, "pending": len(self.pending), "in_flight": len(self.in_flight)}
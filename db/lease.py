@@ -0,0 +1,113 @@
+from typing import Awaitable, Callable, Dict, Tuple
+import datetime
+import asyncio
+import logging
+import random
+import time
+import uuid
+import os
+
+
+def default_owner() -> str:
+    """Unique name of the current process (mac address + pid + random part)"""
+    return f"{uuid.getnode()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+class Lease(object):
+    """
+    Exclusive, time limited right to do something (e.g. run periodic job) in the cluster.
+
+    Holder has to call `acquire` again before `duration` runs out to keep the lease,
+    otherwise any other process can take it over.
+    """
+
+    def __init__(self, name: str, owner: str = None, duration: float = 30):
+        self.name = name
+        self.owner = owner or default_owner()
+        self.duration = duration
+
+    async def acquire(self) -> bool:
+        """Takes or prolongs the lease, returns True if the lease is held by this owner now"""
+        raise NotImplementedError
+
+    async def release(self):
+        """Gives lease away, so another process doesn't have to wait until it expires"""
+        raise NotImplementedError
+
+
+class DatabaseLease(Lease):
+    """Lease kept in the `Leases` table, with conditional writes, works across nodes"""
+
+    def __init__(self, db, name: str, owner: str = None, duration: float = 30):
+        super().__init__(name, owner, duration)
+        self.db = db
+        self.held = False
+
+    async def acquire(self) -> bool:
+        # @Important: a read is cheaper than a failed conditional write, so
+        # @Important: processes that wait for the lease only try to write when it's free
+        if not self.held:
+            item = await self.db.get_lease(self.name)
+            if item and item['owner'] != self.owner and item['expires_at'] >= self.db.now().isoformat():
+                return False
+        self.held = await self.db.acquire_lease(self.name, self.owner, datetime.timedelta(seconds=self.duration))
+        return self.held
+
+    async def release(self):
+        self.held = False
+        await self.db.release_lease(self.name, self.owner)
+
+
+class LocalLease(Lease):
+    """Lease kept in memory, for a single process setup (development, tests)"""
+    # name -> (owner, expires_at)
+    holders: Dict[str, Tuple[str, float]] = dict()
+
+    async def acquire(self) -> bool:
+        now = time.monotonic()
+        owner, expires_at = self.holders.get(self.name, (None, 0))
+        if owner is not None and owner != self.owner and expires_at > now:
+            return False
+        self.holders[self.name] = (self.owner, now + self.duration)
+        return True
+
+    async def release(self):
+        owner, _ = self.holders.get(self.name, (None, 0))
+        if owner == self.owner:
+            del self.holders[self.name]
+
+
+async def run_with_lease(lease: Lease, job: Callable[[], Awaitable]):
+    """
+    Runs `job()` only while `lease` is held by this process.
+
+    The lease is renewed three times per its duration. When it can't be renewed (taken over,
+    database unavailable) the job is cancelled; when the holder dies, another process running
+    the same coroutine takes over in at most ~5/3 of the lease duration. Processes that wait
+    for the lease retry at random moments, so many leases spread over the processes.
+    """
+    task = None
+    interval = lease.duration / 3
+    try:
+        while True:
+            try:
+                is_leader = await lease.acquire()
+            except Exception as e:
+                logging.exception(f"Failed to renew lease {lease.name}: {e}")
+                is_leader = False
+
+            if is_leader and (task is None or task.done()):
+                logging.info(f"Lease {lease.name} acquired by {lease.owner}")
+                task = asyncio.ensure_future(job())
+            elif not is_leader and task is not None:
+                logging.info(f"Lease {lease.name} lost by {lease.owner}")
+                task.cancel()
+                task = None
+            await asyncio.sleep(interval if is_leader else random.uniform(interval, 2 * interval))
+    finally:
+        if task is not None:
+            task.cancel()
+            try:
+                await lease.release()
+            except Exception as e:
+                logging.exception(f"Failed to release lease {lease.name}: {e}")
@@ -0,0 +1,883 @@
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from boto3.dynamodb.types import TypeSerializer, TypeDeserializer
+from botocore.exceptions import ClientError
+from typing import Callable, Dict, List, Optional
+from decimal import Decimal
+import threading
+import sqlite3
+import bisect
+import copy
+import json
+import re
+
+
+# Attribute that isn't in the item
+MISSING = object()
+
+TOKEN = re.compile(r"\s*(?:(#\w+)|(:\w+)|(\d+)|([A-Za-z_]\w*)|(<>|<=|>=|[=<>()\[\],.+-]))")
+CLAUSES = {"SET", "REMOVE", "ADD", "DELETE"}
+
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+
+
+def error(code: str, message: str, operation: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": message}}, operation)
+
+
+def normalize(value):
+    """Converts value the way boto3 does on the way to DynamoDB and back (int -> Decimal, no floats, ...)"""
+    return deserializer.deserialize(serializer.serialize(value))
+
+
+def type_of(value) -> Optional[str]:
+    if value is MISSING:
+        return None
+    if isinstance(value, bool):
+        return "BOOL"
+    if value is None:
+        return "NULL"
+    if isinstance(value, Decimal):
+        return "N"
+    if isinstance(value, str):
+        return "S"
+    if isinstance(value, (bytes, bytearray)):
+        return "B"
+    if isinstance(value, dict):
+        return "M"
+    if isinstance(value, list):
+        return "L"
+    if isinstance(value, set):
+        # Set type is defined by its elements (SS, NS, BS)
+        return type_of(next(iter(value))) + "S" if value else "SS"
+    return type(value).__name__
+
+
+def get_path(item, path: tuple):
+    for part in path:
+        if isinstance(part, int):
+            if not isinstance(item, list) or part >= len(item):
+                return MISSING
+        elif not isinstance(item, dict) or part not in item:
+            return MISSING
+        item = item[part]
+    return item
+
+
+def set_path(item: dict, path: tuple, value):
+    parent = get_path(item, path[:-1])
+    part = path[-1]
+    if isinstance(part, int) and isinstance(parent, list):
+        if part < len(parent):
+            parent[part] = value
+        else:
+            parent.append(value)
+    elif isinstance(part, str) and isinstance(parent, dict):
+        parent[part] = value
+    else:
+        raise ValueError("The document path provided in the update expression is invalid for update")
+
+
+def remove_path(item: dict, path: tuple):
+    parent = get_path(item, path[:-1])
+    part = path[-1]
+    if isinstance(part, int) and isinstance(parent, list) and part < len(parent):
+        del parent[part]
+    elif isinstance(part, str) and isinstance(parent, dict):
+        parent.pop(part, None)
+
+
+def project(item: dict, paths: List[tuple]) -> dict:
+    """Copies only `paths` of the item, keeping their nesting"""
+    result = dict()
+    for path in paths:
+        value = get_path(item, path)
+        if value is MISSING:
+            continue
+        target = result
+        for part, next_part in zip(path, path[1:]):
+            default = list() if isinstance(next_part, int) else dict()
+            if isinstance(target, list):
+                target.append(default)
+                target = target[-1]
+            else:
+                target = target.setdefault(part, default)
+        if isinstance(target, list):
+            target.append(copy.deepcopy(value))
+        else:
+            target[path[-1]] = copy.deepcopy(value)
+    return result
+
+
+def equal(a, b) -> bool:
+    return a is not MISSING and b is not MISSING and type_of(a) == type_of(b) and a == b
+
+
+def compare(operator: str, a, b) -> bool:
+    if operator == "=":
+        return equal(a, b)
+    if operator == "<>":
+        return not equal(a, b)
+    # Only scalars of the same type are ordered
+    if type_of(a) != type_of(b) or type_of(a) not in ("N", "S", "B"):
+        return False
+    if operator == "<":
+        return a < b
+    if operator == "<=":
+        return a <= b
+    if operator == ">":
+        return a > b
+    return a >= b
+
+
+def contains(value, operand) -> bool:
+    if isinstance(value, str):
+        return isinstance(operand, str) and operand in value
+    if isinstance(value, (bytes, bytearray)):
+        return isinstance(operand, (bytes, bytearray)) and operand in value
+    if isinstance(value, set):
+        return operand in value
+    if isinstance(value, list):
+        return any(equal(element, operand) for element in value)
+    return False
+
+
+class Expression(object):
+    """
+    Parser of the DynamoDB expression syntax (condition, key condition, filter, update, projection).
+
+    Conditions compile into `item -> bool`, update into `item -> updated paths`. Equalities of the
+    condition are kept in `equalities` (path -> value), key conditions are looked up with them.
+    """
+
+    def __init__(self, text: str, names: Optional[dict], values: Optional[dict]):
+        self.tokens = list()
+        position = 0
+        text = text.strip()
+        while position < len(text):
+            match = TOKEN.match(text, position)
+            if match is None or match.end() == position:
+                raise ValueError(f"Invalid expression: {text!r} at {position}")
+            self.tokens.append(next(token for token in match.groups() if token is not None))
+            position = match.end()
+        self.position = 0
+        self.names = names or dict()
+        self.values = values or dict()
+        self.equalities = dict()
+
+    @classmethod
+    def build(cls, expression, names: Optional[dict], values: Optional[dict], builder: ConditionExpressionBuilder,
+              is_key_condition: bool = False) -> "Expression":
+        """Expression from a string or boto3 condition (`Attr`, `Key`), same as boto3 does before sending it"""
+        if isinstance(expression, ConditionBase):
+            built = builder.build_expression(expression, is_key_condition=is_key_condition)
+            expression = built.condition_expression
+            names = {**(names or {}), **built.attribute_name_placeholders}
+            values = {**(values or {}), **{key: normalize(value)
+                                           for key, value in built.attribute_value_placeholders.items()}}
+        return cls(expression, names, values)
+
+    # Tokens
+
+    def peek(self, offset: int = 0) -> Optional[str]:
+        if self.position + offset < len(self.tokens):
+            return self.tokens[self.position + offset]
+
+    def take(self, expected: str = None) -> str:
+        token = self.peek()
+        if token is None or (expected is not None and token.upper() != expected):
+            raise ValueError(f"Invalid expression: expected {expected or 'more'}, got {token}")
+        self.position += 1
+        return token
+
+    def keyword(self, *words: str) -> bool:
+        token = self.peek()
+        return token is not None and token.upper() in words
+
+    def done(self):
+        if self.peek() is not None:
+            raise ValueError(f"Invalid expression: unexpected {self.peek()}")
+
+    # Operands
+
+    def path(self) -> tuple:
+        token = self.take()
+        parts = [self.names[token] if token.startswith("#") else token]
+        while self.peek() in (".", "["):
+            if self.take() == ".":
+                token = self.take()
+                parts.append(self.names[token] if token.startswith("#") else token)
+            else:
+                parts.append(int(self.take()))
+                self.take("]")
+        return tuple(parts)
+
+    def value(self) -> Callable:
+        token = self.peek()
+        if token.startswith(":"):
+            self.take()
+            value = self.values[token]
+            return lambda item: value
+        if token.lower() == "size" and self.peek(1) == "(":
+            self.take()
+            self.take("(")
+            path = self.path()
+            self.take(")")
+
+            def size(item):
+                value = get_path(item, path)
+                if isinstance(value, (str, bytes, bytearray, list, dict, set)):
+                    return Decimal(len(value))
+                return MISSING
+            return size
+        path = self.path()
+        return lambda item: get_path(item, path)
+
+    # Conditions
+
+    def condition(self) -> Callable[[dict], bool]:
+        result = self.conjunction()
+        while self.keyword("OR"):
+            self.take()
+            left, right = result, self.conjunction()
+            result = lambda item, left=left, right=right: left(item) or right(item)
+        return result
+
+    def conjunction(self) -> Callable[[dict], bool]:
+        result = self.negation()
+        while self.keyword("AND"):
+            self.take()
+            left, right = result, self.negation()
+            result = lambda item, left=left, right=right: left(item) and right(item)
+        return result
+
+    def negation(self) -> Callable[[dict], bool]:
+        if self.keyword("NOT"):
+            self.take()
+            inner = self.negation()
+            return lambda item: not inner(item)
+        return self.predicate()
+
+    def predicate(self) -> Callable[[dict], bool]:
+        if self.peek() == "(":
+            self.take()
+            inner = self.condition()
+            self.take(")")
+            return inner
+        function = self.peek().lower()
+        if self.peek(1) == "(" and function in ("attribute_exists", "attribute_not_exists", "attribute_type",
+                                                "begins_with", "contains"):
+            self.take()
+            self.take("(")
+            path = self.path()
+            operand = None
+            if function not in ("attribute_exists", "attribute_not_exists"):
+                self.take(",")
+                operand = self.value()
+            self.take(")")
+            if function == "attribute_exists":
+                return lambda item: get_path(item, path) is not MISSING
+            if function == "attribute_not_exists":
+                return lambda item: get_path(item, path) is MISSING
+            if function == "attribute_type":
+                return lambda item: type_of(get_path(item, path)) == operand(item)
+            if function == "begins_with":
+                def begins_with(item):
+                    value, prefix = get_path(item, path), operand(item)
+                    return type_of(value) in ("S", "B") and type_of(value) == type_of(prefix) and value.startswith(prefix)
+                return begins_with
+            return lambda item: contains(get_path(item, path), operand(item))
+
+        start = self.position
+        left = self.value()
+        single_name = self.position - start == 1 and not self.tokens[start].startswith(":")
+        if self.keyword("BETWEEN"):
+            self.take()
+            low = self.value()
+            self.take("AND")
+            high = self.value()
+            return lambda item: compare(">=", left(item), low(item)) and compare("<=", left(item), high(item))
+        if self.keyword("IN"):
+            self.take()
+            self.take("(")
+            options = [self.value()]
+            while self.peek() == ",":
+                self.take()
+                options.append(self.value())
+            self.take(")")
+            return lambda item: any(equal(left(item), option(item)) for option in options)
+        operator = self.take()
+        if operator not in ("=", "<>", "<", "<=", ">", ">="):
+            raise ValueError(f"Invalid expression: unknown operator {operator}")
+        token = self.peek()
+        right = self.value()
+        if operator == "=" and single_name and token.startswith(":"):
+            name = self.tokens[start]
+            self.equalities[self.names.get(name, name)] = self.values[token]
+        return lambda item: compare(operator, left(item), right(item))
+
+    def compile_condition(self) -> Callable[[dict], bool]:
+        result = self.condition()
+        self.done()
+        return result
+
+    def key_value(self, name: str):
+        """Value the attribute `name` is required to be equal to by the (key) condition"""
+        return self.equalities.get(name, MISSING)
+
+    # Updates
+
+    def operand(self) -> Callable:
+        function = self.peek().lower()
+        if self.peek(1) == "(" and function in ("if_not_exists", "list_append"):
+            self.take()
+            self.take("(")
+            if function == "if_not_exists":
+                path = self.path()
+                self.take(",")
+                default = self.update_value()
+                self.take(")")
+
+                def if_not_exists(item):
+                    value = get_path(item, path)
+                    return default(item) if value is MISSING else value
+                return if_not_exists
+            first = self.update_value()
+            self.take(",")
+            second = self.update_value()
+            self.take(")")
+
+            def list_append(item):
+                a, b = first(item), second(item)
+                if not isinstance(a, list) or not isinstance(b, list):
+                    raise ValueError("An operand in the update expression has an incorrect data type")
+                return a + b
+            return list_append
+        return self.value()
+
+    def update_value(self) -> Callable:
+        left = self.operand()
+        if self.peek() in ("+", "-"):
+            sign = self.take()
+            right = self.operand()
+
+            def arithmetic(item):
+                a, b = left(item), right(item)
+                if type_of(a) != "N" or type_of(b) != "N":
+                    raise ValueError("An operand in the update expression has an incorrect data type")
+                return a + b if sign == "+" else a - b
+            return arithmetic
+        return left
+
+    def compile_update(self) -> Callable[[dict], List[tuple]]:
+        """Function that applies the update to the item (in place) and returns the updated paths"""
+        actions = list()
+        while self.peek() is not None:
+            clause = self.take().upper()
+            if clause not in CLAUSES:
+                raise ValueError(f"Invalid update expression: unknown clause {clause}")
+            while True:
+                path = self.path()
+                if clause == "SET":
+                    self.take("=")
+                    actions.append((clause, path, self.update_value()))
+                elif clause == "REMOVE":
+                    actions.append((clause, path, None))
+                else:
+                    actions.append((clause, path, self.value()))
+                if self.peek() != ",":
+                    break
+                self.take()
+
+        def apply(item: dict) -> List[tuple]:
+            # @Important: all values are evaluated against the item before the update
+            values = [function(item) if function is not None else None for _, _, function in actions]
+            # Indexes of the same list are removed from the end, so they don't shift
+            removals = sorted((path for clause, path, _ in actions if clause == "REMOVE"), reverse=True,
+                              key=lambda path: [(0, part) if isinstance(part, int) else (1, part) for part in path])
+            for (clause, path, _), value in zip(actions, values):
+                if clause == "SET":
+                    set_path(item, path, value)
+                elif clause == "ADD":
+                    current = get_path(item, path)
+                    if current is MISSING:
+                        set_path(item, path, value)
+                    elif isinstance(current, set):
+                        current |= value
+                    else:
+                        set_path(item, path, current + value)
+                elif clause == "DELETE":
+                    current = get_path(item, path)
+                    if isinstance(current, set):
+                        current -= value
+                        if not current:
+                            remove_path(item, path)
+            for path in removals:
+                remove_path(item, path)
+            return [path for _, path, _ in actions]
+        return apply
+
+    # Projection
+
+    def compile_projection(self) -> List[tuple]:
+        paths = [self.path()]
+        while self.peek() == ",":
+            self.take()
+            paths.append(self.path())
+        self.done()
+        return paths
+
+
+class MemoryIndex(object):
+    """Key schema and sorted keys of the table (or of its global secondary index)"""
+
+    def __init__(self, key_names: List[str], projection: Optional[dict] = None, description: dict = None):
+        self.key_names = key_names
+        # None - all attributes
+        self.projection = projection
+        self.description = description
+        # Sorted tuples of (index key values..., table key values...)
+        self.entries = list()
+
+    def entry_names(self, table_keys: List[str]) -> List[str]:
+        return self.key_names + [name for name in table_keys if name not in self.key_names]
+
+    def entry(self, item: dict, table_keys: List[str]) -> Optional[tuple]:
+        # @Important: index is sparse, items without its keys aren't in it
+        if any(name not in item for name in self.key_names):
+            return
+        return tuple(item[name] for name in self.entry_names(table_keys))
+
+    def project(self, item: dict, table_keys: List[str]) -> dict:
+        if self.projection is None:
+            return copy.deepcopy(item)
+        names = set(table_keys) | set(self.key_names) | self.projection
+        return {name: copy.deepcopy(value) for name, value in item.items() if name in names}
+
+
+class MemoryTable(object):
+    """
+    DynamoDB table kept in memory, with the subset of the boto3 `Table` api the `Database` uses:
+    put/get/update/delete_item, query (also of the global secondary indexes), scan, with conditions,
+    filters and projections either as strings or `Attr`/`Key` conditions.
+    """
+
+    def __init__(self, resource: "MemoryDynamoDB", name: str, key_schema: List[dict], attributes: List[dict],
+                 indexes: List[dict] = None):
+        self.resource = resource
+        self.name = name
+        self.table_status = "ACTIVE"
+        # Attribute of the time to live, only recorded: expired items aren't deleted
+        self.time_to_live: Optional[str] = None
+        self.lock = resource.lock
+        self.key_names = [key['AttributeName'] for key in sorted(key_schema, key=lambda key: key['KeyType'] != 'HASH')]
+        self.attribute_types = dict()
+        self.items: Dict[tuple, dict] = dict()
+        self.primary = MemoryIndex(self.key_names)
+        self.indexes: Dict[str, MemoryIndex] = dict()
+        self.add_attributes(attributes)
+        for index in indexes or []:
+            self.add_index(index)
+
+    @property
+    def global_secondary_indexes(self) -> Optional[List[dict]]:
+        return [{**index.description, "IndexStatus": "ACTIVE"} for index in self.indexes.values()] or None
+
+    # Schema
+
+    def add_attributes(self, attributes: List[dict]):
+        for attribute in attributes:
+            self.attribute_types[attribute['AttributeName']] = attribute['AttributeType']
+
+    def add_index(self, description: dict):
+        key_names = [key['AttributeName'] for key in sorted(description['KeySchema'],
+                                                            key=lambda key: key['KeyType'] != 'HASH')]
+        projection = description.get('Projection', {})
+        if projection.get('ProjectionType', 'ALL') == 'ALL':
+            projected = None
+        else:
+            projected = set(projection.get('NonKeyAttributes', []))
+        index = MemoryIndex(key_names, projected, description)
+        for item in self.items.values():
+            entry = index.entry(item, self.key_names)
+            if entry is not None:
+                index.entries.append(entry)
+        index.entries.sort()
+        self.indexes[description['IndexName']] = index
+
+    def describe(self) -> dict:
+        def size(items):
+            return sum(len(json.dumps(serializer.serialize(item))) for item in items)
+        description = {
+            "TableName": self.name,
+            "TableStatus": self.table_status,
+            "KeySchema": [{"AttributeName": name, "KeyType": key_type}
+                          for name, key_type in zip(self.key_names, ("HASH", "RANGE"))],
+            "AttributeDefinitions": [{"AttributeName": name, "AttributeType": type_}
+                                     for name, type_ in self.attribute_types.items()],
+            "ItemCount": len(self.items),
+            "TableSizeBytes": size(self.items.values())
+        }
+        if self.indexes:
+            description["GlobalSecondaryIndexes"] = [{
+                **index.description,
+                "IndexStatus": "ACTIVE",
+                "ItemCount": len(index.entries),
+                "IndexSizeBytes": size(index.project(self.items[self.table_key(index, entry)], self.key_names)
+                                       for entry in index.entries)
+            } for index in self.indexes.values()]
+        return description
+
+    # Helpers
+
+    def table_key(self, index: MemoryIndex, entry: tuple) -> tuple:
+        if index is self.primary:
+            return entry
+        entry = dict(zip(index.entry_names(self.key_names), entry))
+        return tuple(entry[name] for name in self.key_names)
+
+    def key(self, key: dict, operation: str = "GetItem") -> tuple:
+        if set(key) != set(self.key_names):
+            raise error("ValidationException", "The provided key element does not match the schema", operation)
+        return tuple(key[name] for name in self.key_names)
+
+    def validate(self, item: dict, operation: str):
+        for name, type_ in self.attribute_types.items():
+            if name in item and type_of(item[name]) != type_:
+                raise error("ValidationException", f"One or more parameter values were invalid: Type mismatch for "
+                                                   f"key {name} expected: {type_} actual: {type_of(item[name])}",
+                            operation)
+
+    def expression(self, expression, names, values, builder, operation: str, key: bool = False) -> Expression:
+        try:
+            return Expression.build(expression, names, values, builder, key)
+        except (ValueError, KeyError) as e:
+            raise error("ValidationException", f"Invalid expression: {e}", operation)
+
+    def check(self, item: Optional[dict], condition, names, values, operation: str):
+        if condition is None:
+            return
+        builder = ConditionExpressionBuilder()
+        expression = self.expression(condition, names, values and normalize(values), builder, operation)
+        if not expression.compile_condition()(item or {}):
+            raise error("ConditionalCheckFailedException", "The conditional request failed", operation)
+
+    def store(self, key: tuple, item: Optional[dict]):
+        """Replaces the item (None - deletes it), keeping the indexes and the storage in sync"""
+        old = self.items.get(key)
+        for index in [self.primary, *self.indexes.values()]:
+            if old is not None:
+                entry = index.entry(old, self.key_names)
+                if entry is not None:
+                    position = bisect.bisect_left(index.entries, entry)
+                    if position < len(index.entries) and index.entries[position] == entry:
+                        del index.entries[position]
+            if item is not None:
+                entry = index.entry(item, self.key_names)
+                if entry is not None:
+                    bisect.insort(index.entries, entry)
+        if item is None:
+            self.items.pop(key, None)
+        else:
+            self.items[key] = item
+        self.resource.persist(self.name, key, item)
+
+    # Items
+
+    def put_item(self, Item: dict, ConditionExpression=None, ExpressionAttributeNames: dict = None,
+                 ExpressionAttributeValues: dict = None, ReturnValues: str = "NONE", **kwargs) -> dict:
+        item = normalize(Item)
+        if any(name not in item for name in self.key_names):
+            raise error("ValidationException", "One of the required keys was not given a value", "PutItem")
+        self.validate(item, "PutItem")
+        key = tuple(item[name] for name in self.key_names)
+        with self.lock:
+            old = self.items.get(key)
+            self.check(old, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues, "PutItem")
+            self.store(key, item)
+        if ReturnValues == "ALL_OLD" and old is not None:
+            return {"Attributes": copy.deepcopy(old)}
+        return {}
+
+    def get_item(self, Key: dict, ProjectionExpression: str = None, ExpressionAttributeNames: dict = None,
+                 **kwargs) -> dict:
+        key = self.key(normalize(Key))
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return {}
+            if ProjectionExpression:
+                paths = self.expression(ProjectionExpression, ExpressionAttributeNames, None, None,
+                                        "GetItem").compile_projection()
+                return {"Item": project(item, paths)}
+            return {"Item": copy.deepcopy(item)}
+
+    def update_item(self, Key: dict, UpdateExpression: str = None, ConditionExpression=None,
+                    ExpressionAttributeNames: dict = None, ExpressionAttributeValues: dict = None,
+                    ReturnValues: str = "NONE", **kwargs) -> dict:
+        key_item = normalize(Key)
+        key = self.key(key_item, "UpdateItem")
+        values = ExpressionAttributeValues and normalize(ExpressionAttributeValues)
+        with self.lock:
+            old = self.items.get(key)
+            self.check(old, ConditionExpression, ExpressionAttributeNames, values, "UpdateItem")
+            # Update of the missing item creates it
+            item = copy.deepcopy(old) if old is not None else dict(key_item)
+            paths = list()
+            if UpdateExpression:
+                update = self.expression(UpdateExpression, ExpressionAttributeNames, values, None, "UpdateItem")
+                try:
+                    paths = update.compile_update()(item)
+                except (ValueError, TypeError) as e:
+                    raise error("ValidationException", str(e), "UpdateItem")
+                if any(path[0] in self.key_names for path in paths):
+                    raise error("ValidationException", "Cannot update attribute, it is part of the key", "UpdateItem")
+            self.validate(item, "UpdateItem")
+            self.store(key, item)
+        if ReturnValues == "ALL_NEW":
+            return {"Attributes": copy.deepcopy(item)}
+        if ReturnValues == "UPDATED_NEW":
+            return {"Attributes": project(item, paths)}
+        if ReturnValues == "ALL_OLD" and old is not None:
+            return {"Attributes": copy.deepcopy(old)}
+        if ReturnValues == "UPDATED_OLD" and old is not None:
+            return {"Attributes": project(old, paths)}
+        return {}
+
+    def delete_item(self, Key: dict, ConditionExpression=None, ExpressionAttributeNames: dict = None,
+                    ExpressionAttributeValues: dict = None, ReturnValues: str = "NONE", **kwargs) -> dict:
+        key = self.key(normalize(Key), "DeleteItem")
+        with self.lock:
+            old = self.items.get(key)
+            self.check(old, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues, "DeleteItem")
+            if old is not None:
+                self.store(key, None)
+        if ReturnValues == "ALL_OLD" and old is not None:
+            return {"Attributes": old}
+        return {}
+
+    # Reads
+
+    def query(self, KeyConditionExpression=None, IndexName: str = None, **kwargs) -> dict:
+        if IndexName and IndexName not in self.indexes:
+            raise error("ValidationException", "The table does not have the specified index: " + IndexName, "Query")
+        index = self.indexes[IndexName] if IndexName else self.primary
+        builder = ConditionExpressionBuilder()
+        names = kwargs.get("ExpressionAttributeNames")
+        values = kwargs.get("ExpressionAttributeValues")
+        values = values and normalize(values)
+        expression = self.expression(KeyConditionExpression, names, values, builder, "Query", key=True)
+        key_condition = expression.compile_condition()
+        hash_value = expression.key_value(index.key_names[0])
+        if hash_value is MISSING:
+            raise error("ValidationException", "Query condition missed key schema element", "Query")
+        return self.read(index, kwargs, builder, "Query", key_condition, hash_value)
+
+    def scan(self, **kwargs) -> dict:
+        return self.read(self.primary, kwargs, ConditionExpressionBuilder(), "Scan")
+
+    def read(self, index: MemoryIndex, kwargs: dict, builder: ConditionExpressionBuilder, operation: str,
+             key_condition: Callable = None, hash_value=MISSING) -> dict:
+        names = kwargs.get("ExpressionAttributeNames")
+        values = kwargs.get("ExpressionAttributeValues")
+        values = values and normalize(values)
+        condition = None
+        if kwargs.get("FilterExpression") is not None:
+            condition = self.expression(kwargs["FilterExpression"], names, values, builder,
+                                        operation).compile_condition()
+        paths = None
+        if kwargs.get("ProjectionExpression"):
+            paths = self.expression(kwargs["ProjectionExpression"], names, None, None, operation).compile_projection()
+        limit = kwargs.get("Limit")
+        forward = kwargs.get("ScanIndexForward", True)
+        segment, total_segments = kwargs.get("Segment", 0), kwargs.get("TotalSegments", 1)
+        entry_names = index.entry_names(self.key_names)
+
+        with self.lock:
+            entries = index.entries
+            # Range of entries of the hash key (or the whole table)
+            low, high = 0, len(entries)
+            if hash_value is not MISSING:
+                low = bisect.bisect_left(entries, (hash_value,))
+                high = low
+                while high < len(entries) and entries[high][0] == hash_value:
+                    high += 1
+            start = kwargs.get("ExclusiveStartKey")
+            if start is not None:
+                start = tuple(normalize(start)[name] for name in entry_names)
+                if forward:
+                    low = max(low, bisect.bisect_right(entries, start))
+                else:
+                    high = min(high, bisect.bisect_left(entries, start))
+            positions = range(low, high) if forward else range(high - 1, low - 1, -1)
+
+            items, scanned, last = list(), 0, None
+            for position in positions:
+                entry = entries[position]
+                table_key = self.table_key(index, entry)
+                if total_segments > 1 and hash(table_key) % total_segments != segment:
+                    continue
+                item = self.items[table_key]
+                if key_condition is not None and not key_condition(item):
+                    continue
+                if limit is not None and scanned >= limit:
+                    break
+                scanned += 1
+                last = entry
+                item = index.project(item, self.key_names) if index is not self.primary else item
+                if condition is not None and not condition(item):
+                    continue
+                items.append(item)
+            else:
+                last = None
+            items = [project(item, paths) if paths is not None else copy.deepcopy(item) for item in items]
+
+        response = {"Count": len(items), "ScannedCount": scanned}
+        if kwargs.get("Select") != "COUNT":
+            response["Items"] = items
+        if last is not None:
+            response["LastEvaluatedKey"] = dict(zip(entry_names, last))
+        return response
+
+
+class MemoryClient(object):
+    """Part of the low level client api (`dynamodb.meta.client`) used by `create_db` and `Database`"""
+
+    def __init__(self, resource: "MemoryDynamoDB"):
+        self.resource = resource
+
+    def describe_table(self, TableName: str) -> dict:
+        with self.resource.lock:
+            return {"Table": self.resource.table(TableName, "DescribeTable").describe()}
+
+    def update_table(self, TableName: str, AttributeDefinitions: List[dict] = None,
+                     GlobalSecondaryIndexUpdates: List[dict] = None, **kwargs) -> dict:
+        with self.resource.lock:
+            table = self.resource.table(TableName, "UpdateTable")
+            table.add_attributes(AttributeDefinitions or [])
+            for update in GlobalSecondaryIndexUpdates or []:
+                if 'Create' in update:
+                    table.add_index(update['Create'])
+                elif 'Delete' in update:
+                    table.indexes.pop(update['Delete']['IndexName'], None)
+            return {"TableDescription": table.describe()}
+
+    def describe_time_to_live(self, TableName: str) -> dict:
+        with self.resource.lock:
+            table = self.resource.table(TableName, "DescribeTimeToLive")
+            if table.time_to_live is None:
+                return {"TimeToLiveDescription": {"TimeToLiveStatus": "DISABLED"}}
+            return {"TimeToLiveDescription": {"TimeToLiveStatus": "ENABLED", "AttributeName": table.time_to_live}}
+
+    def update_time_to_live(self, TableName: str, TimeToLiveSpecification: dict) -> dict:
+        specification = TimeToLiveSpecification
+        with self.resource.lock:
+            table = self.resource.table(TableName, "UpdateTimeToLive")
+            table.time_to_live = specification['AttributeName'] if specification['Enabled'] else None
+            return {"TimeToLiveSpecification": TimeToLiveSpecification}
+
+
+class MemoryDynamoDB(object):
+    """
+    Drop-in replacement of the boto3 DynamoDB resource, that keeps the tables in the process.
+
+    With `path` every write also goes to the SQLite database at `path`, tables are loaded from it
+    when they are created (`create_db` runs on every start), so data survives restarts.
+    Not shared between processes, the server has to run with a single worker (like `LocalLease`).
+    """
+
+    def __init__(self, path: str = None):
+        # @Important: boto3 calls run in the executor threads, every table operation holds the lock
+        self.lock = threading.RLock()
+        self.tables: Dict[str, MemoryTable] = dict()
+        self.connection = None
+        self.meta = type("Meta", (), {"client": MemoryClient(self)})()
+        if path is not None:
+            self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS items "
+                                    "(table_name TEXT, key TEXT, item TEXT, PRIMARY KEY (table_name, key))")
+
+    def create_table(self, TableName: str, KeySchema: List[dict], AttributeDefinitions: List[dict],
+                     GlobalSecondaryIndexes: List[dict] = None, **kwargs) -> MemoryTable:
+        with self.lock:
+            if TableName in self.tables:
+                raise error("ResourceInUseException", f"Table already exists: {TableName}", "CreateTable")
+            table = MemoryTable(self, TableName, KeySchema, AttributeDefinitions, GlobalSecondaryIndexes)
+            self.tables[TableName] = table
+            if self.connection is not None:
+                rows = self.connection.execute("SELECT item FROM items WHERE table_name = ?", (TableName,))
+                for (item,) in rows.fetchall():
+                    item = deserializer.deserialize({"M": json.loads(item)})
+                    key = tuple(item[name] for name in table.key_names)
+                    table.items[key] = item
+                    for index in [table.primary, *table.indexes.values()]:
+                        entry = index.entry(item, table.key_names)
+                        if entry is not None:
+                            index.entries.append(entry)
+                for index in [table.primary, *table.indexes.values()]:
+                    index.entries.sort()
+            return table
+
+    def table(self, name: str, operation: str) -> MemoryTable:
+        if name not in self.tables:
+            raise error("ResourceNotFoundException", f"Requested resource not found: Table: {name} not found",
+                        operation)
+        return self.tables[name]
+
+    def Table(self, name: str) -> MemoryTable:
+        return self.table(name, "DescribeTable")
+
+    def batch_get_item(self, RequestItems: Dict[str, dict], **kwargs) -> dict:
+        requests = [(self.table(name, "BatchGetItem"), key)
+                    for name, request in RequestItems.items() for key in request['Keys']]
+        if not 0 < len(requests) <= 100:
+            raise error("ValidationException", "Too many items requested for the BatchGetItem call",
+                        "BatchGetItem")
+        keys = [(table, table.key(normalize(key), "BatchGetItem")) for table, key in requests]
+        if len(set((table.name, key) for table, key in keys)) != len(keys):
+            raise error("ValidationException", "Provided list of item keys contains duplicates", "BatchGetItem")
+        responses = {name: list() for name in RequestItems}
+        with self.lock:
+            for table, key in keys:
+                if key in table.items:
+                    responses[table.name].append(copy.deepcopy(table.items[key]))
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+    def batch_write_item(self, RequestItems: Dict[str, List[dict]], **kwargs) -> dict:
+        requests = [(self.table(name, "BatchWriteItem"), request)
+                    for name, table_requests in RequestItems.items() for request in table_requests]
+        if not 0 < len(requests) <= 25:
+            raise error("ValidationException", "Too many items requested for the BatchWriteItem call",
+                        "BatchWriteItem")
+        keys = set()
+        for table, request in requests:
+            item = request['PutRequest']['Item'] if 'PutRequest' in request else request['DeleteRequest']['Key']
+            # Whole request is rejected if any of the items is invalid
+            item = normalize(item)
+            if 'PutRequest' in request:
+                table.validate(item, "BatchWriteItem")
+            key = (table.name, table.key({name: item[name] for name in table.key_names if name in item},
+                                         "BatchWriteItem"))
+            if key in keys:
+                raise error("ValidationException", "Provided list of item keys contains duplicates",
+                            "BatchWriteItem")
+            keys.add(key)
+        with self.lock:
+            for table, request in requests:
+                if 'PutRequest' in request:
+                    table.put_item(Item=request['PutRequest']['Item'])
+                else:
+                    table.delete_item(Key=request['DeleteRequest']['Key'])
+        return {"UnprocessedItems": {}}
+
+    def persist(self, table_name: str, key: tuple, item: Optional[dict]):
+        if self.connection is None:
+            return
+        key = json.dumps(serializer.serialize(list(key)))
+        if item is None:
+            self.connection.execute("DELETE FROM items WHERE table_name = ? AND key = ?", (table_name, key))
+        else:
+            self.connection.execute("INSERT OR REPLACE INTO items VALUES (?, ?, ?)",
+                                    (table_name, key, json.dumps(serializer.serialize(item)["M"])))
@@ -0,0 +1,39 @@
+"""
+One-off migrations of the tables and the data written by the older versions of the server. Run once after
+an upgrade, with the same .env as the server; the server can keep running meanwhile, every migration is
+safe to run again.
+
+Indexes introduced since the tables were created are added here, not on the server start: DynamoDB builds
+an index of a big table for minutes to hours (the features that need it wait till it's `ACTIVE`).
+
+Usage:
+    $ python -m db.migrate
+"""
+from .create_db import migrate_checkbacks, add_missing_indexes, INDEXES
+from .create_db import migrate_dead_letters, enable_time_to_live, OUTBOUND_TIME_TO_LIVE
+from settings import OUTBOUND_DEAD_LETTER_DAYS
+import datetime
+from .db import Database
+import logging
+
+
+def main():
+    db = Database()
+    checkbacks = migrate_checkbacks(db.dynamodb, db.checkback_partition, db.now())
+    logging.info(f"CheckBacks moved to the partitions: {checkbacks['pending']}, "
+                 f"marked sent (overdue): {checkbacks['sent']}")
+    expires_at = db.now() + datetime.timedelta(days=OUTBOUND_DEAD_LETTER_DAYS)
+    dead_letters = migrate_dead_letters(db.dynamodb, int(expires_at.timestamp()))
+    logging.info(f"Dead-lettered outbound messages taken out of the retry index: {dead_letters}")
+    if enable_time_to_live(db.dynamodb, 'OutboundMessages', OUTBOUND_TIME_TO_LIVE):
+        logging.info("OutboundMessages: enabled the expiration of dead-lettered messages")
+    for table_name in INDEXES:
+        logging.info(f"{table_name}: building missing indexes (if any), it may take a while")
+        added = add_missing_indexes(db.dynamodb, table_name)
+        logging.info(f"{table_name}: added indexes {', '.join(added) or '-'}")
+    db.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
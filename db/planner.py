@@ -0,0 +1,148 @@
+from boto3.dynamodb.conditions import Attr, Key
+from typing import List, Optional
+from collections import namedtuple
+import decimal
+import math
+
+# Single condition of the broadcast targeting (`[!]key<mode>value`), see `BroadcastingState._parse_targets`
+Target = namedtuple("Target", ["key", "invert", "mode", "value"])
+
+# Global secondary indexes of the `Users` table, attribute -> (index name, type of the values)
+USER_INDEXES = {
+    "language": ("language_index", str),
+    "via_instance": ("via_instance_index", str),
+    "type": ("type_index", int),
+    "permission_level": ("permission_level_index", int),
+}
+# Non-key attributes copied to each of the indexes, filters on the index can only use these
+USER_INDEX_PROJECTION = ["user_id", "via_instance", "language", "type", "permission_level"]
+PROJECTED = set(USER_INDEX_PROJECTION) | {"identity"}
+
+# Eventually consistent read unit covers 8KB
+READ_UNIT_BYTES = 8192
+
+
+def target_condition(target: Target) -> Attr:
+    attr = Attr(target.key)
+    if target.mode == "=":
+        condition = attr.eq(target.value)
+    elif target.mode == "<":
+        condition = attr.lt(target.value)
+    elif target.mode == ">":
+        condition = attr.gt(target.value)
+    elif target.mode == "{":
+        condition = attr.is_in(target.value)
+    elif target.mode == "}":
+        condition = attr.contains(target.value)
+    else:
+        raise ValueError(f"unknown mode {target.mode!r}")
+    if target.invert:
+        condition = ~condition
+    return condition
+
+
+def combine(targets: List[Target]) -> Optional[Attr]:
+    condition = None
+    for target in targets:
+        if condition is None:
+            condition = target_condition(target)
+        else:
+            condition &= target_condition(target)
+    return condition
+
+
+def index_values(target: Target) -> Optional[list]:
+    """Values to query the index with, if the condition can be answered by an index"""
+    if target.invert or target.key not in USER_INDEXES:
+        return
+    _, type_ = USER_INDEXES[target.key]
+    # Numbers are decimals once targets were saved to the user's context
+    types = (int, decimal.Decimal) if type_ is int else type_
+    values = [target.value] if target.mode == "=" else target.value if target.mode == "{" else None
+    if not values or not all(isinstance(value, types) and not isinstance(value, bool) for value in values):
+        return
+    return values
+
+
+class QueryPlan(object):
+    """
+    How to find users of a broadcast: query of one index (once per value) with the rest of the
+    conditions as a filter, or the full scan with all conditions as a filter.
+    """
+
+    def __init__(self, key: Optional[str], values: list, condition: Optional[Attr],
+                 estimated_items: int, estimated_read_units: float):
+        self.key = key
+        self.index = USER_INDEXES[key][0] if key is not None else None
+        self.values = values
+        self.condition = condition
+        self.estimated_items = estimated_items
+        self.estimated_read_units = estimated_read_units
+
+    def key_conditions(self) -> list:
+        return [Key(self.key).eq(value) for value in self.values]
+
+    def describe(self) -> str:
+        if self.index is None:
+            how = "full scan of the users"
+        else:
+            how = f"query of the {self.index}"
+        return f"{how}, reads at most ~{self.estimated_items} users " \
+               f"(~{math.ceil(self.estimated_read_units)} read units)"
+
+
+async def plan_targets(db, targets: List[Target], estimate: bool = True, key: Optional[str] = None) -> QueryPlan:
+    """
+    Picks the cheapest way to find users that match all `targets`: of the conditions an index can answer,
+    the one with the smallest index is queried and the rest of the conditions filter its results. Falls back
+    to the full scan if no index can be used.
+
+    @Important: sizes come from `DescribeTable` (free, updated every ~6 hours), not from `COUNT` queries;
+    @Important: DynamoDB charges those for every item they count, as much as the broadcast itself. An index
+    @Important: has no counts per value, so its size is the upper bound of what the query reads.
+
+    Args:
+        db (Database): database wrapper object
+        targets (list): parsed conditions
+        estimate (bool): if False, sizes aren't read and the plan uses `key`
+        key (str): attribute to query by when not estimating (of the plan that was estimated before), None - scan
+    """
+    if not estimate:
+        stats = {'items': 0, 'bytes': 0, 'indexes': {}}
+    else:
+        stats = await db.users_table_stats()
+    scan_plan = QueryPlan(None, [], combine(targets), stats['items'], stats['bytes'] / READ_UNIT_BYTES)
+
+    candidates = dict()
+    for target in targets:
+        values = index_values(target)
+        if values is None or target.key in candidates:
+            continue
+        rest = [other for other in targets if other is not target]
+        # Filters on the index can't see attributes that aren't copied to it
+        if all(other.key in PROJECTED for other in rest):
+            candidates[target.key] = (values, rest)
+    if estimate:
+        # Index that isn't added yet (`python -m db.migrate`) or still being built can't be queried
+        candidates = {candidate: rest for candidate, rest in candidates.items()
+                      if stats['indexes'].get(USER_INDEXES[candidate][0], {}).get('status') == 'ACTIVE'}
+    if not candidates:
+        return scan_plan
+
+    if not estimate:
+        if key not in candidates:
+            return scan_plan
+        values, rest = candidates[key]
+        return QueryPlan(key, values, combine(rest), 0, 0)
+
+    # Query reads only matching (and smaller) items, so any index beats the scan; the smallest one wins,
+    # of the same size - the one queried fewer times
+    best = None
+    for candidate, (values, rest) in candidates.items():
+        index, _ = USER_INDEXES[candidate]
+        index_stats = stats['indexes'].get(index, {})
+        plan = QueryPlan(candidate, values, combine(rest), index_stats.get('items', 0),
+                         index_stats.get('bytes', 0) / READ_UNIT_BYTES)
+        if best is None or (plan.estimated_items, len(plan.values)) < (best.estimated_items, len(best.values)):
+            best = plan
+    return best
@@ -0,0 +1,176 @@
+from typing import Awaitable, Callable, Dict, Optional
+from botocore.exceptions import ClientError, ConnectionError
+from collections import Counter, defaultdict, deque
+from .executor import DatabaseExecutor
+import asyncio
+import random
+import time
+
+# Error codes of the requests over the capacity of the table (or the account)
+THROTTLING = {"ProvisionedThroughputExceededException", "ThrottlingException", "RequestLimitExceeded"}
+# Error codes of the requests that may succeed as they are
+TRANSIENT = {"InternalServerError", "ServiceUnavailable"}
+# Operations that report the capacity they consumed
+CONSUMED_CAPACITY = {"get_item", "put_item", "update_item", "delete_item", "query", "scan",
+                     "batch_get_item", "batch_write_item"}
+
+
+class AdaptiveRateLimiter(object):
+    """
+    Requests per second to one table, found out from its throttling (AIMD).
+
+    Isn't limited until the table throttles a request. Then the rate is cut to `decrease` of the rate
+    requests were sent at, and every request that gets through adds to it, so it grows by about
+    `increase` requests per second every second. Once it's twice the rate the table throttled at,
+    the limit is lifted again.
+    """
+    # Requests in flight are throttled together, that's one signal
+    COOLDOWN = 0.1
+
+    def __init__(self, min_rate: float = 1.0, increase: float = 1.0, decrease: float = 0.5,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], Awaitable] = asyncio.sleep):
+        self.min_rate = min_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.clock = clock
+        self.sleep = sleep
+        # Requests per second, None - not limited
+        self.rate: Optional[float] = None
+        self.ceiling: Optional[float] = None
+        self.next_at = 0.0
+        self.decreased_at = float("-inf")
+        # Times of the requests of the last second
+        self.recent = deque()
+
+    async def acquire(self):
+        """Waits for the turn of the request"""
+        now = self.clock()
+        at = now
+        if self.rate is not None:
+            at = max(now, self.next_at)
+            self.next_at = at + 1 / self.rate
+        self.recent.append(at)
+        while self.recent[0] <= now - 1:
+            self.recent.popleft()
+        if at > now:
+            await self.sleep(at - now)
+
+    def succeeded(self):
+        if self.rate is None:
+            return
+        self.rate += self.increase / self.rate
+        if self.rate >= 2 * self.ceiling:
+            self.rate = None
+
+    def throttled(self):
+        now = self.clock()
+        if now - self.decreased_at < self.COOLDOWN:
+            return
+        self.decreased_at = now
+        current = self.rate if self.rate is not None else len([at for at in self.recent if at > now - 1])
+        self.ceiling = max(current, self.min_rate)
+        self.rate = max(current * self.decrease, self.min_rate)
+
+
+class ThrottledClient(object):
+    """
+    Runs boto3 calls in the `DatabaseExecutor`, keeping each table under the rate it can take.
+
+    Throttled (and transient) errors are retried with full-jitter exponential backoff, up to `retries`
+    times, and slow the table down (`AdaptiveRateLimiter`); so does a batch with unprocessed items.
+    Other errors are raised right away. Every call asks for `ReturnConsumedCapacity`, the units are
+    summed per table and operation to size the provisioned capacity from (see `metrics`).
+    """
+
+    def __init__(self, executor: DatabaseExecutor, retries: int = 8, backoff: float = 0.05, max_backoff: float = 5.0,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], Awaitable] = asyncio.sleep):
+        """
+        Args:
+            executor (DatabaseExecutor): pool the calls run in
+            retries (int): attempts after a throttled or transient error, before it's raised
+            backoff (float): base delay between the attempts, seconds
+            max_backoff (float): longest delay between the attempts, seconds
+        """
+        self.executor = executor
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.sleep = sleep
+        self.started = clock()
+        self.limiters: Dict[str, AdaptiveRateLimiter] = defaultdict(
+            lambda: AdaptiveRateLimiter(clock=self.clock, sleep=self.sleep)
+        )
+        # (table, operation) -> counters
+        self.operations: Dict[tuple, Counter] = defaultdict(Counter)
+
+    @staticmethod
+    def table_of(method: Callable, kwargs: dict) -> str:
+        if 'TableName' in kwargs:
+            return kwargs['TableName']
+        if 'RequestItems' in kwargs:
+            return ",".join(kwargs['RequestItems'])
+        name = getattr(getattr(method, '__self__', None), 'name', None)
+        return name if isinstance(name, str) else ""
+
+    async def run(self, method: Callable, *args, **kwargs):
+        """Calls `method(*args, **kwargs)` in the executor, returns its result (or raises its exception)"""
+        operation = getattr(method, '__name__', str(method))
+        table = self.table_of(method, kwargs)
+        if operation in CONSUMED_CAPACITY:
+            kwargs.setdefault('ReturnConsumedCapacity', 'TOTAL')
+        limiter = self.limiters[table]
+        stats = self.operations[(table, operation)]
+        attempt = 0
+        while True:
+            await limiter.acquire()
+            stats['calls'] += 1
+            try:
+                response = await self.executor.run(method, *args, **kwargs)
+            except ClientError as e:
+                code = e.response.get('Error', {}).get('Code')
+                if code in THROTTLING:
+                    stats['throttled'] += 1
+                    limiter.throttled()
+                elif code not in TRANSIENT:
+                    raise
+                if attempt >= self.retries:
+                    stats['failed'] += 1
+                    raise
+            except ConnectionError:
+                if attempt >= self.retries:
+                    stats['failed'] += 1
+                    raise
+            else:
+                if isinstance(response, dict):
+                    self.consumed(operation, response)
+                    if response.get('UnprocessedItems') or response.get('UnprocessedKeys'):
+                        # Part of the batch was throttled, the caller retries it
+                        stats['throttled'] += 1
+                        limiter.throttled()
+                        return response
+                limiter.succeeded()
+                return response
+            attempt += 1
+            stats['retries'] += 1
+            await self.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+    def error(self, table: str, operation: str):
+        """Counts the error of a call, that the caller handled itself instead of raising it"""
+        self.operations[(table, operation)]['errors'] += 1
+
+    def consumed(self, operation: str, response: dict):
+        consumed = response.get('ConsumedCapacity') or []
+        if isinstance(consumed, dict):
+            consumed = [consumed]
+        for each in consumed:
+            self.operations[(each['TableName'], operation)]['units'] += float(each.get('CapacityUnits', 0))
+
+    def metrics(self) -> dict:
+        elapsed = max(self.clock() - self.started, 1e-9)
+        tables = dict()
+        for (table, operation), stats in self.operations.items():
+            limiter = self.limiters.get(table)
+            entry = tables.setdefault(table, {"rate_limit": limiter.rate if limiter else None, "operations": {}})
+            entry["operations"][operation] = {**stats, "units_per_second": stats['units'] / elapsed}
+        return tables
@@ -0,0 +1,73 @@
+from typing import Dict, List, Optional, Tuple
+
+
+def same(a, b) -> bool:
+    """Deep equality that, unlike `==`, doesn't take True for 1 (database keeps them apart)"""
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(same(a[key], b[key]) for key in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+    if isinstance(a, (dict, list)) or isinstance(b, (dict, list)):
+        return False
+    return isinstance(a, bool) == isinstance(b, bool) and a == b
+
+
+def changes(old: dict, new: dict, path: tuple = ()) -> List[Tuple[str, tuple, object]]:
+    """
+    Minimal list of actions that turn `old` into `new`:
+        ("SET", path, value) - attribute is new or changed (maps are compared key by key)
+        ("APPEND", path, tail) - list only got new elements at the end
+        ("REMOVE", path, None) - attribute is gone
+    """
+    actions = list()
+    for key, value in new.items():
+        if key not in old:
+            actions.append(("SET", path + (key,), value))
+            continue
+        previous = old[key]
+        if same(previous, value):
+            continue
+        if isinstance(previous, dict) and isinstance(value, dict):
+            actions.extend(changes(previous, value, path + (key,)))
+        elif isinstance(previous, list) and isinstance(value, list) and len(value) > len(previous) \
+                and same(previous, value[:len(previous)]):
+            actions.append(("APPEND", path + (key,), value[len(previous):]))
+        else:
+            actions.append(("SET", path + (key,), value))
+    for key in old:
+        if key not in new:
+            actions.append(("REMOVE", path + (key,), None))
+    return actions
+
+
+def update_expression(actions: List[Tuple[str, tuple, object]]) -> Tuple[str, Dict[str, str], Dict[str, object]]:
+    """UpdateExpression (with names and values) of the actions from `changes`"""
+    names, values = dict(), dict()
+    placeholders = dict()
+    sets, removes = list(), list()
+
+    def name(path: tuple) -> str:
+        parts = list()
+        for part in path:
+            if part not in placeholders:
+                placeholders[part] = f"#a{len(placeholders)}"
+                names[placeholders[part]] = part
+            parts.append(placeholders[part])
+        return ".".join(parts)
+
+    for action, path, value in actions:
+        if action == "REMOVE":
+            removes.append(name(path))
+            continue
+        placeholder = f":v{len(values)}"
+        values[placeholder] = value
+        if action == "APPEND":
+            sets.append(f"{name(path)} = list_append({name(path)}, {placeholder})")
+        else:
+            sets.append(f"{name(path)} = {placeholder}")
+    clauses = list()
+    if sets:
+        clauses.append("SET " + ", ".join(sets))
+    if removes:
+        clauses.append("REMOVE " + ", ".join(removes))
+    return " ".join(clauses), names, values
@@ -38,10 +38,12 @@ class ConversationRequest(TypedDict):
 
 class CheckBack(TypedDict):
     id: str
-    server_mac: str
+    partition: str
     identity: str
     context: str
     send_at: str
+    was_sent: bool
+    attempts: int
 
 
 class Session(TypedDict):
@@ -51,6 +53,24 @@ class Session(TypedDict):
     broadcast: Optional[int]
     psychological_room: Optional[int]
     doctor_room: Optional[int]
+    bulk: bool
+
+
+class LeaseItem(TypedDict):
+    name: str
+    owner: str
+    expires_at: str
+
+
+class OutboundMessage(TypedDict):
+    id: str
+    service: str
+    context: str
+    status: str
+    attempts: int
+    last_error: str
+    created_at: str
+    next_attempt_at: str
 
 
 class BroadcastMessage(TypedDict):
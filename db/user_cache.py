@@ -0,0 +1,79 @@
+from collections import OrderedDict, Counter
+from typing import Callable, Optional
+from .typing_hints import User
+import time
+
+
+class UserCache(object):
+    """
+    Least recently used `User` items of this process, so a user in an active conversation isn't read
+    from the database on every message.
+
+    Holds at most `size` users, each for `ttl` seconds after it was last read from or written to the
+    database. Items are kept as they are in the database; callers get copies (see `Database.get_user`).
+    Every write of the process goes through the cache, writes it can't follow (`update_user` with an
+    arbitrary expression) `invalidate` the user.
+
+    @Important: writes of the other processes aren't seen until the entry expires, so the cache is
+    @Important: on by default only for a single process (see `USER_CACHE_TTL`)
+    """
+
+    def __init__(self, size: int, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+        # identity -> (expires_at, user)
+        self.items: "OrderedDict[str, tuple]" = OrderedDict()
+        self.stats = Counter()
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0 and self.ttl > 0
+
+    def get(self, identity: str) -> Optional[User]:
+        if not self.enabled:
+            return
+        entry = self.items.get(identity)
+        if entry is None:
+            self.stats['misses'] += 1
+            return
+        expires_at, user = entry
+        if expires_at <= self.clock():
+            del self.items[identity]
+            self.stats['expired'] += 1
+            self.stats['misses'] += 1
+            return
+        self.items.move_to_end(identity)
+        self.stats['hits'] += 1
+        return user
+
+    def put(self, identity: str, user: User):
+        """Saves user as it's in the database now (the object is owned by the cache from now on)"""
+        if not self.enabled:
+            return
+        self.items[identity] = (self.clock() + self.ttl, user)
+        self.items.move_to_end(identity)
+        while len(self.items) > self.size:
+            self.items.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def update(self, identity: str, user: User):
+        """Replaces the user after a write, unless it was invalidated (or dropped) since it was read"""
+        if identity in self.items:
+            self.put(identity, user)
+
+    def invalidate(self, identity: str):
+        if self.items.pop(identity, None) is not None:
+            self.stats['invalidations'] += 1
+
+    def clear(self):
+        self.items.clear()
+
+    def metrics(self) -> dict:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {
+            **self.stats,
+            "size": len(self.items),
+            "capacity": self.size,
+            "hit_rate": self.stats['hits'] / lookups if lookups else 0.0
+        }
@@ -0,0 +1,52 @@
+from collections import Counter
+
+
+class Admission(object):
+    """
+    Bounded backlog of the `Worker`: a message counts towards `queue_depth` (and the quota of its `via_instance`)
+    from the moment it is admitted until it's released, when the handler is done with it.
+
+    When either limit is reached the message is refused with 429 (`rejection`), and the frontend is asked
+    to retry after `retry_after` seconds (`headers`).
+    """
+
+    def __init__(self, max_depth: int, max_instance_depth: int, retry_after: int):
+        self.max_depth = max_depth
+        self.max_instance_depth = max_instance_depth
+        self.retry_after = retry_after
+        self.queue_depth = 0
+        self.instance_depth = Counter()
+        self.rejected = Counter()
+
+    def admit(self, instance: str) -> bool:
+        """Takes a place in the backlog for the message of `instance`, False if the backlog is full"""
+        if self.queue_depth >= self.max_depth or self.instance_depth[instance] >= self.max_instance_depth:
+            self.rejected[instance] += 1
+            return False
+        self.queue_depth += 1
+        self.instance_depth[instance] += 1
+        return True
+
+    def release(self, instance: str):
+        self.queue_depth -= 1
+        self.instance_depth[instance] -= 1
+        if self.instance_depth[instance] <= 0:
+            del self.instance_depth[instance]
+
+    def rejection(self, **payload) -> dict:
+        """Response payload of the refused request"""
+        return {"status": 429, **payload, "retry_after": self.retry_after}
+
+    def headers(self) -> dict:
+        """Response headers of the refused request"""
+        return {"Retry-After": str(self.retry_after)}
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "queue_limit": self.max_depth,
+            "instance_queue_limit": self.max_instance_depth,
+            "instance_depth": dict(self.instance_depth),
+            "rejected": dict(self.rejected),
+            "rejected_total": sum(self.rejected.values()),
+        }
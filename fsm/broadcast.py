@@ -0,0 +1,144 @@
+from server_logic.definitions import SenderTask, Snapshot
+from typing import AsyncGenerator, Awaitable, Callable, List, Optional, Set
+from fsm.delivery import DeliveryQueue
+from http_client import http
+from db import Database, User, QueryPlan
+import asyncio
+import logging
+
+
+class Broadcast(object):
+    """
+    Sends one message to all users found by the `plan`, in the background.
+
+    Targets are streamed page by page from the index queries of the plan (one per value, in parallel) or
+    from a parallel (segmented) scan of the `Users` table into a bounded queue, which `concurrency` senders take them from, at most `rate` messages per second.
+    Only the chat id differs between the messages, everything else is shared with `message`.
+    Memory doesn't grow with the amount of targets. `progress` is awaited every `PROGRESS_INTERVAL`
+    seconds and once more when the broadcast is `done` (see `outcome`); if reading the targets fails,
+    the broadcast stops and `error` is set.
+    """
+    SCAN_SEGMENTS = 4
+    PAGE_SIZE = 100
+    PROGRESS_INTERVAL = 30
+    PROJECTION = "via_instance, user_id"
+    # Broadcasts in progress (of this process)
+    running: Set["Broadcast"] = set()
+
+    def __init__(self,
+                 db: Database,
+                 outbox: DeliveryQueue,
+                 plan: QueryPlan,
+                 message: Snapshot,
+                 progress: Callable[["Broadcast"], Awaitable],
+                 rate: float = 30,
+                 concurrency: int = 16):
+        self.db = db
+        self.outbox = outbox
+        self.plan = plan
+        self.message = message
+        self.progress = progress
+        self.rate = rate
+        self.concurrency = concurrency
+        self.found = 0
+        self.sent = 0
+        self.failed = 0
+        self.done = False
+        # Why the broadcast stopped before all targets were found, None - it didn't
+        self.error: Optional[str] = None
+        self.__next_slot = 0.0
+
+    def start(self) -> asyncio.Future:
+        """Runs the broadcast in the background, returns right away"""
+        self.running.add(self)
+        task = asyncio.ensure_future(self.run())
+        task.add_done_callback(lambda _: self.running.discard(self))
+        return task
+
+    async def run(self):
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        if self.plan.index is not None:
+            pages = [self.db.iter_users_index_pages(self.plan.index, key_condition, self.plan.condition,
+                                                    self.PROJECTION, self.PAGE_SIZE)
+                     for key_condition in self.plan.key_conditions()]
+        else:
+            pages = [self.db.iter_users_pages(self.plan.condition, self.PROJECTION, segment, self.SCAN_SEGMENTS,
+                                              self.PAGE_SIZE)
+                     for segment in range(self.SCAN_SEGMENTS)]
+        scanners = [asyncio.ensure_future(self.__scan(each_pages, queue)) for each_pages in pages]
+        senders = [asyncio.ensure_future(self.__send_loop(queue)) for _ in range(self.concurrency)]
+        reporter = asyncio.ensure_future(self.__report_loop())
+        try:
+            await asyncio.gather(*scanners)
+            # Wait until everything found is sent
+            await queue.join()
+        except Exception as e:
+            self.error = repr(e)
+            logging.exception(f"Broadcast failed after {self.sent} messages: {e}")
+        finally:
+            for task in scanners + senders + [reporter]:
+                task.cancel()
+            self.done = True
+        await self.__report()
+
+    async def __scan(self, pages: AsyncGenerator[List[User], None], queue: asyncio.Queue):
+        async for page in pages:
+            for target in page:
+                self.found += 1
+                # @Important: waits while the queue is full, so targets are read only as fast as they are sent
+                await queue.put(target)
+
+    async def __send_loop(self, queue: asyncio.Queue):
+        while True:
+            target = await queue.get()
+            try:
+                await self.__pace()
+                if await self.outbox.send(self.task(target), http.session("frontend")):
+                    self.sent += 1
+                else:
+                    # Saved to the outbox, will be retried
+                    self.failed += 1
+            except Exception as e:
+                self.failed += 1
+                logging.exception(f"Failed to send broadcast to {target.get('user_id')}: {e}")
+            finally:
+                queue.task_done()
+
+    async def __pace(self):
+        # Each sender reserves the next free slot, slots are 1/rate seconds apart
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        slot = max(now, self.__next_slot)
+        self.__next_slot = slot + 1 / self.rate
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def task(self, target: User) -> SenderTask:
+        # Shallow copy, only `chat` is different for each target
+        payload = Snapshot(self.message)
+        payload['chat'] = dict(self.message['chat'], chat_id=int(target['user_id']))
+        return SenderTask(target['via_instance'], payload)
+
+    def outcome(self) -> str:
+        """`progress` while running, then `failed` (stopped early), `partial` (some sends failed) or `complete`"""
+        if not self.done:
+            return "progress"
+        if self.error is not None:
+            return "failed"
+        return "partial" if self.failed else "complete"
+
+    async def __report_loop(self):
+        while True:
+            await asyncio.sleep(self.PROGRESS_INTERVAL)
+            await self.__report()
+
+    async def __report(self):
+        try:
+            await self.progress(self)
+        except Exception as e:
+            logging.exception(f"Failed to report broadcast progress: {e}")
+
+    @classmethod
+    def stats(cls) -> list:
+        return [{"found": each.found, "sent": each.sent, "failed": each.failed, "error": each.error}
+                for each in cls.running]
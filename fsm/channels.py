@@ -0,0 +1,86 @@
+from collections import Counter
+from typing import Dict, Optional
+import asyncio
+import uuid
+
+
+class FrontendChannel(object):
+    """
+    Long-lived websocket of one frontend instance (see `/api/ws`), multiplexes messages in both directions.
+
+    Outbound messages are sent as `{"type": "deliver", "id": ..., "payload": ...}` and count as delivered
+    only when the frontend answers with `{"type": "ack", "id": ..., "status": 200}` in `ACK_TIMEOUT` seconds.
+    """
+    ACK_TIMEOUT = 10
+    # Seconds for a new connection to authorize itself
+    AUTH_TIMEOUT = 10
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.closed = False
+        self.__pending: Dict[str, asyncio.Future] = dict()
+
+    async def deliver(self, data: str) -> Optional[str]:
+        """Sends serialized payload, returns None if frontend acknowledged it, otherwise the error"""
+        if self.closed:
+            return "websocket closed"
+        id_ = uuid.uuid4().hex
+        future = asyncio.get_event_loop().create_future()
+        self.__pending[id_] = future
+        try:
+            # Payload is serialized already, no need to decode it just to wrap
+            await self.ws.send(f'{{"type": "deliver", "id": "{id_}", "payload": {data}}}')
+            status = await asyncio.wait_for(future, self.ACK_TIMEOUT)
+        except asyncio.TimeoutError:
+            return "websocket ack timeout"
+        except Exception as e:
+            # Connection closed while sending
+            return repr(e)
+        finally:
+            self.__pending.pop(id_, None)
+        if status != 200:
+            return f"websocket status {status}"
+
+    def ack(self, id_: str, status: int = 200):
+        future = self.__pending.get(id_)
+        if future is not None and not future.done():
+            future.set_result(status)
+
+    def close(self):
+        self.closed = True
+        # Don't make senders wait for the timeout, they will fall back to http right away
+        for future in self.__pending.values():
+            if not future.done():
+                future.set_result(None)
+
+
+class ChannelRegistry(object):
+    """Open websocket channels of this process, by frontend instance name"""
+
+    def __init__(self):
+        self.__channels: Dict[str, FrontendChannel] = dict()
+        self.stats: Counter = Counter()
+
+    def get(self, name: str) -> Optional[FrontendChannel]:
+        return self.__channels.get(name)
+
+    def open(self, name: str, ws) -> FrontendChannel:
+        # @Important: reconnected frontend replaces its old connection, the old one might be half-open
+        old = self.__channels.get(name)
+        if old is not None:
+            old.close()
+        channel = self.__channels[name] = FrontendChannel(ws)
+        self.stats['opened'] += 1
+        return channel
+
+    def close(self, name: str, channel: FrontendChannel):
+        channel.close()
+        if self.__channels.get(name) is channel:
+            del self.__channels[name]
+        self.stats['closed'] += 1
+
+    def metrics(self) -> dict:
+        return dict(self.stats, connected=sorted(self.__channels))
+
+
+channels = ChannelRegistry()
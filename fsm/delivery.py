@@ -0,0 +1,154 @@
+from server_logic.definitions import SenderTask, Snapshot
+from db import Database, OutboundMessage
+from aiohttp import ClientSession, ClientError
+from collections import defaultdict, Counter
+from typing import Dict, List, Optional
+from http_client import http
+from settings import tokens
+import itertools
+import datetime
+import asyncio
+import logging
+import random
+import codec
+
+
+class DeliveryQueue(object):
+    """
+    Delivers messages to the frontends, without losing them when a frontend is down.
+
+    First attempt is made right away; if it fails (bad status, connection error, timeout) the message
+    is saved to the `OutboundMessages` table and `retry_loop` (one per cluster) retries it with
+    exponential backoff. After `MAX_ATTEMPTS` the message is dead-lettered (kept in the table with
+    `dead` status). Per-frontend counters are kept in `stats`.
+
+    Frontends that registered with `bulk` get consecutive messages of one turn in a single request,
+    `{"messages": [<context>, ...]}`, instead of one request per message (see `send_all`).
+
+    If the frontend has an open websocket channel in this process (`channels`), messages go through it
+    first and fall back to the http webhook when it isn't acknowledged.
+    """
+    MAX_ATTEMPTS = 10
+    # Seconds before the first retry, doubled with each attempt (plus jitter), up to `MAX_DELAY`
+    BASE_DELAY = 2
+    MAX_DELAY = 600
+    # Seconds between looking for due retries
+    RETRY_INTERVAL = 2
+    HEADERS = {
+        "Content-Type": "application/json"
+    }
+
+    def __init__(self, db: Database, channels=None):
+        self.db = db
+        self.channels = channels
+        self.stats: Dict[str, Counter] = defaultdict(Counter)
+
+    def retry_delay(self, attempts: int) -> datetime.timedelta:
+        delay = min(self.BASE_DELAY * 2 ** (attempts - 1), self.MAX_DELAY)
+        return datetime.timedelta(seconds=delay * random.uniform(0.5, 1))
+
+    @staticmethod
+    def encode(payload: dict) -> str:
+        """Serializes payload, snapshot (sent to many chats, retried) is serialized only once"""
+        if isinstance(payload, Snapshot):
+            if payload.encoded is None:
+                payload.encoded = codec.dumps(payload)
+            return payload.encoded
+        return codec.dumps(payload)
+
+    async def _post(self, service: str, data: str, session: ClientSession) -> Optional[str]:
+        """Posts serialized payload, returns None if delivered, otherwise the error"""
+        channel = self.channels.get(service) if self.channels is not None else None
+        if channel is not None:
+            error = await channel.deliver(data)
+            if error is None:
+                self.stats[service]['websocket'] += 1
+                return
+            logging.warning(f"Websocket delivery to {service} failed ({error}), falling back to http")
+            self.stats[service]['websocket_failed'] += 1
+        config = tokens.get(service)
+        if config is None:
+            return f"unknown service {service}"
+        try:
+            async with session.post(config.url, data=data, headers=self.HEADERS) as resp:
+                if resp.status == 200:
+                    return
+                return f"status {resp.status}: {await resp.text()}"
+        except (ClientError, asyncio.TimeoutError, OSError) as e:
+            return repr(e)
+
+    async def send(self, task: SenderTask, session: ClientSession) -> bool:
+        """Sends task to the frontend, on failure saves it for the retry; returns True if delivered right away"""
+        error = await self._post(task.service, self.encode(task.context), session)
+        if error is None:
+            self.stats[task.service]['delivered'] += 1
+            return True
+        logging.error(f"[ERROR]: Sending task (service={task.service}, context={task.context}) {error}")
+        self.stats[task.service]['failed'] += 1
+        await self.__queue(task, error)
+        return False
+
+    async def send_bulk(self, service: str, tasks: List[SenderTask], session: ClientSession) -> List[bool]:
+        """Sends tasks to the frontend in one request, in order; on failure each task is saved for the retry"""
+        data = '{"messages": [' + ", ".join(self.encode(task.context) for task in tasks) + ']}'
+        error = await self._post(service, data, session)
+        self.stats[service]['bulk_requests'] += 1
+        if error is None:
+            self.stats[service]['delivered'] += len(tasks)
+            return [True] * len(tasks)
+        logging.error(f"[ERROR]: Sending {len(tasks)} tasks in bulk (service={service}) {error}")
+        self.stats[service]['failed'] += len(tasks)
+        for task in tasks:
+            await self.__queue(task, error)
+        return [False] * len(tasks)
+
+    async def send_all(self, tasks: List[SenderTask], session: ClientSession) -> List[bool]:
+        """Sends tasks one after another, consecutive tasks of the same bulk frontend go in one request"""
+        results = list()
+        for service, group in itertools.groupby(tasks, key=lambda task: task.service):
+            group = list(group)
+            if len(group) > 1 and tokens.supports_bulk(service):
+                results.extend(await self.send_bulk(service, group, session))
+            else:
+                for task in group:
+                    results.append(await self.send(task, session))
+        return results
+
+    async def __queue(self, task: SenderTask, error: str):
+        try:
+            await self.db.create_outbound(task.service, task.context, error, self.retry_delay(1))
+            self.stats[task.service]['queued'] += 1
+        except Exception as e:
+            # Nothing else we can do, at least don't break the rest of the batch
+            self.stats[task.service]['lost'] += 1
+            logging.exception(f"Failed to save outbound message: {e}")
+
+    async def retry(self, item: OutboundMessage, session: ClientSession):
+        service = item['service']
+        # Saved already serialized
+        error = await self._post(service, item['context'], session)
+        attempts = int(item['attempts']) + 1
+        if error is None:
+            self.stats[service]['delivered'] += 1
+            self.stats[service]['retried'] += 1
+            await self.db.remove_outbound(item)
+        elif attempts >= self.MAX_ATTEMPTS:
+            logging.error(f"[ERROR]: Giving up on outbound message {item['id']} (service={service}) {error}")
+            self.stats[service]['dead'] += 1
+            await self.db.dead_letter_outbound(item, error)
+        else:
+            self.stats[service]['failed'] += 1
+            await self.db.reschedule_outbound(item, error, self.retry_delay(attempts))
+
+    async def retry_loop(self):
+        try:
+            logging.info("Delivery retry loop started")
+            while True:
+                try:
+                    async for item in self.db.iter_due_outbound():
+                        await self.retry(item, http.session("frontend"))
+                except Exception as e:
+                    logging.exception(f"Exception in delivery retry loop: {e}")
+                await asyncio.sleep(self.RETRY_INTERVAL)
+        except asyncio.CancelledError:
+            logging.info("Delivery retry loop stopped")
@@ -0,0 +1,75 @@
+from collections import deque
+from typing import Awaitable, Hashable, Deque, Dict
+import asyncio
+import logging
+
+
+class KeyedExecutor(object):
+    """
+    Runs awaitables one after another for the same key, while different keys run concurrently.
+
+    Used to process messages of the same user (`identity`) strictly in the order they came in,
+    so two quick messages can't race on the same `User` item, but different users don't wait on each other.
+    At most `max_keys` keys are executed at the same time, the rest waits for a free slot.
+
+    @Important: the order holds only within one process (one sanic worker). With `N_CORES` > 1 every worker
+    @Important: has an executor of its own, and two messages of a user accepted by different workers can run at
+    @Important: the same time, the later one may even finish first. Ordering across processes needs either a
+    @Important: single worker, or frontends that send the next message of a user after the previous one's answer.
+
+    Note:
+        Has to be created inside of the running event loop.
+    """
+
+    def __init__(self, max_keys: int = 256):
+        self.max_keys = max_keys
+        self.__slots = asyncio.Semaphore(max_keys)
+        self.__queues: Dict[Hashable, Deque[Awaitable]] = dict()
+        self.__idle = asyncio.Event()
+        self.__idle.set()
+        self.in_flight = 0
+
+    def submit(self, key: Hashable, job: Awaitable):
+        """
+        Schedules awaitable `job` to run after all jobs previously submitted with the same key
+
+        Args:
+            key (Hashable): serialization key, e.g. user identity
+            job (Awaitable): coroutine to execute
+        """
+        jobs = self.__queues.get(key)
+        # Key is already being drained -> just wait in line
+        if jobs is not None:
+            jobs.append(job)
+            return
+        self.__queues[key] = deque([job])
+        self.__idle.clear()
+        asyncio.ensure_future(self.__drain(key))
+
+    async def __drain(self, key: Hashable):
+        jobs = self.__queues[key]
+        async with self.__slots:
+            self.in_flight += 1
+            try:
+                while jobs:
+                    # @Important: keep the job in the deque while awaiting, so `submit` knows key is busy
+                    try:
+                        await jobs[0]
+                    except Exception as e:
+                        logging.exception(e)
+                    jobs.popleft()
+            finally:
+                self.in_flight -= 1
+                # @Important: no await between the last check and removal, so nothing can be lost
+                del self.__queues[key]
+                if not self.__queues:
+                    self.__idle.set()
+
+    @property
+    def pending(self) -> int:
+        """Amount of keys that have jobs queued or running"""
+        return len(self.__queues)
+
+    async def join(self):
+        """Waits until all submitted jobs are done"""
+        await self.__idle.wait()
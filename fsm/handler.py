@@ -1,71 +1,132 @@
 from db import Database, User, BroadcastMessage, Session
 from datetime import timedelta, datetime
 from db.enums import PermissionLevel
-from settings import settings, tokens, ROOT_PATH
+from settings import settings, tokens, ROOT_PATH, MAX_CONCURRENT_USERS
+from settings import MAX_QUEUE_SIZE, MAX_INSTANCE_QUEUE_SIZE, RETRY_AFTER, LEASE_TIME, LEASE_BACKEND
+from settings import CHECKBACK_PARTITIONS
 from fsm.states.base_state import BaseState
+from fsm.executor import KeyedExecutor
+from fsm.admission import Admission
+from fsm.scheduler import CheckbackScheduler
+from fsm.unit_of_work import UnitOfWork
 import fsm.states as states
 from db import ServiceTypes
 from db import CheckBack
-from typing import List
-import threading
+from db import Lease, DatabaseLease, LocalLease, run_with_lease
+from http_client import http
+from typing import List, Optional
+import functools
 import asyncio
 import aiohttp
 import logging
 import random
-import queue
+import codec
+import time
 import json
 import os
 
 
-class Worker(threading.Thread):
-    def __init__(self, loop_time=1.0 / 250):
-        self.q = queue.Queue()
-        self.random_q = queue.Queue()
-        self.timeout = loop_time
-        self.handler = Handler()
-        super(Worker, self).__init__()
+class Worker(object):
+    """
+    Dispatches incoming contexts to the `Handler` from within the server's event loop.
+
+    `start()` must be called once the loop is running (sanic `before_server_start` listener),
+    after that `process()` is a cheap non-blocking put into the `asyncio.Queue`.
+
+    Backlog is bounded (`admission`): a message counts towards the limits from the moment it is accepted
+    until the handler is done with it. When the backlog is full `process()` refuses the message and
+    the caller is expected to retry later.
 
-    def process(self, ctx):
-        self.q.put(ctx)
+    Messages of a user are processed in order only among those accepted by this process (see `KeyedExecutor`).
+    """
+    # Weight of the newest sample in the ingest-to-handler latency moving average
+    LATENCY_SMOOTHING = 0.1
+
+    def __init__(self):
+        self.q = None
+        self.executor = None
+        self.handler = Handler()
+        # Moving average of seconds between `process()` and the dispatch to the handler
+        self.latency = 0.0
+        self.admission = Admission(MAX_QUEUE_SIZE, MAX_INSTANCE_QUEUE_SIZE, RETRY_AFTER)
+
+    def start(self):
+        # @Important: queue has to be created inside of the running loop
+        self.q = asyncio.Queue()
+        self.executor = KeyedExecutor(MAX_CONCURRENT_USERS)
+        asyncio.ensure_future(self._run_processes())
+
+    def process(self, ctx) -> bool:
+        """
+        Accepts context for the processing
+
+        Returns:
+            bool: False if the backlog (overall or of the context's instance) is full and the message was dropped
+        """
+        if not self.admission.admit(ctx['request']['via_instance']):
+            return False
+        self.q.put_nowait((time.monotonic(), ctx))
+        return True
 
     async def _run_processes(self):
         # # # Background tasks # # #
-        # Reminder loop
-        asyncio.ensure_future(self.handler.reminder_loop())
+        # Checkbacks created in this process (and loaded by the reminder loops of the partitions it owns)
+        asyncio.ensure_future(self.handler.scheduler.run())
+        # @Important: every sanic worker process runs this, but each job must run once per cluster
+        # Reminder loop of each checkback partition, partitions of a dead node are taken over by the others
+        for partition in range(CHECKBACK_PARTITIONS):
+            asyncio.ensure_future(run_with_lease(self.lease(f"checkbacks-{partition}"),
+                                                 functools.partial(self.handler.reminder_loop, str(partition))))
         # Broadcast messages loop
-        asyncio.ensure_future(self.handler.broadcast_loop())
-        # Loop of updating botsociety file data for the core path 
-        asyncio.ensure_future(self.autoload_file())
+        asyncio.ensure_future(run_with_lease(self.lease("broadcasts"), self.handler.broadcast_loop))
+        # Retries of the messages that frontends failed to receive
+        asyncio.ensure_future(run_with_lease(self.lease("outbox"), BaseState.outbox.retry_loop))
+        # Held back user writes of this process (if enabled)
+        asyncio.ensure_future(self.handler.db.user_flush_loop())
 
         while True:
+            # @Important: sleeps until something is put into the queue, no polling
+            received_at, ctx = await self.q.get()
             try:
-                ctx = self.q.get(timeout=self.timeout)
-                asyncio.ensure_future(self.handler.process(ctx))
-            except queue.Empty:
-                await self.idle()
+                self.latency += (time.monotonic() - received_at - self.latency) * self.LATENCY_SMOOTHING
+                # @Important: messages of one user are handled in order, different users in parallel
+                self.executor.submit(ctx['request']['user']['identity'], self._handle(ctx))
             except Exception as e:
+                self._release(ctx)
                 logging.exception(e)
 
-    async def idle(self):
-        await asyncio.sleep(0)
-
-    def run(self):
-        asyncio.run(self._run_processes())
+    def lease(self, name: str) -> Lease:
+        if LEASE_BACKEND == "local":
+            return LocalLease(name, duration=LEASE_TIME)
+        return DatabaseLease(self.handler.db, name, duration=LEASE_TIME)
 
-    # @Important: async infinite task to propagate update on webhook to handler's thread
-    async def autoload_file(self):
-        while True:
-            try:
-                self.random_q.get(timeout=1.0/250)
-                self.handler.load_bots_file()
-            except queue.Empty:
-                await asyncio.sleep(1)
-            except Exception as e:
-                logging.exception(e)
-    
+    async def _handle(self, ctx):
+        try:
+            await self.handler.process(ctx)
+        finally:
+            self._release(ctx)
+
+    def _release(self, ctx):
+        self.admission.release(ctx['request']['via_instance'])
+
+    def stats(self) -> dict:
+        """Snapshot of the ingest counters for monitoring"""
+        return {
+            **self.admission.stats(),
+            "users_in_flight": self.executor.in_flight if self.executor else 0,
+            "latency": self.latency,
+            "user_writes": dict(UnitOfWork.stats),
+        }
+
+    @staticmethod
+    def delivery_stats() -> dict:
+        """Per-frontend counters of the outbound messages (of this process)"""
+        return {service: dict(counters) for service, counters in BaseState.outbox.stats.items()}
+
+    # @Important: webhook and handler share the loop now, so reload can happen right away
     def reload_file(self):
-        self.random_q.put(True)
-        
+        self.handler.load_bots_file()
+
 
 class Handler(object):
     STATES_HISTORY_LENGTH = 10
@@ -74,12 +135,24 @@ class Handler(object):
     BROADCASTING_STATE = "BroadcastingState"
     GET_ID_STATE = "GetIdState"
     EDIT_PERMISSIONS_STATE = "EditPermissionsState"
+    # Seconds between the sweeps for checkbacks created by the other processes of the node
+    REMINDER_SWEEP_INTERVAL = 60
+    # Seconds a process has to deliver a claimed checkback, before others may send it again
+    CHECKBACK_CLAIM_TIME = 60
+    # Failed checkback is retried after `CHECKBACK_RETRY_DELAY` seconds, doubled with each attempt
+    # up to `CHECKBACK_MAX_DELAY`, and given up after `CHECKBACK_MAX_ATTEMPTS`
+    CHECKBACK_MAX_ATTEMPTS = 8
+    CHECKBACK_RETRY_DELAY = 60
+    CHECKBACK_MAX_DELAY = 3600
     latest_data_fp = os.path.join(ROOT_PATH, "archive", "latest.json") 
 
     def __init__(self):
         self.__states = {}
         self.__register_states(*states.collect())
         self.db = Database()
+        # Fires checkbacks exactly at `send_at`; gets them as soon as they are created in this process
+        self.scheduler = CheckbackScheduler(self.send_reminder, self.db.now)
+        self.db.checkback_listeners.append(self.scheduler.add)
 
         if os.path.exists(self.latest_data_fp):
             self.load_bots_file()
@@ -107,7 +180,8 @@ class Handler(object):
         return True, state(), name
 
     async def __get_or_register_user(self, context):
-        # Getting user from database
+        """Returns user of the context and whether it's new (not in the database yet)"""
+        # Getting user from database (users of active conversations come from the cache of this process)
         user = await self.db.get_user(context['request']['user']['identity'])
         if user is None:
             user = {
@@ -130,20 +204,11 @@ class Handler(object):
                 "permission_level": PermissionLevel.DEFAULT, 
                 "context": dict()
             }
-            await self.db.create_user(user)
-
-        # @Important: Dynamically update associated service instance, when it was changed
-        if context['request']['via_instance'] != user["via_instance"]:
-            # Update database
-            user = await self.db.update_user(
-                user['identity'],
-                "SET via_instance = :v",
-                {":v": context['request']['via_instance']},
-                user
-            )
+            # @Important: saved with the rest of the changes of this message (see `UnitOfWork`)
+            return user, True
 
         #await self.__register_event(user)
-        return user
+        return user, False
 
     #async def __register_event(self, user: User):
     #    # TODO: REGISTER USER ACTIVITY
@@ -151,22 +216,36 @@ class Handler(object):
 
     async def process(self, context):
         # Getting or registering user
-        user = await self.__get_or_register_user(context)
+        user, new = await self.__get_or_register_user(context)
+        # @Important: all states the message goes through change the user, it's written once in the end
+        work = UnitOfWork(self.db, user, new)
+        # @Important: Dynamically update associated service instance, when it was changed
+        if new or context['request']['via_instance'] != user["via_instance"]:
+            user["via_instance"] = context['request']['via_instance']
+            # Registration and the new instance are saved even if the states fail
+            work.checkpoint()
+        try:
+            await self.__process(context, user, work)
+        except Exception:
+            work.failed = True
+            raise
+        finally:
+            await work.complete()
+
+    async def __process(self, context, user, work: UnitOfWork):
         # Finding last registered state of the user
         special_state = await self.get_command_state(user, context)
         if special_state:
-            await self.__forward_to_state(context, user, special_state)
+            await self.__forward_to_state(context, user, work, special_state)
             return
         last_state = await self.last_state(user, context)
         # Looking for state, creating state object
         correct_state, current_state, current_state_name = self.__get_state(last_state)
         if not correct_state:
             user['states'].append(current_state_name)
-            # @Important: maybe we don't need to commit, since we will commit after?
-            # await self.db.commit_user(user)
         # Call process method of some state
         ret_code = await current_state.wrapped_process(context, user)
-        await self.__handle_ret_code(context, user, ret_code)
+        await self.__handle_ret_code(context, user, work, ret_code)
 
 
     async def get_command_state(self, user: User, context):
@@ -197,86 +276,111 @@ class Handler(object):
             user['states'] = ["ENDState"]
         return Handler.START_STATE
 
-    async def __handle_ret_code(self, context, user, ret_code):
+    async def __handle_ret_code(self, context, user, work: UnitOfWork, ret_code):
         # Handle return codes
         #    If status is OK -> Done
         #    If status is GO_TO_STATE -> proceed executing wanted state
+        work.record(ret_code)
         if ret_code == states.OK:
             return
         elif isinstance(ret_code, states.GO_TO_STATE):
-            await self.__forward_to_state(context, user, ret_code.next_state)
+            await self.__forward_to_state(context, user, work, ret_code.next_state)
 
-    async def __forward_to_state(self, context, user, next_state):
+    async def __forward_to_state(self, context, user, work: UnitOfWork, next_state):
         last_state = await self.last_state(user, context)
         correct_state, current_state, current_state_name = self.__get_state(next_state)
         if current_state_name != last_state:
             # Registering new last state
             user['states'].append(current_state_name)
-            # @Important: maybe we don't need to commit, since we will commit after?
-            # await self.db.commit_user(user)
             # Check if history is too long
             if len(user['states']) > self.STATES_HISTORY_LENGTH:
-                # @Important: maybe we don't need to update, since we will commit after?
-                # await self.db.update_user(user['identity'], "REMOVE states[0]", None, user)
                 user['states'].pop(0)
         if current_state.has_entry and current_state_name != last_state:
             ret_code = await current_state.wrapped_entry(context, user)
         else:
             ret_code = await current_state.wrapped_process(context, user)
-        await self.__handle_ret_code(context, user, ret_code)
+        await self.__handle_ret_code(context, user, work, ret_code)
 
-    async def reminder_loop(self) -> None:
+    async def reminder_loop(self, partition: str) -> None:
+        """
+        Runs in the process that owns the partition: loads all pending (including overdue) checkbacks of the
+        partition into the scheduler and then periodically picks up the ones created by the other processes
+        """
         try:
-            logging.info("Reminder loop started")
+            logging.info(f"Reminder loop of partition {partition} started")
+            until = None
             while True:
-                now = self.db.now()
-                #next_circle = (now + timedelta(minutes=1)).replace(second=0, microsecond=0)
-                next_circle = (now + timedelta(seconds=10)).replace(microsecond=0)
-                await asyncio.sleep((next_circle - now).total_seconds())
-                await self.schedule_nearby_reminders(next_circle)
+                count = 0
+                async for checkback in self.db.iter_pending_checkbacks(partition, until):
+                    self.scheduler.add(checkback)
+                    count += 1
+                logging.info(f"Loaded {count} pending checkbacks of partition {partition}")
+                # Anything that is due before the next sweep
+                until = self.db.now() + timedelta(seconds=self.REMINDER_SWEEP_INTERVAL * 2)
+                await asyncio.sleep(self.REMINDER_SWEEP_INTERVAL)
         except asyncio.CancelledError:
-            logging.info("Reminder loop stopped")
+            logging.info(f"Reminder loop of partition {partition} stopped")
         except Exception as e:
             logging.exception(f"Exception in reminder loop: {e}")
 
-    async def schedule_nearby_reminders(self, now: datetime) -> None:
-        #until = now + timedelta(minutes=1)
-        until = now + timedelta(seconds=10)
-        count, all_items_in_range = await self.db.all_checkbacks_in_range(now, until)
-        # Send broadcast in the next minute, but not all at the same time
-        send_at_list = [(60 / count) * i for i in range(count)]
-        async with aiohttp.ClientSession() as session:
-            await asyncio.gather(*[self.send_reminder(send_at, checkback, session)
-                                   for send_at, checkback in zip(send_at_list, all_items_in_range)])
-
-    async def send_reminder(self, send_at: float, checkback: CheckBack, session: aiohttp.ClientSession) -> None:
+    async def send_reminder(self, checkback: CheckBack) -> None:
+        # Loaded from the index -> only keys are there
+        if 'context' not in checkback:
+            checkback = await self.db.get_checkback(checkback['id'])
+            if checkback is None or checkback.get('was_sent'):
+                return
+        # @Important: claim first, the same checkback might be scheduled by several processes
+        if not await self.db.claim_checkback(checkback, timedelta(seconds=self.CHECKBACK_CLAIM_TIME)):
+            return
+        logging.info("Sending checkback")
+        context = codec.loads(checkback["context"])
+        # @Important: if the process dies before the checkback is completed or retried, the claim runs out
+        # @Important: and the checkback is sent again
+        if not await tokens.ensure(context['via_instance']):
+            # Frontend was deregistered, retries won't help
+            logging.error(f"[ERROR]: Giving up on checkback {checkback['id']}, "
+                          f"instance {context['via_instance']} isn't registered")
+            await self.db.dead_letter_checkback(checkback, f"unknown instance {context['via_instance']}")
+            return
         try:
-            logging.info(f"Sending checkback after {send_at} seconds")
-            await asyncio.sleep(send_at)
-            logging.info("Sending checkback")
-            await self._send_reminder(checkback, session)
+            error = await self._send_reminder(checkback, context, http.session("frontend"))
         except Exception as e:
-            logging.exception(f"Failed to send reminder: {e}")
+            logging.exception(e)
+            error = repr(e)
+        if error is None:
+            await self.db.complete_checkback(checkback)
+            return
+        attempts = int(checkback.get('attempts', 0)) + 1
+        if attempts >= self.CHECKBACK_MAX_ATTEMPTS:
+            logging.error(f"[ERROR]: Giving up on checkback {checkback['id']} after {attempts} attempts: {error}")
+            await self.db.dead_letter_checkback(checkback, error)
+        else:
+            delay = min(self.CHECKBACK_RETRY_DELAY * 2 ** (attempts - 1), self.CHECKBACK_MAX_DELAY)
+            # Picked up again by a sweep of the partition's reminder loop
+            await self.db.retry_checkback(checkback, error, self.db.now() + timedelta(seconds=delay))
 
-    async def _send_reminder(self, reminder: CheckBack, session: aiohttp.ClientSession) -> None:
+    async def _send_reminder(self, reminder: CheckBack, context: dict,
+                             session: aiohttp.ClientSession) -> Optional[str]:
+        """Posts checkback to the frontend, returns None if delivered, otherwise the error"""
+        url = tokens[context['via_instance']].url
+        try:
+            # TODO: Find a better way to deal with decimals
+            async with session.post(url, json=context) as response:
+                if response.status != 200:
+                    error = f"status {response.status}: {await response.text()}"
+                    logging.error(f"[ERROR]: Sending checkback (send_at={reminder['send_at']}, "
+                                  f"identity={reminder['identity']}) {error}")
+                    return error
+                result = await response.json()
+                logging.info(f"Sending checkback status: {result}")
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+            return repr(e)
+        # @Important: only once delivered, so failed attempts don't pile up in the history of the user
         await self.db.update_user(
             reminder['identity'],
             "SET states = list_append(states, :i)",
             {":i": ["CheckbackState"]}
         )
-        context = json.loads(reminder["context"])
-        url = tokens[context['via_instance']].url
-        # TODO: Find a better way to deal with decimals
-        async with session.post(url, json=context) as response:
-            # If reached server - log response
-            if response.status == 200:
-                result = await response.json()
-                logging.info(f"Sending checkback status: {result}")
-                return result
-            # Otherwise - log error
-            else:
-                logging.error(f"[ERROR]: Sending checkback (send_at={reminder['send_at']}, "
-                              f"identity={reminder['identity']}) status {await response.text()}")
 
     async def broadcast_loop(self) -> None:
         try:
@@ -300,16 +404,16 @@ class Handler(object):
         # Nowhere to send
         if not all_frontend_sessions:
             return
-        async with aiohttp.ClientSession() as session:
-            # Send broadcast in the next minute, but not all at the same time
-            send_at_list = [(60 / count) * i for i in range(count)]
-            await asyncio.gather(
-                *[
-                    self.send_broadcast(send_at, message, all_frontend_sessions, session)
-                    for send_at, message in
-                    zip(send_at_list, all_items_in_range)
-                ]
-            )
+        session = http.session("frontend")
+        # Send broadcast in the next minute, but not all at the same time
+        send_at_list = [(60 / count) * i for i in range(count)]
+        await asyncio.gather(
+            *[
+                self.send_broadcast(send_at, message, all_frontend_sessions, session)
+                for send_at, message in
+                zip(send_at_list, all_items_in_range)
+            ]
+        )
 
     async def send_broadcast(self,
                              send_at: float,
@@ -317,7 +421,7 @@ class Handler(object):
                              frontend: List[Session],
                              session: aiohttp.ClientSession):
         await asyncio.sleep(send_at)
-        context = json.loads(broadcast_message["context"])
+        context = codec.loads(broadcast_message["context"])
         tasks = list()
         for each_session in frontend:
             context['chat']['chat_id'] = each_session['broadcast']
@@ -0,0 +1,66 @@
+from typing import Awaitable, Callable, Dict, List, Tuple
+from db import CheckBack
+import datetime
+import asyncio
+import logging
+import heapq
+
+
+class CheckbackScheduler(object):
+    """
+    Keeps upcoming checkbacks in a heap ordered by `send_at` and fires each one exactly at that time.
+
+    Checkbacks get here right when they are created (`Database.create_checkback` listener) and from
+    the database, when the node's reminder leader loads everything that is still pending. The same
+    checkback may be scheduled by several processes, `fire` is expected to claim it before sending.
+    """
+
+    def __init__(self, fire: Callable[[CheckBack], Awaitable], now: Callable[[], datetime.datetime]):
+        self.fire = fire
+        self.now = now
+        self.__heap: List[Tuple[datetime.datetime, str, CheckBack]] = list()
+        self.__scheduled: Dict[str, datetime.datetime] = dict()
+        self.__wakeup = None
+
+    def __len__(self):
+        return len(self.__heap)
+
+    def add(self, checkback: CheckBack):
+        """Schedules checkback, if it's not scheduled yet"""
+        if checkback['id'] in self.__scheduled:
+            return
+        send_at = datetime.datetime.fromisoformat(checkback['send_at'])
+        self.__scheduled[checkback['id']] = send_at
+        heapq.heappush(self.__heap, (send_at, checkback['id'], checkback))
+        # New checkback might be earlier than the one we are sleeping for
+        if self.__wakeup is not None and self.__heap[0][1] == checkback['id']:
+            self.__wakeup.set()
+
+    async def run(self):
+        # @Important: event has to be created inside of the running loop
+        self.__wakeup = asyncio.Event()
+        try:
+            while True:
+                if not self.__heap:
+                    await self.__wakeup.wait()
+                    self.__wakeup.clear()
+                    continue
+                delay = (self.__heap[0][0] - self.now()).total_seconds()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self.__wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    self.__wakeup.clear()
+                    continue
+                _, checkback_id, checkback = heapq.heappop(self.__heap)
+                del self.__scheduled[checkback_id]
+                asyncio.ensure_future(self.__fire(checkback))
+        except asyncio.CancelledError:
+            logging.info("Checkback scheduler stopped")
+
+    async def __fire(self, checkback: CheckBack):
+        try:
+            await self.fire(checkback)
+        except Exception as e:
+            logging.exception(f"Failed to send checkback {checkback['id']}: {e}")
@@ -1,11 +1,10 @@
 from server_logic.definitions import Context
 from settings import AI_URL
 from . import base_state
-from db.db import custom_default
+from http_client import http
 from db import User
-import aiohttp
 import logging
-import json
+import codec
 
 
 class AIState(base_state.BaseState):
@@ -33,13 +32,12 @@ class AIState(base_state.BaseState):
         return base_state.OK
 
     async def get_response(self, user_id, prompt):
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                    f"{AI_URL}/api/get_response",
-                    json=json.dumps({"user_id": user_id, "text": prompt}, default=custom_default),
-                    #headers={"Content-Type": "application/json"}
-                ) as resp:
-                    res = await resp.json()
-                    logging.info(f"AI resp: {res}")
-                    return res['text']
+        async with http.session("ai").post(
+                f"{AI_URL}/api/get_response",
+                json=codec.dumps({"user_id": user_id, "text": prompt}),
+                #headers={"Content-Type": "application/json"}
+            ) as resp:
+                res = await resp.json()
+                logging.info(f"AI resp: {res}")
+                return res['text']
 
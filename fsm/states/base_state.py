@@ -1,16 +1,17 @@
-from server_logic.definitions import Context, SenderTask, ExecutionTask
+from server_logic.definitions import Context, SenderTask, ExecutionTask, Snapshot, freeze
 from strings import Strings, StringAccessor, TextPromise, Button
 from settings import tokens, ROOT_PATH
 from server_logic import NLUWorker
 from translation import Translator
+from fsm.delivery import DeliveryQueue
+from fsm.channels import channels
+from http_client import http
 from aiohttp import ClientSession
 from db import User, Database
 from typing import Union, Optional
 import aiofiles
 import asyncio
 import logging
-import copy
-import json
 import os
 
 
@@ -38,13 +39,6 @@ class GO_TO_STATE:
         return self.status == other.status
 
 
-class PromisesEncoder(json.JSONEncoder):
-    def default(self, o):
-        if isinstance(o, TextPromise):
-            return str(o)
-        return json.JSONEncoder.default(self, o)
-
-
 class BaseState(object):
     """
     This class is a parent-class for all state handlers, it provides:
@@ -55,7 +49,7 @@ class BaseState(object):
         - interface to the database
         - interface to the NLU (Natural Language Understanding unit - https://github.com/HumanbiOS/rasa)
         - automatic requests queueing
-        - automatic database updates for the `User` object
+        - automatic database updates for the `User` object (once per message, see `fsm/unit_of_work.py`)
 
     Note 0:
         In the text there are some special words:
@@ -89,6 +83,8 @@ class BaseState(object):
     db = Database()
     nlu = NLUWorker(tr)
     STRINGS = Strings(tr, db)
+    # Retries messages that frontends failed to receive
+    outbox = DeliveryQueue(db, channels)
     # Data buffer that is assigned to when the class is initialized, stores reference to the relevant Botsociety Data 
     bots_data = None
 
@@ -106,6 +102,8 @@ class BaseState(object):
         self.random_tasks = list()
         # Keeps execution queue
         self.execution_queue = list()
+        # Last sent payload, next one shares everything that didn't change with it
+        self.__snapshot: Optional[Snapshot] = None
         # Create language variable
         self.__language = None
         self.strings = None
@@ -137,13 +135,10 @@ class BaseState(object):
             # Execute state method
             status = await self.entry(context, user, self.db)
         except Exception as e:
-            # Do not commit to database if something went wrong
+            # Do not commit to database if something went wrong (all changes of the message are rolled back)
             status = OK(commit=False)
             # Log exception
             logging.exception(e)
-        # Commit changes to database
-        if status.commit:
-            await self.db.commit_user(user=user)
         # @Important: Fulfill text promises
         if self.strings.promises:
             await self.strings.fill_promises()
@@ -173,13 +168,10 @@ class BaseState(object):
             # Execute state method
             status = await self.process(context, user, self.db)
         except Exception as e:
-            # Do not commit to database if something went wrong
+            # Do not commit to database if something went wrong (all changes of the message are rolled back)
             status = OK(commit=False)
             # Log exception
             logging.exception(e)
-        # Commit changes to database
-        if status.commit:
-            await self.db.commit_user(user=user)
         # @Important: Fulfill text promises
         if self.strings.promises:
             await self.strings.fill_promises()
@@ -317,15 +309,14 @@ class BaseState(object):
             os.mkdir(os.path.join(self.media_path, *folders))
         # Full file path with filename
         filepath = os.path.join(self.media_path, *folders, filename)
-        # Initiate aiohttp sessions, get file
-        async with ClientSession() as session:
-            async with session.get(url) as response:
-                # Open file with aiofiles and start steaming bytes, write to the file
-                logging.debug(f"Downloading file: {url} to {filepath}")
-                async with aiofiles.open(filepath, 'wb') as f:
-                    async for chunk in response.content.iter_any():
-                        await f.write(chunk)
-                logging.debug(f"Finished download [{filepath}]")
+        # Get file with the shared pool of connections
+        async with http.session("media").get(url) as response:
+            # Open file with aiofiles and start steaming bytes, write to the file
+            logging.debug(f"Downloading file: {url} to {filepath}")
+            async with aiofiles.open(filepath, 'wb') as f:
+                async for chunk in response.content.iter_any():
+                    await f.write(chunk)
+            logging.debug(f"Finished download [{filepath}]")
         return filepath
 
     # @Important: check if downloaded file exist
@@ -354,38 +345,22 @@ class BaseState(object):
     # @Important: command to actually send all collected requests from `process` or `entry`
     async def _collect(self):
         results = list()
-        async with ClientSession(json_serialize=lambda o: json.dumps(o, cls=PromisesEncoder)) as session:
-            # @Important: Since asyncio.gather order is not preserved, we don't want to run them concurrently
-            # @Important: so, gather tasks that were tagged with "allow_gather".
-            
-            # @Important: Group tasks by the value of "size" for the sake of not hitting front end too hard
-            size = 30
-            for coeff in range(len(self.random_tasks[::size])):
-                results.extend(await asyncio.gather(*(self._send(r_task, session) for r_task in self.random_tasks[size*coeff:size*(coeff+1)])))
-            # Send ordinary tasks
-            for each_task in self.tasks:
-                res = await self._send(each_task, session)
-                results.append(res)
+        session = http.session("frontend")
+        # @Important: Since asyncio.gather order is not preserved, we don't want to run them concurrently
+        # @Important: so, gather tasks that were tagged with "allow_gather".
+        
+        # @Important: Group tasks by the value of "size" for the sake of not hitting front end too hard
+        size = 30
+        for coeff in range(len(self.random_tasks[::size])):
+            results.extend(await asyncio.gather(*(self._send(r_task, session) for r_task in self.random_tasks[size*coeff:size*(coeff+1)])))
+        # Send ordinary tasks, in order (several tasks to the same frontend might go in one request)
+        results.extend(await self.outbox.send_all(self.tasks, session))
         return results
 
     # @Important: Real send method, takes SenderTask as argument
     async def _send(self, task: SenderTask, session: ClientSession):
-        # Takes instance data holder object with the name from the tokens storage, extracts url
-        url = tokens[task.service].url
-        # Unpack context, set headers (content-type: json)
-        async with session.post(url, json=task.context, headers=self.HEADERS) as resp:
-            # If reached server - log response
-            if resp.status == 200:
-                pass  # [DEBUG]
-                #result = await resp.json()
-                #if result:
-                #    logging.info(f"Sending task status: {result}")
-                #    return result
-                #else:
-                #    logging.info(f"Sending task status: No result")
-            # Otherwise - log error
-            else:
-                logging.error(f"[ERROR]: Sending task (service={task.service}, context={task.context}) status {await resp.text()}")
+        # @Important: never raises, undelivered task is saved and retried in the background
+        return await self.outbox.send(task, session)
 
     # @Important: `send` METHOD THAT ALLOWS TO SEND PAYLOAD TO THE USER
     def send(self, to_entity: Union[User, str], context: Context, allow_gather=False):
@@ -395,7 +370,7 @@ class BaseState(object):
 
         Args:
         to_entity (User, str): user object to send message to, or just service name
-        context (Context): request context that is send to the user. The object is deep copied so it
+        context (Context): request context that is send to the user. The request is snapshotted so it
                            can't be changed further in code (reliable consistency for multiple requests)
         """
         # @Important: [Explanation to the code below]:
@@ -410,7 +385,10 @@ class BaseState(object):
         else:
             service = to_entity['via_instance']
 
-        task = SenderTask(service, copy.deepcopy(context.__dict__['request']))
+        # @Important: snapshot shares unchanged parts with the previous one, so sending the same request
+        # @Important: to many chats copies only the `chat` for each of them, instead of the whole request
+        self.__snapshot = freeze(context.__dict__['request'], self.__snapshot)
+        task = SenderTask(service, self.__snapshot)
         if allow_gather:
             self.random_tasks.append(task)
         else:
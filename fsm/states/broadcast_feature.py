@@ -1,9 +1,13 @@
+import functools
 import ast
-from boto3.dynamodb.conditions import Attr
 
 from . import base_state
-from server_logic.definitions import Context
-from db import User
+from server_logic.definitions import Context, SenderTask, Snapshot, freeze
+from settings import BROADCAST_RATE, BROADCAST_CONCURRENCY
+from strings import StringAccessor
+from fsm.broadcast import Broadcast
+from http_client import http
+from db import User, Target, plan_targets
 from db.enums import PermissionLevel
 
 
@@ -53,9 +57,14 @@ class BroadcastingState(base_state.BaseState):
                 # Targets are not parseable
                 context['request']['message']['text'] = self.strings["broadcast_targets_error"]
             else:
+                # Let broadcaster know how many users it's going to reach (and how expensive it is) before sending
+                plan = await plan_targets(db, self._targets(broadcasting_to))
+                context['request']['message']['text'] = self.strings["broadcast_estimate"].format(plan.describe())
+                self.send(user, context)
                 # Request broadcast message
                 context['request']['message']['text'] = self.strings["broadcast_get_message"]
                 user["context"]["broadcasting_to"] = broadcasting_to
+                user["context"]["broadcasting_index"] = plan.key
                 user["context"]["broadcasting"] = "send"
 
             context['request']['buttons'] = []
@@ -65,21 +74,24 @@ class BroadcastingState(base_state.BaseState):
             return base_state.OK
 
         elif user["context"]["broadcasting"] == "send":
-            # Don't forget to await coroutine
             context['request']['buttons'] = []
             context['request']['has_buttons'] = False
-            count = 0
-            async for target in self._get_targets(user["context"]["broadcasting_to"], db):
-                context['request']['chat']['chat_id'] = int(target['user_id'])
-                # TODO Should use allow_gather instead, but it's functional only in kitty-dev yet
-                self.send(user, context)
-                # self.send(user, context, allow_gather=True)
-                count += 1
-            context['request']['message']['text'] = self.strings["broadcast_complete"].format(count)
+            # @Important: broadcast runs in the background, so the worker isn't stalled by a big user base;
+            # @Important: broadcaster gets the progress reports to the same chat
+            message = freeze(context['request'])
+            report = functools.partial(self._report_progress, user['via_instance'], user['language'], message)
+            # Same plan that was estimated
+            plan = await plan_targets(db, self._targets(user["context"]["broadcasting_to"]), estimate=False,
+                                      key=user["context"].get("broadcasting_index"))
+            Broadcast(
+                db, self.outbox, plan, message, report, rate=BROADCAST_RATE, concurrency=BROADCAST_CONCURRENCY
+            ).start()
+            context['request']['message']['text'] = self.strings["broadcast_started"]
             self.send(user, context)
             # Not strictly needed, but it's still a good idea to remove state specific data
             del user["context"]["broadcasting"]
             del user["context"]["broadcasting_to"]
+            user["context"].pop("broadcasting_index", None)
             prev = user["context"]["broadcasting_state"]
             del user["context"]["broadcasting_state"]
             return base_state.GO_TO_STATE(prev)
@@ -98,14 +110,14 @@ class BroadcastingState(base_state.BaseState):
                 cond = cond[1:]
             mode = None
             for i, char in enumerate(cond):
-                if char in "=<>~{}":
+                if char in "=<>{}":
                     mode = char
                     key = cond[:i]
                     try:
                         value = ast.literal_eval(cond[i + 1:])
                         if not isinstance(value, (str, int)):
                             if isinstance(value, list):
-                                if any(lambda item: not isinstance(item, (str, int)), value):
+                                if any(not isinstance(item, (str, int)) for item in value):
                                     value = cond[i + 1:]
                             else:
                                 value = cond[i + 1:]
@@ -117,26 +129,15 @@ class BroadcastingState(base_state.BaseState):
             data[key] = [invert, mode, value]  # dynamodb can't serialise sets
         return data
 
-    def _get_targets(self, parsed_targets, db):
-        overall_cond = None
-        for i, (key, (invert, type_, value)) in enumerate(parsed_targets.items()):
-            cond = None
-            attr = Attr(key)
-            if type_ == "=":
-                cond = attr.eq(value)
-            elif type_ == "<":
-                cond = attr.lt(value)
-            elif type_ == ">":
-                cond = attr.lte(value)
-            elif type_ == "{":
-                cond = attr.is_in(value)
-            elif type_ == "}":
-                cond = attr.contains(value)
-            if invert:
-                cond = ~cond
-            if overall_cond is None:
-                overall_cond = cond
-            else:
-                overall_cond &= cond
-        # Return async generator
-        return db.scan_users(overall_cond, "via_instance, user_id")
+    async def _report_progress(self, service: str, language: str, message: Snapshot, job: Broadcast):
+        strings = StringAccessor(language or "en", self.STRINGS)
+        text = strings[f"broadcast_{job.outcome()}"].format(job.sent, job.failed)
+        if strings.promises:
+            await strings.fill_promises()
+        payload = Snapshot(message)
+        payload['message'] = dict(message['message'], text=text)
+        await self.outbox.send(SenderTask(service, payload), http.session("frontend"))
+
+    @staticmethod
+    def _targets(parsed_targets) -> list:
+        return [Target(key, invert, mode, value) for key, (invert, mode, value) in parsed_targets.items()]
@@ -0,0 +1,66 @@
+from db import Database, User
+from collections import Counter
+from typing import Optional
+import copy
+
+
+class UnitOfWork(object):
+    """
+    Changes of the user made while one inbound message is handled, saved with a single write.
+
+    A message can go through a chain of states (`GO_TO_STATE`), each of them changes the same `user`
+    object. States report with their status whether their changes should be saved (`record`);
+    `complete` writes the user once, after the whole chain, and only the attributes that changed
+    since it was read (`Database.save_user`). If any state of the chain failed, all changes of the
+    chain are rolled back, the user (in memory and in the database) stays as it was at the last
+    `checkpoint` (as it was read, by default).
+    """
+    # Counters of all units of work (of this process)
+    stats = Counter()
+
+    def __init__(self, db: Database, user: User, new: bool = False):
+        """
+        Args:
+            db (Database): database to write the user to
+            user (User): user object the states work with
+            new (bool): user isn't in the database yet
+        """
+        self.db = db
+        self.user = user
+        self.commit = False
+        self.failed = False
+        # User as it's in the database
+        self.stored: Optional[User] = None if new else copy.deepcopy(user)
+        self.restore_point: Optional[User] = self.stored
+
+    def checkpoint(self):
+        """Changes made so far are saved even if the states fail (registration, new `via_instance`)"""
+        self.restore_point = copy.deepcopy(self.user)
+        self.commit = True
+
+    def record(self, status):
+        """Takes status of the state (`OK`, `GO_TO_STATE`), a status without `commit` means the state failed"""
+        if status.commit:
+            self.commit = True
+        else:
+            self.failed = True
+
+    def rollback(self):
+        """Restores the user object to the restore point (it's shared, so in place)"""
+        self.user.clear()
+        self.user.update(copy.deepcopy(self.restore_point))
+
+    async def complete(self):
+        self.stats['messages'] += 1
+        if self.failed:
+            self.stats['rollbacks'] += 1
+            if self.restore_point is None:
+                # New user, nothing to keep
+                return
+            self.rollback()
+        if not self.commit:
+            return
+        if await self.db.save_user(self.user, self.stored):
+            self.stats['writes'] += 1
+        else:
+            self.stats['unchanged'] += 1
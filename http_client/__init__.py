@@ -0,0 +1,100 @@
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, TraceConfig
+from collections import defaultdict, Counter
+from typing import Dict, Tuple
+import asyncio
+import logging
+import codec
+
+
+class HttpClient(object):
+    """
+    Process-wide pool of http connections, one `ClientSession` per destination (frontends, translator, rasa, ...).
+
+    Sessions keep connections alive and cache dns, so the outbound requests don't pay for tcp/tls setup
+    each time. Every destination has its own connection limits and timeouts (see `DESTINATIONS`).
+    Sessions are created lazily, inside of the running loop; `close` has to be awaited on shutdown.
+    """
+    # name -> (connector kwargs, timeout kwargs)
+    DESTINATIONS = {
+        "frontend": ({"limit": 100, "limit_per_host": 50}, {"total": 10}),
+        "translator": ({"limit": 20, "limit_per_host": 20}, {"total": 15}),
+        "rasa": ({"limit": 20, "limit_per_host": 20}, {"total": 10}),
+        "ai": ({"limit": 10, "limit_per_host": 10}, {"total": 60}),
+        "botsociety": ({"limit": 2, "limit_per_host": 2}, {"total": 30}),
+        # Files can be big, so limit time of the each read instead of the whole download
+        "media": ({"limit": 20, "limit_per_host": 10}, {"total": None, "sock_connect": 10, "sock_read": 60}),
+    }
+    DNS_CACHE_TTL = 300
+    KEEPALIVE_TIMEOUT = 30
+
+    def __init__(self):
+        self.__sessions: Dict[str, Tuple[asyncio.AbstractEventLoop, ClientSession]] = dict()
+        self.stats: Dict[str, Counter] = defaultdict(Counter)
+
+    def session(self, destination: str) -> ClientSession:
+        """Returns shared session of the destination, don't close it (or use it as context manager)"""
+        loop = asyncio.get_event_loop()
+        loop_, session = self.__sessions.get(destination, (None, None))
+        # @Important: session is bound to the loop it was created in
+        if session is None or session.closed or loop_ is not loop:
+            session = self.__create(destination)
+            self.__sessions[destination] = (loop, session)
+        return session
+
+    def __create(self, destination: str) -> ClientSession:
+        connector_kwargs, timeout_kwargs = self.DESTINATIONS[destination]
+        connector = TCPConnector(
+            ttl_dns_cache=self.DNS_CACHE_TTL,
+            keepalive_timeout=self.KEEPALIVE_TIMEOUT,
+            **connector_kwargs
+        )
+        return ClientSession(
+            connector=connector,
+            timeout=ClientTimeout(**timeout_kwargs),
+            json_serialize=lambda obj: codec.dumps(obj),
+            trace_configs=[self.__trace(destination)]
+        )
+
+    def __trace(self, destination: str) -> TraceConfig:
+        stats = self.stats[destination]
+        trace = TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            stats['requests'] += 1
+
+        async def on_request_exception(session, ctx, params):
+            stats['errors'] += 1
+
+        async def on_connection_create_end(session, ctx, params):
+            stats['new_connections'] += 1
+
+        async def on_connection_reuseconn(session, ctx, params):
+            stats['reused_connections'] += 1
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_request_exception.append(on_request_exception)
+        trace.on_connection_create_end.append(on_connection_create_end)
+        trace.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace
+
+    def metrics(self) -> dict:
+        result = dict()
+        for destination, counters in self.stats.items():
+            connections = counters['new_connections'] + counters['reused_connections']
+            result[destination] = dict(counters)
+            result[destination]['reuse_rate'] = counters['reused_connections'] / connections if connections else None
+        return result
+
+    async def close(self):
+        sessions, self.__sessions = self.__sessions, dict()
+        for _, session in sessions.values():
+            if not session.closed:
+                try:
+                    await session.close()
+                except Exception as e:
+                    logging.exception(e)
+
+
+http = HttpClient()
+
+__all__ = ['HttpClient', 'http']
@@ -1,17 +1,22 @@
 from settings import ROOT_PATH, Config, N_CORES, DEBUG, BOTSOCIETY_API_KEY
 from server_logic.utils.parser import parse_api, save_file
-from sanic.response import json, html, redirect, empty
+from sanic.response import json as json_response, html, redirect, empty
 from server_logic.definitions import Context
 from fsm.handler import Worker
+from fsm.channels import channels, FrontendChannel
+from fsm.broadcast import Broadcast
+from http_client import http
 from settings import tokens
+from websockets import ConnectionClosed
 from sanic import Sanic
 from db import Database
 import urllib.parse
 import datetime
-import aiohttp
+import asyncio
 import logging
+import functools
 import secrets
-import ujson
+import codec
 import sanic
 import uuid
 import os
@@ -19,11 +24,30 @@ import re
 
 
 app = Sanic(name="HumanBios-Server")
+# Responses are encoded by the same codec as everything else (looked up on each call, backend can be switched)
+json = functools.partial(json_response, dumps=lambda body, **kwargs: codec.dumps(body))
 handler = Worker()
-handler.start()
 database = Database()
 
 
+@app.listener('before_server_start')
+async def start_worker(app, loop):
+    # Dispatcher lives on the sanic loop of each worker process
+    handler.start()
+    # Keep frontend sessions of this process in sync with the other processes
+    tokens.set_loader(database.all_frontend_sessions)
+    asyncio.ensure_future(tokens.refresh_loop())
+
+
+@app.listener('after_server_stop')
+async def close_connections(app, loop):
+    # Let pooled connections close gracefully, instead of being dropped with the loop
+    await http.close()
+    # Held back user writes (USER_CACHE_WRITE_BEHIND)
+    await database.flush_users()
+    database.close()
+
+
 @app.route('/api/webhooks/botsociety')
 async def botsociety_webhook(request):
     args = request.args
@@ -40,9 +64,8 @@ async def botsociety_webhook(request):
         "user_id": user_id
     }
     # Get data from api
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, headers=h) as resp:
-            data = await resp.json()
+    async with http.session("botsociety").get(url, headers=h) as resp:
+        data = await resp.json()
     # [DEBUG]
     # logging.info(data)
     # Parse/Save data
@@ -51,50 +74,157 @@ async def botsociety_webhook(request):
     handler.reload_file()
     return empty()
 
-@app.route('/api/process_message', methods=['POST'])
-async def data_handler(request):
-    # get data from request
-    data = request.json
-    if data is None:
-        return json({"status": 403, "message": "expected json"})
-
+async def authorize_instance(data: dict):
+    """Returns error payload if the frontend instance of the request is not authorized, otherwise None"""
     instance = data.get("via_instance")
-    if not instance or instance not in tokens:
-        return json({"status": 403, "message": "instance is not registered"})
+    # the session might be registered by another worker process and only saved in the database so far
+    if not instance or instance == "server" or not await tokens.ensure(instance):
+        return {"status": 403, "message": "instance is not registered"}
 
     token = tokens.get(instance, '')
-    # the session might be saved in the database
-    if not token:
-        potential_session = await database.get_session(data.get('via_instance'))
-        if potential_session:
-            # it is, we save it in the cache and set the token to the retrieved values
-            tokens[potential_session["name"]] = Config(potential_session["token"], potential_session["url"])
-            token = tokens.get(data.get('via_instance'))
     # `not token` to avoid `'' == ''`
     if not token or not (data.get("security_token", '') == token.token):
         # add custom 403 error code
-        return json({"status": 403, "message": "token unauthorized (bad token)"})
+        return {"status": 403, "message": "token unauthorized (bad token)"}
 
+
+def ingest(data) -> dict:
+    """Validates single (already authorized) message and passes it to the handler, returns status payload"""
     # build into context
     result = Context.from_json(data)
     # verify context `required` attributes
     if not result.validated:
         # add custom 403 error code
-        return json({"status": 403, "message": result.error})
+        return {"status": 403, "message": result.error}
     # Validated object
     ctx = result.object
     # Replace security token to the server's after validation
     ctx.replace_security_token()
     # process message
-    handler.process(ctx)
+    if not handler.process(ctx):
+        # Backlog is full -> ask frontend to retry later
+        return handler.admission.rejection(message="too many requests")
+    return ctx.ok
+
+
+def too_many_requests(payload: dict):
+    return json(payload, status=429, headers=handler.admission.headers())
+
+
+@app.route('/api/process_message', methods=['POST'])
+async def data_handler(request):
+    # get data from request
+    data = request.load_json(loads=codec.loads)
+    if data is None:
+        return json({"status": 403, "message": "expected json"})
+
+    error = await authorize_instance(data)
+    if error:
+        return json(error)
+
+    status = ingest(data)
+    if status["status"] == 429:
+        return too_many_requests(status)
     # return context
-    return json(ctx.ok)
+    return json(status)
+
+
+@app.route('/api/process_messages', methods=['POST'])
+async def batch_data_handler(request):
+    """
+    Same as `/api/process_message`, but for many messages of the same instance at once.
+    Expects `{"via_instance": ..., "security_token": ..., "messages": [context, ...]}`, the instance is
+    authorized once for the whole batch. Each message is validated on its own, response keeps the order:
+    `{"status": 200, "results": [{"status": ...}, ...]}`
+    """
+    # get data from request
+    data = request.load_json(loads=codec.loads)
+    if not isinstance(data, dict) or not isinstance(data.get("messages"), list):
+        return json({"status": 403, "message": "expected json with the list of messages"})
+
+    error = await authorize_instance(data)
+    if error:
+        return json(error)
+
+    results = list()
+    for each_message in data["messages"]:
+        if not isinstance(each_message, dict):
+            results.append({"status": 403, "message": "message is not an object"})
+            continue
+        # Messages inherit credentials of the batch, but can't claim another instance
+        if each_message.setdefault("via_instance", data["via_instance"]) != data["via_instance"]:
+            results.append({"status": 403, "message": "message belongs to another instance"})
+            continue
+        each_message["security_token"] = data["security_token"]
+        results.append(ingest(each_message))
+
+    # Nothing accepted because the backlog is full -> let frontend know when to retry
+    if results and all(each_result["status"] == 429 for each_result in results):
+        return too_many_requests(handler.admission.rejection(results=results))
+    return json({"status": 200, "results": results})
+
+
+@app.websocket('/api/ws')
+async def frontend_channel(request, ws):
+    """
+    Optional long-lived channel of a frontend instance, instead of (or along with) the http webhooks.
+    First message must be `{"type": "auth", "via_instance": ..., "security_token": ...}`, then:
+        - frontend sends `{"type": "message", "id": ..., "context": {...}}` and gets `{"type": "ack", "id": ..., "status": ...}`
+        - server sends `{"type": "deliver", "id": ..., "payload": ...}` and expects `{"type": "ack", "id": ..., "status": 200}`
+    """
+    try:
+        auth = codec.loads(await asyncio.wait_for(ws.recv(), FrontendChannel.AUTH_TIMEOUT))
+    except (asyncio.TimeoutError, ValueError):
+        return
+    error = await authorize_instance(auth) if isinstance(auth, dict) else {"status": 403, "message": "expected json"}
+    if error:
+        await ws.send(codec.dumps(dict(error, type="auth")))
+        return
+    instance = auth["via_instance"]
+    channel = channels.open(instance, ws)
+    try:
+        await ws.send(codec.dumps({"type": "auth", "status": 200}))
+        while True:
+            try:
+                message = codec.loads(await ws.recv())
+            except ValueError:
+                await ws.send(codec.dumps({"type": "error", "status": 403, "message": "expected json"}))
+                continue
+            if not isinstance(message, dict):
+                continue
+            if message.get("type") == "ack":
+                channel.ack(message.get("id"), message.get("status", 200))
+            elif message.get("type") == "message" and isinstance(message.get("context"), dict):
+                context = message["context"]
+                # Channel is authorized already, same as with the batch ingest
+                context["via_instance"] = instance
+                context["security_token"] = auth["security_token"]
+                await ws.send(codec.dumps(dict(ingest(context), type="ack", id=message.get("id"))))
+            else:
+                await ws.send(codec.dumps({"type": "error", "status": 403, "id": message.get("id"),
+                                           "message": "unknown message type"}))
+    except ConnectionClosed:
+        pass
+    finally:
+        channels.close(instance, channel)
+
+
+@app.route('/api/metrics')
+async def metrics(request):
+    """Expects the server's token in the `Authorization: Bearer <token>` header"""
+    # @Important: not in the query string, urls end up in the access logs of the proxies
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme != "Bearer" or not secrets.compare_digest(token.encode(), tokens['server'].encode()):
+        return json({"status": 403, "message": "token unauthorized"})
+    return json({"status": 200, "ingest": handler.stats(), "delivery": handler.delivery_stats(),
+                 "http": http.metrics(), "channels": channels.metrics(),
+                 "broadcasts": Broadcast.stats(), "database": database.metrics()})
 
 
 @app.route('/api/setup', methods=['POST'])
 async def worker_setup(request):
     # get data from request
-    data = request.json
+    data = request.load_json(loads=codec.loads)
     # If not data -> return "expected json"
     if not data:
         return json({"status": 403, "message": "expected json"})
@@ -114,26 +244,20 @@ async def worker_setup(request):
     # check if session is already saved, then this means the frontend was restarted and we can ignore this
     # TODO: Support a changed key where the instance can say that it didnt restart,
     # TODO: rather changed the other variables. Potentially its own endpoint
-    check = False
-    # if its in the cache we take it from there
-    for session_name in tokens:
-        # for reasons we save the server token in this cache as well so we have to ignore it in here
-        if session_name == "server":
-            continue
-        if tokens[session_name].url == url:
-            check = session_name
-            break
-    # it was not in the cache, maybe its in the database
-    if not check:
-        all_sessions = await database.all_frontend_sessions()
-        for session in all_sessions:
-            # url is the unique identifier here
-            if session["url"] == url:
-                tokens[session["name"]] = Config(session["token"], session["url"])
-                check = session["name"]
+    # Frontend can take all messages of one turn in a single request
+    bulk = data.get("bulk", False)
+    if not isinstance(bulk, bool):
+        return json({"status": 403, "message": "bulk must be boolean"})
+    # url is the unique identifier here; if it's not in the registry, maybe it's in the database
+    await tokens.ensure(url=url)
+    check = tokens.by_url(url)
     # check is set to the new name which is way better then giving it its own variable
     if check:
-        return json({"status": 200, "name": check, "token": tokens[check].token})
+        # Restarted frontend might have been upgraded (or downgraded)
+        if tokens[check].bulk != bulk:
+            tokens[check] = tokens[check]._replace(bulk=bulk)
+            await database.update_session_bulk(check, bulk)
+        return json({"status": 200, "name": check, "token": tokens[check].token, "bulk": bulk})
     # continue setting up the new session
     # Pull broadcast channel from the request
     broadcast_entity = data.get("broadcast")
@@ -160,7 +284,7 @@ async def worker_setup(request):
     name = secrets.token_hex(10)
     # [DEBUG]: assert len(name) == 20
 
-    config_obj = Config(new_token, url)
+    config_obj = Config(new_token, url, bulk)
     tokens[name] = config_obj
     # Return useful data back to the caller
     await database.create_session({
@@ -169,9 +293,10 @@ async def worker_setup(request):
         "url": url,
         "broadcast": broadcast_entity,
         "psychological_room": psychological_room,
-        "doctor_room": doctor_room
+        "doctor_room": doctor_room,
+        "bulk": bulk
     })
-    return json({"status": 200, "name": name, "token": new_token})
+    return json({"status": 200, "name": name, "token": new_token, "bulk": bulk})
 
 
 if __name__ == '__main__':
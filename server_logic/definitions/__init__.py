@@ -1,5 +1,6 @@
 from .user_identity import UserIdentity
 from .sender_task import SenderTask, ExecutionTask
 from .context import Context
+from .snapshot import Snapshot, freeze
 
-__all__ = ["UserIdentity", "SenderTask", "ExecutionTask", "Context"]
+__all__ = ["UserIdentity", "SenderTask", "ExecutionTask", "Context", "Snapshot", "freeze"]
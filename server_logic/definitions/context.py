@@ -1,10 +1,12 @@
 from jsonschema import Draft7Validator, validators, ValidationError
 
+from .fast_validator import compile_schema, UnsupportedSchema
 from .serializable import Serializable
 from settings import ROOT_PATH, tokens
 from collections import namedtuple
 from copy import copy, deepcopy
 from . import UserIdentity
+import logging
 import json
 import os
 
@@ -22,7 +24,8 @@ def extend_with_default(validator_class):
     def set_defaults(validator, properties, instance, schema):
         for property_, sub_schema in properties.items():
             if "default" in sub_schema:
-                instance.setdefault(property_, sub_schema["default"])
+                # @Important: copy, so requests don't share (and modify) the default object of the schema
+                instance.setdefault(property_, deepcopy(sub_schema["default"]))
                 if isinstance(property_, dict):
                     for sub_property_, sub_sub_schema in sub_schema["properties"]:
                         instance[property_][sub_property_] = sub_sub_schema["default"]
@@ -44,21 +47,34 @@ SCHEMA = load(os.path.join(ROOT_PATH, 'server_logic', 'schema.json'))
 # Validator with defaults
 DefaultValidatingDraft7Validator = extend_with_default(Draft7Validator)
 Validator = DefaultValidatingDraft7Validator(schema=SCHEMA)
+
+
+def schema_validate(json_ish):
+    """Validates (and fills defaults) with jsonschema, returns error message or None"""
+    try:
+        Validator.validate(json_ish)
+    except ValidationError as e:
+        return e.message
+
+
+# Same validation, but compiled ahead of time into plain python checks (much faster);
+# jsonschema stays as a fallback in case schema gets keywords that the compiler doesn't support
+try:
+    fast_validate = compile_schema(SCHEMA, {"Context": lambda inst: isinstance(inst, Context)})
+except UnsupportedSchema as e:
+    logging.warning(f"Falling back to jsonschema validation of the context: {e}")
+    fast_validate = None
 ValidationResult = namedtuple("ValidationResult", ["validated", "object", "error"])
 
 
 class Context(Serializable):
     @classmethod
     def from_json(cls, json_ish):
-        validated = True
-        try:
-            # TODO: Disallow unfeatured properties?
-            # TODO: Or it will be too resource-consuming?
-            Validator.validate(json_ish)
-            error = False
-        except ValidationError as e:
-            validated = False
-            error = e.message
+        # TODO: Disallow unfeatured properties?
+        # TODO: Or it will be too resource-consuming?
+        error = (fast_validate or schema_validate)(json_ish)
+        validated = error is None
+        error = error or False
         if validated:
             obj = cls()
             # Set request value
@@ -0,0 +1,198 @@
+from typing import Any, Callable, Dict, Optional
+from copy import deepcopy
+import numbers
+
+
+# Compiled check: takes instance, fills defaults in-place, returns first error message or None
+Check = Callable[[Any], Optional[str]]
+
+
+class UnsupportedSchema(Exception):
+    """Schema uses keyword that compiler doesn't know, jsonschema validator has to be used instead"""
+
+
+# Keywords that don't affect validation
+ANNOTATIONS = {"default", "title", "description", "$comment", "examples"}
+
+
+def _is_number(instance):
+    return isinstance(instance, numbers.Number) and not isinstance(instance, bool)
+
+
+def _is_integer(instance):
+    if isinstance(instance, bool):
+        return False
+    if isinstance(instance, float):
+        return instance.is_integer()
+    return isinstance(instance, int)
+
+
+# Same semantics as Draft7 type checker of jsonschema
+TYPE_CHECKS: Dict[str, Callable[[Any], bool]] = {
+    "array": lambda instance: isinstance(instance, list),
+    "boolean": lambda instance: isinstance(instance, bool),
+    "integer": _is_integer,
+    "null": lambda instance: instance is None,
+    "number": _is_number,
+    "object": lambda instance: isinstance(instance, dict),
+    "string": lambda instance: isinstance(instance, str),
+}
+
+
+def _default_factory(value) -> Callable[[], Any]:
+    # @Important: each instance gets its own copy of mutable defaults, otherwise
+    # @Important: all requests would share (and modify) the very same dict/list of the schema
+    if isinstance(value, (dict, list)):
+        if not value:
+            return type(value)
+        return lambda: deepcopy(value)
+    return lambda: value
+
+
+def _compile_type(types, extra_types) -> Check:
+    if isinstance(types, str):
+        types = [types]
+    checks = list()
+    for each_type in types:
+        check = extra_types.get(each_type) or TYPE_CHECKS.get(each_type)
+        if check is None:
+            raise UnsupportedSchema(f"unknown type {each_type!r}")
+        checks.append(check)
+    reprs = ", ".join(repr(each_type) for each_type in types)
+
+    if len(checks) == 1:
+        only_check = checks[0]
+
+        def check_type(instance):
+            if not only_check(instance):
+                return f"{instance!r} is not of type {reprs}"
+    else:
+        def check_type(instance):
+            if not any(check(instance) for check in checks):
+                return f"{instance!r} is not of type {reprs}"
+    return check_type
+
+
+def _compile_required(required) -> Check:
+    required = list(required)
+
+    def check_required(instance):
+        if isinstance(instance, dict):
+            for property_ in required:
+                if property_ not in instance:
+                    return f"{property_!r} is a required property"
+    return check_required
+
+
+def _compile_properties(properties, extra_types) -> Check:
+    defaults = [(property_, _default_factory(sub_schema["default"])) for property_, sub_schema in properties.items()
+                if "default" in sub_schema]
+    checks = [(property_, compile_schema(sub_schema, extra_types)) for property_, sub_schema in properties.items()]
+
+    def check_properties(instance):
+        if not isinstance(instance, dict):
+            return
+        # @Important: defaults are set before validation, as the `properties` hook of the jsonschema validator does
+        for property_, default in defaults:
+            if property_ not in instance:
+                instance[property_] = default()
+        for property_, check in checks:
+            if property_ in instance:
+                error = check(instance[property_])
+                if error is not None:
+                    return error
+    return check_properties
+
+
+def _compile_items(items, extra_types) -> Check:
+    if not isinstance(items, dict):
+        raise UnsupportedSchema("only single schema `items` is supported")
+    check_item = compile_schema(items, extra_types)
+
+    def check_items(instance):
+        if isinstance(instance, list):
+            for item in instance:
+                error = check_item(item)
+                if error is not None:
+                    return error
+    return check_items
+
+
+def _error_one_of(instance, one_of, valid):
+    if not valid:
+        return f"{instance!r} is not valid under any of the given schemas"
+    if len(valid) > 1:
+        # jsonschema lists the other valid schemas first and the first valid one last
+        more_valid = [one_of[index] for index in valid[1:]] + [one_of[valid[0]]]
+        reprs = ", ".join(repr(schema) for schema in more_valid)
+        return f"{instance!r} is valid under each of {reprs}"
+
+
+def _compile_one_of(one_of, extra_types) -> Check:
+    # Most common case (`"oneOf": [{"type": "null"}, {"type": "string"}]`) is just a few type checks
+    if all(set(sub_schema) == {"type"} and isinstance(sub_schema["type"], str) for sub_schema in one_of):
+        type_checks = list()
+        for sub_schema in one_of:
+            check = extra_types.get(sub_schema["type"]) or TYPE_CHECKS.get(sub_schema["type"])
+            if check is None:
+                raise UnsupportedSchema(f"unknown type {sub_schema['type']!r}")
+            type_checks.append(check)
+
+        def check_one_of_types(instance):
+            valid = [index for index, check in enumerate(type_checks) if check(instance)]
+            if len(valid) != 1:
+                return _error_one_of(instance, one_of, valid)
+        return check_one_of_types
+
+    checks = [compile_schema(sub_schema, extra_types) for sub_schema in one_of]
+
+    def check_one_of(instance):
+        valid = [index for index, check in enumerate(checks) if check(instance) is None]
+        if len(valid) != 1:
+            return _error_one_of(instance, one_of, valid)
+    return check_one_of
+
+
+def compile_schema(schema: dict, extra_types: Dict[str, Callable[[Any], bool]] = None) -> Check:
+    """
+    Compiles json schema into single function, that validates instance and fills defaults
+    exactly like `Draft7Validator` extended with the default-setting `properties` hook does,
+    including the order of checks, so the first error message is the same.
+
+    Only the subset of keywords that our schema uses is supported: `type`, `required`,
+    `properties`, `items` and `oneOf`; anything else raises `UnsupportedSchema`.
+
+    Args:
+        schema (dict): json schema
+        extra_types (dict): additional type names mapped to the type check functions
+    """
+    extra_types = extra_types or {}
+    checks = list()
+    # @Important: keywords are checked in order of the schema, same as jsonschema does
+    for keyword, value in schema.items():
+        if keyword in ANNOTATIONS:
+            continue
+        if keyword == "type":
+            checks.append(_compile_type(value, extra_types))
+        elif keyword == "required":
+            checks.append(_compile_required(value))
+        elif keyword == "properties":
+            checks.append(_compile_properties(value, extra_types))
+        elif keyword == "items":
+            checks.append(_compile_items(value, extra_types))
+        elif keyword == "oneOf":
+            checks.append(_compile_one_of(value, extra_types))
+        else:
+            raise UnsupportedSchema(f"keyword {keyword!r} is not supported")
+
+    if not checks:
+        return lambda instance: None
+    if len(checks) == 1:
+        return checks[0]
+
+    def check_all(instance):
+        for check in checks:
+            error = check(instance)
+            if error is not None:
+                return error
+    return check_all
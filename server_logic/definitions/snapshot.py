@@ -0,0 +1,78 @@
+from typing import Any, Optional
+from copy import deepcopy
+
+# Values that are safe to share between snapshots as they are
+IMMUTABLE = (str, int, float, bool, type(None))
+_MISSING = object()
+
+
+class Snapshot(dict):
+    """
+    Read-only copy of the request payload, as it was at the moment of `BaseState.send`.
+
+    Parts that didn't change since the previous snapshot are shared with it (not copied), so
+    snapshots must never be modified. The serialized form is kept in `encoded` once computed.
+    """
+    __slots__ = ('encoded',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.encoded: Optional[str] = None
+
+
+def _freeze(value, base):
+    if isinstance(value, dict):
+        base = base if isinstance(base, dict) else None
+        # Stays None while everything is the same as in base, so unchanged dicts are not allocated at all
+        result = None
+        for key, item in value.items():
+            base_item = base.get(key, _MISSING) if base is not None else _MISSING
+            # Fast path (most of the values): the same immutable object as in the previous snapshot
+            if item is base_item and type(item) in IMMUTABLE:
+                frozen = item
+            else:
+                frozen = _freeze(item, base_item)
+            if result is not None:
+                result[key] = frozen
+            elif frozen is not base_item:
+                # First change, everything before it is the same as in base
+                result = dict()
+                for previous in value:
+                    if previous == key:
+                        break
+                    result[previous] = base[previous]
+                result[key] = frozen
+        if result is None:
+            if base is not None and len(base) == len(value):
+                return base
+            result = {key: base[key] for key in value} if base is not None else dict()
+        return result
+    if isinstance(value, list):
+        base = base if isinstance(base, list) else None
+        same = base is not None and len(base) == len(value)
+        result = list()
+        for index, item in enumerate(value):
+            base_item = base[index] if base is not None and index < len(base) else _MISSING
+            frozen = _freeze(item, base_item)
+            result.append(frozen)
+            same = same and frozen is base_item
+        return base if same else result
+    if type(value) in IMMUTABLE:
+        if value is base or (type(value) is type(base) and value == base):
+            return base
+        return value
+    # Anything else is copied, as before (`TextPromise` keeps itself on copy, so it's shared)
+    copied = deepcopy(value)
+    return base if copied is base else copied
+
+
+def freeze(value: dict, base: Snapshot = None) -> Snapshot:
+    """
+    Returns snapshot of the `value`, reusing every part of `base` (previous snapshot) that is still
+    equal to the same part of `value`. The cost is one walk over `value`, but only changed
+    dicts and lists are allocated, e.g. changing `chat.chat_id` allocates just the root and `chat`.
+    """
+    frozen = _freeze(value, base)
+    if frozen is base:
+        return base
+    return Snapshot(frozen)
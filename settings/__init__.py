@@ -1,26 +1,35 @@
 from .settings import CLOUD_TRANSLATION_API_KEY, AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY
 from .settings import SERVER_SECURITY_TOKEN
 from .settings import BOTSOCIETY_API_KEY
-from .settings import DATABASE_URL
+from .settings import DATABASE_URL, DATABASE_POOL_SIZE, DATABASE_BACKEND, DATABASE_RETRIES, USERS_INDEX_CAPACITY
 from .settings import ROOT_PATH
 from .settings import RASA_URL
 from .settings import N_CORES
+from .settings import MAX_CONCURRENT_USERS
+from .settings import MAX_QUEUE_SIZE, MAX_INSTANCE_QUEUE_SIZE, RETRY_AFTER
+from .settings import SESSION_REGISTRY_TTL
+from .settings import OUTBOUND_DEAD_LETTER_DAYS
+from .settings import LEASE_TIME, LEASE_BACKEND, CHECKBACK_PARTITIONS
+from .settings import BROADCAST_RATE, BROADCAST_CONCURRENCY
+from .settings import USER_CACHE_SIZE, USER_CACHE_TTL, USER_CACHE_WRITE_BEHIND, USER_GROUP_COMMIT_WINDOW
 from .settings import AI_URL
 from .settings import DEBUG
-from collections import namedtuple
+from .sessions import SessionRegistry, Config
 import logging
 import os
-Config = namedtuple("Config", ['token', 'url'])
 
-tokens = {
-    'server': SERVER_SECURITY_TOKEN,
-    # Bot for tests, don't touch
-    'tests_dummy_bot': Config('TEST_BOT_1111', 'http://dummy_url'),
-}
+tokens = SessionRegistry(SERVER_SECURITY_TOKEN, ttl=SESSION_REGISTRY_TTL)
+# Bot for tests, don't touch
+tokens['tests_dummy_bot'] = Config('TEST_BOT_1111', 'http://dummy_url')
 
 __all__ = ['tokens', 'ROOT_PATH', 'CLOUD_TRANSLATION_API_KEY', 'Config', 'N_CORES', 'DEBUG',
-           'DATABASE_URL', 'RASA_URL', 'AWS_SECRET_ACCESS_KEY', 'AWS_ACCESS_KEY_ID',
-           'BOTSOCIETY_API_KEY', 'AI_URL']
+           'DATABASE_URL', 'DATABASE_POOL_SIZE', 'DATABASE_BACKEND', 'DATABASE_RETRIES', 'USERS_INDEX_CAPACITY',
+           'RASA_URL',
+           'AWS_SECRET_ACCESS_KEY', 'AWS_ACCESS_KEY_ID',
+           'BOTSOCIETY_API_KEY', 'AI_URL', 'MAX_CONCURRENT_USERS', 'MAX_QUEUE_SIZE',
+           'MAX_INSTANCE_QUEUE_SIZE', 'RETRY_AFTER', 'SESSION_REGISTRY_TTL', 'SessionRegistry', 'OUTBOUND_DEAD_LETTER_DAYS',
+           'LEASE_TIME', 'LEASE_BACKEND', 'CHECKBACK_PARTITIONS', 'BROADCAST_RATE', 'BROADCAST_CONCURRENCY',
+           'USER_CACHE_SIZE', 'USER_CACHE_TTL', 'USER_CACHE_WRITE_BEHIND', 'USER_GROUP_COMMIT_WINDOW']
 
 
 # Logging
@@ -0,0 +1,111 @@
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+from collections import namedtuple
+import asyncio
+import logging
+import time
+
+# bulk: frontend accepts all messages of one turn in a single request (see server_logic/README.md)
+Config = namedtuple("Config", ['token', 'url', 'bulk'], defaults=[False])
+
+
+class SessionRegistry(object):
+    """
+    In-memory registry of the frontend sessions, indexed by instance name and by url.
+
+    Every sanic worker process has its own copy, kept in sync with the `Sessions` table:
+        - `refresh_loop` reloads all sessions every `ttl` seconds, so a session created by
+          another process becomes visible to this one in at most `ttl` seconds
+        - `ensure` reloads right away on a miss (at most once per `min_interval` seconds)
+
+    Behaves like a dict of `name -> Config` for the rest of the code, except the special
+    'server' key that keeps the security token of the server itself.
+    """
+
+    def __init__(self, server_token: str, ttl: float = 30, min_interval: float = 1):
+        self.server_token = server_token
+        self.ttl = ttl
+        self.min_interval = min_interval
+        self.__by_name: Dict[str, Config] = dict()
+        self.__by_url: Dict[str, str] = dict()
+        self.__loader: Optional[Callable[[], Awaitable[Iterable[dict]]]] = None
+        self.__lock = None
+        self.last_refresh = 0.0
+
+    # Dict-like access
+
+    def __getitem__(self, name: str):
+        if name == 'server':
+            return self.server_token
+        return self.__by_name[name]
+
+    def __setitem__(self, name: str, config: Config):
+        old = self.__by_name.get(name)
+        # Drop stale url index, if frontend moved
+        if old is not None and self.__by_url.get(old.url) == name:
+            del self.__by_url[old.url]
+        self.__by_name[name] = config
+        self.__by_url[config.url] = name
+
+    def __contains__(self, name: str):
+        return name == 'server' or name in self.__by_name
+
+    def __iter__(self):
+        yield 'server'
+        yield from list(self.__by_name)
+
+    def __len__(self):
+        return len(self.__by_name) + 1
+
+    def get(self, name: str, default=None):
+        if name in self:
+            return self[name]
+        return default
+
+    def supports_bulk(self, name: str) -> bool:
+        config = self.__by_name.get(name)
+        return config is not None and config.bulk
+
+    def by_url(self, url: str) -> Optional[str]:
+        """Returns name of the instance registered with the url"""
+        return self.__by_url.get(url)
+
+    # Syncing with database
+
+    def set_loader(self, loader: Callable[[], Awaitable[Iterable[dict]]]):
+        """Sets coroutine function that returns all saved `Session` items"""
+        self.__loader = loader
+
+    def load(self, sessions: Iterable[dict]):
+        for session in sessions:
+            self[session["name"]] = Config(session["token"], session["url"], bool(session.get("bulk", False)))
+
+    async def refresh(self):
+        if self.__loader is None:
+            return
+        if self.__lock is None:
+            self.__lock = asyncio.Lock()
+        # @Important: concurrent misses share one reload instead of scanning the table each
+        async with self.__lock:
+            if time.monotonic() - self.last_refresh < self.min_interval:
+                return
+            try:
+                self.load(await self.__loader())
+            except Exception as e:
+                logging.exception(f"Failed to refresh frontend sessions: {e}")
+            self.last_refresh = time.monotonic()
+
+    async def ensure(self, name: str = None, url: str = None) -> bool:
+        """Makes sure that the latest data is loaded, if instance (by name or url) is unknown; returns if it's known now"""
+        known = name in self if name is not None else self.by_url(url) is not None
+        if not known:
+            await self.refresh()
+            known = name in self if name is not None else self.by_url(url) is not None
+        return known
+
+    async def refresh_loop(self):
+        try:
+            while True:
+                await self.refresh()
+                await asyncio.sleep(self.ttl)
+        except asyncio.CancelledError:
+            logging.info("Session registry refresh loop stopped")
@@ -14,6 +14,15 @@ CLOUD_TRANSLATION_API_KEY = os.environ['CLOUD_TRANSLATION_API_KEY']
 
 AI_URL = os.environ['AI_URL']
 DATABASE_URL = os.environ['DATABASE_URL']
+# Threads (and connections) for the requests to the database, more requests at once wait for a free one
+DATABASE_POOL_SIZE = int(os.environ.get("DATABASE_POOL_SIZE", 32))
+# Attempts after a throttled database request, before it fails
+DATABASE_RETRIES = int(os.environ.get("DATABASE_RETRIES", 8))
+# Read and write capacity units of each of the Users indexes (at creation), see db/README.md for the sizing
+USERS_INDEX_CAPACITY = int(os.environ.get("USERS_INDEX_CAPACITY", 1))
+# "dynamodb", "memory" - tables kept in the process, "sqlite" - same, saved to the file at DATABASE_URL
+# (both "memory" and "sqlite" are for a single process only: local load testing, CI)
+DATABASE_BACKEND = os.environ.get("DATABASE_BACKEND", "dynamodb")
 
 AWS_ACCESS_KEY_ID = os.environ['AWS_ACCESS_KEY_ID']
 AWS_SECRET_ACCESS_KEY = os.environ['AWS_SECRET_ACCESS_KEY']
@@ -21,6 +30,7 @@ AWS_SECRET_ACCESS_KEY = os.environ['AWS_SECRET_ACCESS_KEY']
 RASA_URL = os.environ['RASA_URL']
 BOTSOCIETY_API_KEY = os.environ['BOTSOCIETY_API_KEY']
 
+# Sanic worker processes; messages of a user are kept in order only within one of them (see `fsm/executor.py`)
 N_CORES = int(os.environ['N_CORES'])
 try:
     DEBUG = bool(ast.literal_eval(os.environ['DEBUG']))
@@ -29,3 +39,42 @@ except (ValueError, SyntaxError) as e:
     logging.exception(f"Expected bool, got {os.environ['DEBUG']}")
 
 OWNER_HASH = os.environ.get("OWNER_HASH", None)
+
+# Max amount of users whose messages are processed at the same time (per worker process)
+MAX_CONCURRENT_USERS = int(os.environ.get("MAX_CONCURRENT_USERS", 256))
+
+# Max amount of accepted, but not yet processed messages (per worker process)
+MAX_QUEUE_SIZE = int(os.environ.get("MAX_QUEUE_SIZE", 10000))
+# Same limit, but for a single frontend instance, so one busy frontend can't take the whole queue
+MAX_INSTANCE_QUEUE_SIZE = int(os.environ.get("MAX_INSTANCE_QUEUE_SIZE", 2500))
+# Seconds frontends are asked to wait before retrying a rejected message
+RETRY_AFTER = int(os.environ.get("RETRY_AFTER", 1))
+# Seconds after which frontend sessions registered by other worker processes are picked up
+SESSION_REGISTRY_TTL = int(os.environ.get("SESSION_REGISTRY_TTL", 30))
+
+# Days dead-lettered outbound messages are kept for inspection, before DynamoDB expires them
+OUTBOUND_DEAD_LETTER_DAYS = int(os.environ.get("OUTBOUND_DEAD_LETTER_DAYS", 14))
+
+# Seconds a process holds the lease of a background job; another process takes over after it expires
+LEASE_TIME = int(os.environ.get("LEASE_TIME", 30))
+# "database" - leases are shared across all nodes, "local" - only within a process (single process setup)
+LEASE_BACKEND = os.environ.get("LEASE_BACKEND", "database")
+# Checkbacks are spread over this many partitions, each served by the node that holds its lease
+CHECKBACK_PARTITIONS = int(os.environ.get("CHECKBACK_PARTITIONS", 8))
+
+# Messages per second a broadcast is sent with (per broadcast), so frontends and their platforms aren't flooded
+BROADCAST_RATE = int(os.environ.get("BROADCAST_RATE", 30))
+# Max amount of broadcast messages being sent at the same time (per broadcast)
+BROADCAST_CONCURRENCY = int(os.environ.get("BROADCAST_CONCURRENCY", 16))
+
+# Users kept in memory of each process, so active conversations aren't read from the database on every message
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 10000))
+# Seconds a cached user is trusted; other processes' writes aren't seen meanwhile, so it's off (0) by default
+# when there are several processes (messages of one user may go to any of them)
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", 30 if N_CORES == 1 else 0))
+# Seconds user writes are held back and merged (0 - every message is written right away);
+# held back writes are lost if the process is killed
+USER_CACHE_WRITE_BEHIND = float(os.environ.get("USER_CACHE_WRITE_BEHIND", 0))
+# Seconds puts of the users (new users, big changes) of concurrent messages are gathered for, to be written
+# with a single BatchWriteItem request (0 - every put is a request of its own)
+USER_GROUP_COMMIT_WINDOW = float(os.environ.get("USER_GROUP_COMMIT_WINDOW", 0.005))
@@ -1,4 +1,5 @@
 from typing import Union, Text
+import codec
 
 
 class Button:
@@ -66,3 +67,7 @@ class TextPromise:
     def __copy__(self):
         return self
 
+
+# Promise is sent as its (filled) text, button as the text it was parsed from
+codec.register(TextPromise, str)
+codec.register(Button, lambda button: button.text)
@@ -0,0 +1,30 @@
+from strings.items import TextPromise, Button
+from decimal import Decimal
+import codec
+import pytest
+
+
+@pytest.fixture(params=list(codec.BACKENDS))
+def backend(request):
+    previous = codec.backend
+    codec.use(request.param)
+    yield request.param
+    codec.use(previous)
+
+
+def test_special_types_are_encoded(backend):
+    promise = TextPromise("key")
+    promise.fill("Hello")
+    data = {"id": Decimal("10"), "score": Decimal("0.5"), "text": promise, "button": Button("Yes", "yes"), 1: None}
+    assert codec.loads(codec.dumps(data)) == {"id": 10, "score": 0.5, "text": "Hello", "button": "Yes", "1": None}
+    assert codec.loads(codec.dumpb(data)) == codec.loads(codec.dumps(data))
+
+
+def test_unknown_type_raises(backend):
+    with pytest.raises(TypeError):
+        codec.dumps({"value": object()})
+
+
+def test_unknown_backend_raises():
+    with pytest.raises(ValueError):
+        codec.use("pickle")
@@ -0,0 +1,12 @@
+from db import Database
+
+
+def memory_database(path=None):
+    """Database on the in-process tables (or the SQLite file at `path`), separate for each call"""
+    return Database.__wrapped__(database_url=path, backend="sqlite" if path else "memory")
+
+
+def user(identity, **kwargs):
+    return {"identity": identity, "user_id": identity, "service": "telegram", "via_instance": "bot",
+            "first_name": "Test", "last_name": None, "username": None, "language": "en", "type": 0,
+            "permission_level": 0, "answers": {}, "states": ["ENDState"], "context": {}, **kwargs}
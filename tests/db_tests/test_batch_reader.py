@@ -0,0 +1,117 @@
+from db.batch_reader import BatchReader
+from db.executor import DatabaseExecutor
+from db.throttling import ThrottledClient
+from db import Database
+import asyncio
+
+
+class FakeBatchReader:
+    """`batch_get_item` of a table with items "0".."199", leaves a key unprocessed on the first `throttle` calls"""
+    def __init__(self, throttle=0):
+        self.throttle = throttle
+        self.calls = list()
+
+    def __call__(self, RequestItems):
+        keys = RequestItems['Users']['Keys']
+        assert len(keys) <= 100
+        self.calls.append([key['identity'] for key in keys])
+        unprocessed = list()
+        if self.throttle:
+            self.throttle -= 1
+            keys, unprocessed = keys[1:], keys[:1]
+        items = [{"identity": key['identity'], "states": []} for key in keys if int(key['identity']) < 200]
+        return {"Responses": {"Users": items},
+                "UnprocessedKeys": {"Users": {"Keys": unprocessed}} if unprocessed else {}}
+
+
+async def no_sleep(_):
+    pass
+
+
+def reader(batch_get_item):
+    return BatchReader(ThrottledClient(DatabaseExecutor(4), sleep=no_sleep), batch_get_item, 'Users', ['identity'],
+                       sleep=no_sleep)
+
+
+def test_reads_of_one_iteration_are_batched():
+    fake = FakeBatchReader()
+    users = reader(fake)
+
+    async def main():
+        return await asyncio.gather(*[users.get({"identity": str(i)}) for i in range(150)],
+                                    users.get({"identity": "500"}))
+
+    items = asyncio.run(main())
+    assert [len(call) for call in fake.calls] == [100, 51]
+    assert items[7]["identity"] == "7" and items[-1] is None
+    assert users.metrics()["saved"] == 149 and users.futures == {}
+
+
+def test_same_key_is_read_once():
+    fake = FakeBatchReader()
+    users = reader(fake)
+
+    async def main():
+        first, second = await asyncio.gather(users.get({"identity": "1"}), users.get({"identity": "1"}))
+        # Callers can change what they got
+        assert first == second and first is not second
+        # Read after a write doesn't join the earlier one
+        read = asyncio.ensure_future(users.get({"identity": "2"}))
+        await asyncio.sleep(0)
+        users.forget({"identity": "2"})
+        await asyncio.gather(read, users.get({"identity": "2"}))
+
+    asyncio.run(main())
+    assert fake.calls == [["1"], ["2"], ["2"]]
+    assert users.stats["coalesced"] == 1
+
+
+def test_unprocessed_keys_are_retried():
+    fake = FakeBatchReader(throttle=1)
+    users = reader(fake)
+
+    async def main():
+        return await asyncio.gather(*[users.get({"identity": str(i)}) for i in range(3)])
+
+    assert [item["identity"] for item in asyncio.run(main())] == ["0", "1", "2"]
+    assert fake.calls == [["0", "1", "2"], ["0"]]
+
+
+def test_database_translations():
+    db = Database.__wrapped__(backend="memory")
+
+    async def main():
+        await db.bulk_save_translations([{"language": "de", "string_key": str(i), "text": str(i)} for i in range(5)])
+        found = await db.query_translations("de", [str(i) for i in range(7)])
+        assert [item["text"] if item else None for item in found] == ["0", "1", "2", "3", "4", None, None]
+        await db.create_session({"name": "bot", "bulk": False})
+        await db.update_session_bulk("bot", True)
+        assert (await db.get_session("bot"))["bulk"] is True
+
+    asyncio.run(main())
+    assert db.translation_reads.stats["requests"] == 1
+    assert db.metrics()["reads"]["StringItems"]["saved"] == 6
+
+
+def test_readers_get_objects_of_their_own():
+    fake = FakeBatchReader()
+    users = reader(fake)
+
+    async def first():
+        item = await users.get({"identity": "1"})
+        item["states"].append("MUTATED-BY-FIRST")
+        return item
+
+    async def after_write():
+        # Forgotten before the read was sent, so the read joins it instead of replacing it
+        users.forget({"identity": "1"})
+        return await users.get({"identity": "1"})
+
+    async def main():
+        reads = [first(), users.get({"identity": "1"}), after_write()]
+        return await asyncio.wait_for(asyncio.gather(*reads), 3)
+
+    mutated, second, third = asyncio.run(main())
+    assert mutated["states"] == ["MUTATED-BY-FIRST"]
+    assert second["states"] == [] and third["states"] == []
+    assert fake.calls == [["1"]]
@@ -0,0 +1,83 @@
+from db.executor import DatabaseExecutor
+from db import Database
+import threading
+import asyncio
+import pytest
+import time
+import os
+
+
+def test_loop_is_not_blocked():
+    executor = DatabaseExecutor(4)
+    ticks = list()
+
+    async def ticker():
+        for _ in range(5):
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(ticker(), *[executor.run(time.sleep, 0.05) for _ in range(4)])
+
+    start = time.monotonic()
+    asyncio.run(main())
+    # All calls ran at the same time and the ticker kept going meanwhile
+    assert time.monotonic() - start < 0.15
+    assert ticks[-1] - ticks[0] < 0.1
+    executor.shutdown()
+
+
+def test_pool_is_bounded():
+    executor = DatabaseExecutor(2)
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def call(value):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        return value
+
+    async def main():
+        return await asyncio.gather(*[executor.run(call, i) for i in range(6)])
+
+    assert asyncio.run(main()) == list(range(6))
+    assert running[1] == 2
+    assert executor.metrics()["max_in_flight"] == 6
+    assert executor.metrics()["in_flight"] == 0
+    executor.shutdown()
+
+
+def test_exceptions_are_raised():
+    executor = DatabaseExecutor(1)
+
+    def fail(**kwargs):
+        raise KeyError(kwargs['Key'])
+
+    with pytest.raises(KeyError):
+        asyncio.run(executor.run(fail, Key="identity"))
+    assert executor.metrics()["errors"] == 1
+    executor.shutdown()
+
+
+def test_database_works_after_fork():
+    db = Database.__wrapped__(backend="memory")
+
+    async def call():
+        await asyncio.wait_for(db.get_session("bot"), 3)
+
+    # Same as the sanic workers: the database was used on import, then the process forks
+    asyncio.run(call())
+    pid = os.fork()
+    if pid == 0:
+        try:
+            asyncio.run(call())
+        except BaseException:
+            os._exit(1)
+        os._exit(0)
+    _, status = os.waitpid(pid, 0)
+    assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+    db.close()
@@ -0,0 +1,104 @@
+from db.group_commit import GroupCommit
+from db.executor import DatabaseExecutor
+from db.throttling import ThrottledClient
+from db import Database
+import asyncio
+import pytest
+
+
+class FakeBatchWriter:
+    """`batch_write_item` that leaves `throttled` items unprocessed on the first `throttle` calls"""
+    def __init__(self, throttle=0, throttled=1):
+        self.throttle = throttle
+        self.throttled = throttled
+        self.calls = list()
+        self.items = dict()
+
+    def __call__(self, RequestItems):
+        requests = RequestItems['Users']
+        assert len(requests) <= 25
+        self.calls.append([request['PutRequest']['Item']['identity'] for request in requests])
+        unprocessed = list()
+        if self.throttle:
+            self.throttle -= 1
+            requests, unprocessed = requests[self.throttled:], requests[:self.throttled]
+        for request in requests:
+            self.items[request['PutRequest']['Item']['identity']] = request['PutRequest']['Item']
+        return {"UnprocessedItems": {"Users": unprocessed} if unprocessed else {}}
+
+
+async def no_sleep(_):
+    pass
+
+
+def group_commit(writer, window=0.01, **kwargs):
+    return GroupCommit(ThrottledClient(DatabaseExecutor(4), sleep=no_sleep), writer, 'Users', 'identity', window,
+                       sleep=no_sleep, **kwargs)
+
+
+def test_concurrent_puts_share_batches():
+    writer = FakeBatchWriter()
+    commit = group_commit(writer)
+
+    async def main():
+        await asyncio.gather(*[commit.put({"identity": str(i), "n": i}) for i in range(60)])
+
+    asyncio.run(main())
+    assert sorted(len(call) for call in writer.calls) == [10, 25, 25]
+    assert len(writer.items) == 60
+    assert commit.metrics()["written"] == 60 and commit.metrics()["in_flight"] == 0
+
+
+def test_same_key_is_merged():
+    writer = FakeBatchWriter()
+    commit = group_commit(writer)
+
+    async def main():
+        await asyncio.gather(*[commit.put({"identity": "1", "n": i}) for i in range(3)])
+
+    asyncio.run(main())
+    assert writer.calls == [["1"]] and writer.items["1"]["n"] == 2
+    assert commit.stats["merged"] == 2
+
+
+def test_unprocessed_items_are_retried():
+    writer = FakeBatchWriter(throttle=2)
+    commit = group_commit(writer)
+
+    async def main():
+        await asyncio.gather(*[commit.put({"identity": str(i)}) for i in range(3)])
+
+    asyncio.run(main())
+    assert writer.calls == [["0", "1", "2"], ["0"], ["0"]]
+    assert len(writer.items) == 3 and commit.stats["unprocessed"] == 2
+
+    # Puts of the items that never got through fail, the others succeed
+    writer = FakeBatchWriter(throttle=10)
+    commit = group_commit(writer, max_retries=2)
+
+    async def failing():
+        return await asyncio.gather(*[commit.put({"identity": str(i)}) for i in range(3)], return_exceptions=True)
+
+    results = asyncio.run(failing())
+    assert isinstance(results[0], RuntimeError) and results[1:] == [None, None]
+
+
+def test_database_batches_user_puts():
+    db = Database.__wrapped__(backend="memory")
+    db.user_writes = GroupCommit(db.client, db.dynamodb.batch_write_item, 'Users', 'identity', 0.01)
+
+    async def main():
+        await asyncio.gather(*[db.commit_user({"identity": str(i), "language": None, "states": []})
+                               for i in range(30)])
+        # Update waits for the put of the same user
+        put = asyncio.ensure_future(db.commit_user({"identity": "30", "states": ["StartState"]}))
+        await asyncio.sleep(0)
+        await db.update_user("30", "SET states = list_append(states, :s)", {":s": ["QAState"]})
+        await put
+        with pytest.raises(TypeError):
+            await db.commit_user({"identity": "31", "score": 1.5})
+
+    asyncio.run(main())
+    assert db.Users.scan(Select="COUNT")["Count"] == 31
+    assert db.Users.get_item(Key={"identity": "30"})["Item"]["states"] == ["StartState", "QAState"]
+    assert db.user_writes.stats["batches"] == 4
@@ -0,0 +1,56 @@
+from db.lease import LocalLease, run_with_lease
+import asyncio
+
+
+def test_local_lease_is_exclusive_until_expired():
+    async def main():
+        first = LocalLease("test-exclusive", "first", duration=0.05)
+        second = LocalLease("test-exclusive", "second", duration=0.05)
+        assert await first.acquire()
+        # Renewal by the holder is fine, another owner has to wait
+        assert await first.acquire()
+        assert not await second.acquire()
+        await asyncio.sleep(0.06)
+        assert await second.acquire()
+        assert not await first.acquire()
+        await second.release()
+        assert await first.acquire()
+
+    asyncio.run(main())
+
+
+def test_job_runs_once_and_fails_over():
+    running = list()
+
+    def job_of(owner):
+        async def job():
+            running.append(owner)
+            try:
+                await asyncio.sleep(10)
+            finally:
+                running.remove(owner)
+        return job
+
+    async def main():
+        runners = {
+            owner: asyncio.ensure_future(run_with_lease(LocalLease("test-failover", owner, 0.06), job_of(owner)))
+            for owner in ("first", "second", "third")
+        }
+        await asyncio.sleep(0.05)
+        assert len(running) == 1
+        leader = running[0]
+        # Leader dies without releasing the lease -> someone else takes over after it expires
+        expires_at = LocalLease.holders["test-failover"][1]
+        dead = runners.pop(leader)
+        dead.cancel()
+        await asyncio.gather(dead, return_exceptions=True)
+        LocalLease.holders["test-failover"] = (leader, expires_at)
+        await asyncio.sleep(0.01)
+        assert not running
+        await asyncio.sleep(0.15)
+        assert len(running) == 1 and running[0] != leader
+        for runner in runners.values():
+            runner.cancel()
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
@@ -0,0 +1,191 @@
+from db.lease import DatabaseLease
+from db.memory import MemoryDynamoDB
+from db.planner import Target, plan_targets
+from .helpers import memory_database, user
+from botocore.exceptions import ClientError
+from boto3.dynamodb.conditions import Attr
+from decimal import Decimal
+import datetime
+import asyncio
+import pytest
+
+
+def test_users_round_trip():
+    db = memory_database()
+
+    async def main():
+        await db.create_user(user("1", language=None))
+        saved = await db.get_user("1")
+        # Numbers come back as Decimal, nulls of the indexed attributes are restored
+        assert saved["type"] == Decimal(0) and saved["language"] is None and saved["last_name"] is None
+        assert await db.get_user("2") is None
+
+        await db.update_user("1", "SET states = list_append(states, :i)", {":i": ["CheckbackState"]})
+        await db.update_user("1", "SET via_instance = :v", {":v": "other"}, saved)
+        assert saved["via_instance"] == "other"
+        assert (await db.get_user("1"))["states"] == ["ENDState", "CheckbackState"]
+
+        # Same validation as DynamoDB: floats and null index keys are rejected
+        with pytest.raises(TypeError):
+            await db.commit_user(user("3", type=1.5))
+        with pytest.raises(ClientError):
+            db.Users.put_item(Item=user("3", language=None))
+
+    asyncio.run(main())
+
+
+def test_broadcast_targets():
+    db = memory_database()
+
+    async def main():
+        for i in range(30):
+            await db.create_user(user(str(i), language=("en", "de", "fr")[i % 3], type=i % 2))
+        plan = await plan_targets(db, [Target("language", False, "=", "de"), Target("type", True, "=", 1)])
+        assert plan.index == "language_index" and plan.estimated_items == 30
+        found = list()
+        async for page in db.iter_users_index_pages(plan.index, plan.key_conditions()[0], plan.condition,
+                                                    "identity", page_size=3):
+            assert len(page) <= 3
+            found.extend(item["identity"] for item in page)
+        assert sorted(found) == sorted(str(i) for i in range(30) if i % 3 == 1 and i % 2 == 0)
+
+        segments = list()
+        for segment in range(4):
+            async for page in db.iter_users_pages(Attr("language").is_in(["en", "fr"]), "identity",
+                                                  segment, 4, page_size=4):
+                segments.extend(item["identity"] for item in page)
+        assert sorted(segments) == sorted(str(i) for i in range(30) if i % 3 != 1)
+        assert (await db.users_table_stats())["items"] == 30
+
+    asyncio.run(main())
+
+
+def test_leases_and_checkbacks():
+    db = memory_database()
+
+    async def main():
+        first, second = DatabaseLease(db, "job", "first"), DatabaseLease(db, "job", "second")
+        assert await first.acquire()
+        assert not await second.acquire()
+        await first.release()
+        assert await second.acquire()
+
+        checkback = await db.create_checkback(user("1"), {"user": {"identity": "1"}}, datetime.timedelta(0))
+        partition = checkback["partition"]
+        assert [item["id"] async for item in db.iter_pending_checkbacks(partition, db.now())] == [checkback["id"]]
+        assert await db.claim_checkback(checkback, datetime.timedelta(seconds=30))
+        assert not await db.claim_checkback(checkback, datetime.timedelta(seconds=30))
+        await db.complete_checkback(checkback)
+        # Sent checkback leaves the sparse index
+        assert [item async for item in db.iter_pending_checkbacks(partition)] == []
+        assert (await db.get_checkback(checkback["id"]))["was_sent"] is True
+
+    asyncio.run(main())
+
+
+def test_failed_checkbacks_back_off_then_die():
+    db = memory_database()
+
+    async def main():
+        checkback = await db.create_checkback(user("1"), {"user": {"identity": "1"}}, datetime.timedelta(0))
+        partition = checkback["partition"]
+        assert await db.claim_checkback(checkback, datetime.timedelta(seconds=30))
+        later = db.now() + datetime.timedelta(minutes=1)
+        await db.retry_checkback(checkback, "status 500", later)
+        # Not due before the new time, but can be claimed again then
+        assert [item async for item in db.iter_pending_checkbacks(partition, db.now())] == []
+        assert [item["id"] async for item in db.iter_pending_checkbacks(partition, later)] == [checkback["id"]]
+        saved = await db.get_checkback(checkback["id"])
+        assert saved["attempts"] == 1 and saved["send_at"] == later.isoformat()
+        assert await db.claim_checkback(saved, datetime.timedelta(seconds=30))
+
+        await db.dead_letter_checkback(saved, "status 500")
+        assert [item async for item in db.iter_pending_checkbacks(partition)] == []
+        assert not await db.claim_checkback(saved, datetime.timedelta(seconds=30))
+        dead = await db.get_checkback(checkback["id"])
+        assert dead["dead"] is True and dead["attempts"] == 2 and dead["last_error"] == "status 500"
+
+    asyncio.run(main())
+
+
+def test_pending_checkbacks_before_the_index_is_added():
+    db = memory_database()
+    db.dynamodb.meta.client.update_table(TableName="CheckBacks",
+                                         GlobalSecondaryIndexUpdates=[{"Delete": {"IndexName": "partition_time"}}])
+
+    async def main():
+        due = await db.create_checkback(user("1"), {"user": {"identity": "1"}}, datetime.timedelta(0))
+        await db.create_checkback(user("1"), {"user": {"identity": "1"}}, datetime.timedelta(days=1))
+        found = [item async for item in db.iter_pending_checkbacks(due["partition"], db.now())]
+        assert found == [{"id": due["id"], "partition": due["partition"], "send_at": due["send_at"]}]
+
+    asyncio.run(main())
+
+
+def test_sqlite_keeps_data(tmp_path):
+    path = str(tmp_path / "database.sqlite")
+
+    async def main():
+        db = memory_database(path)
+        await db.create_user(user("1"))
+        await db.create_outbound("bot", {"text": "hi"}, "status 500", datetime.timedelta(0))
+        db = memory_database(path)
+        assert (await db.get_user("1"))["first_name"] == "Test"
+        assert [item["service"] async for item in db.iter_due_outbound()] == ["bot"]
+
+    asyncio.run(main())
+
+
+def test_due_outbound_are_read_from_the_index():
+    db = memory_database()
+
+    async def main():
+        await db.create_outbound("due", {"text": "1"}, "status 500", datetime.timedelta(0))
+        await db.create_outbound("later", {"text": "2"}, "status 500", datetime.timedelta(minutes=5))
+        await db.create_outbound("dead", {"text": "3"}, "status 500", datetime.timedelta(0))
+        dead = [item async for item in db.iter_due_outbound() if item["service"] == "dead"][0]
+        await db.dead_letter_outbound(dead, "status 500")
+        assert [item["service"] async for item in db.iter_due_outbound()] == ["due"]
+        return db.OutboundMessages.get_item(Key={"id": dead["id"]})["Item"]
+
+    dead = asyncio.run(main())
+    assert dead["status"] == "dead" and "next_attempt_at" not in dead
+    assert dead["expires_at"] > db.now().timestamp() + 13 * 24 * 3600
+    operations = db.client.metrics()["OutboundMessages"]["operations"]
+    assert "scan" not in operations and operations["query"]["calls"] == 2
+
+
+def test_due_outbound_before_the_index_is_added():
+    db = memory_database()
+    db.dynamodb.meta.client.update_table(TableName="OutboundMessages",
+                                         GlobalSecondaryIndexUpdates=[{"Delete": {"IndexName": "status_next_attempt"}}])
+
+    async def main():
+        await db.create_outbound("bot", {"text": "hi"}, "status 500", datetime.timedelta(0))
+        return [item["service"] async for item in db.iter_due_outbound()]
+
+    assert asyncio.run(main()) == ["bot"]
+
+
+def test_expressions():
+    table = MemoryDynamoDB().create_table(
+        TableName="Items",
+        KeySchema=[{"AttributeName": "id", "KeyType": "HASH"}],
+        AttributeDefinitions=[{"AttributeName": "id", "AttributeType": "S"}]
+    )
+    table.put_item(Item={"id": "a", "count": 1, "tags": {"x"}, "nested": {"list": [1, 2, 3]}})
+    response = table.update_item(
+        Key={"id": "a"},
+        UpdateExpression="SET #c = #c + :one, nested.list[0] = :v, created = if_not_exists(created, :v) "
+                         "REMOVE nested.list[2] ADD tags :t",
+        ConditionExpression="attribute_exists(id) AND size(nested.list) BETWEEN :one AND :three AND NOT (#c > :three)",
+        ExpressionAttributeNames={"#c": "count"},
+        ExpressionAttributeValues={":one": 1, ":three": 3, ":v": 10, ":t": {"y"}},
+        ReturnValues="ALL_NEW"
+    )
+    assert response["Attributes"] == {"id": "a", "count": 2, "tags": {"x", "y"}, "nested": {"list": [10, 2]},
+                                      "created": 10}
+    with pytest.raises(ClientError) as e:
+        table.delete_item(Key={"id": "a"}, ConditionExpression=Attr("tags").contains("z") | Attr("count").lt(2))
+    assert e.value.response["Error"]["Code"] == "ConditionalCheckFailedException"
+    assert table.scan(FilterExpression=Attr("nested.list").size().eq(2), Select="COUNT")["Count"] == 1
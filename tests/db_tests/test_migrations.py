@@ -0,0 +1,75 @@
+from db.create_db import migrate_checkbacks, create_db, missing_indexes, add_missing_indexes
+from db.create_db import migrate_dead_letters, enable_time_to_live
+from db.memory import MemoryDynamoDB
+from db import Database
+from boto3.dynamodb.conditions import Key
+import datetime
+import asyncio
+
+
+def test_old_checkbacks_move_to_partitions():
+    db = Database.__wrapped__(backend="memory")
+    now = db.now()
+    ids = {"due": "00000000-0000-0000-0000-000000000001", "late": "00000000-0000-0000-0000-000000000002",
+           "old": "00000000-0000-0000-0000-000000000003"}
+    # As the server wrote them before the partitions
+    for name, send_at in (("due", now + datetime.timedelta(minutes=10)), ("late", now - datetime.timedelta(minutes=5)),
+                          ("old", now - datetime.timedelta(days=2))):
+        db.CheckBacks.put_item(Item={"id": ids[name], "server_mac": "123", "identity": "1", "context": "{}",
+                                     "send_at": send_at.isoformat()})
+
+    assert migrate_checkbacks(db.dynamodb, db.checkback_partition, now) == {"pending": 2, "sent": 1}
+    # Nothing left to migrate
+    assert migrate_checkbacks(db.dynamodb, db.checkback_partition, now) == {"pending": 0, "sent": 0}
+
+    async def pending():
+        found = list()
+        for partition in {db.checkback_partition(each) for each in ids.values()}:
+            found.extend([item["id"] async for item in db.iter_pending_checkbacks(partition)])
+        return found
+
+    assert sorted(asyncio.run(pending())) == [ids["due"], ids["late"]]
+    old = db.CheckBacks.get_item(Key={"id": ids["old"]})["Item"]
+    assert old["was_sent"] is True and "server_mac" not in old and "partition" not in old
+    assert asyncio.run(db.claim_checkback({"id": ids["due"]}, datetime.timedelta(seconds=30)))
+
+
+def test_new_indexes_are_added_by_the_migration(capsys):
+    dynamodb = MemoryDynamoDB()
+    # Users table of a version before the indexes
+    dynamodb.create_table(TableName='Users', KeySchema=[{'AttributeName': 'identity', 'KeyType': 'HASH'}],
+                          AttributeDefinitions=[{'AttributeName': 'identity', 'AttributeType': 'S'}])
+    dynamodb.Table('Users').put_item(Item={"identity": "1", "language": "de"})
+
+    create_db(dynamodb)
+    # Server start doesn't wait for the indexes to build
+    assert "Users: ALREADY EXISTS, MISSING INDEXES" in capsys.readouterr().out
+    assert missing_indexes(dynamodb, 'Users') == ['language_index', 'via_instance_index', 'type_index',
+                                                  'permission_level_index']
+
+    assert add_missing_indexes(dynamodb, 'Users') == ['language_index', 'via_instance_index', 'type_index',
+                                                      'permission_level_index']
+    assert missing_indexes(dynamodb, 'Users') == [] and add_missing_indexes(dynamodb, 'Users') == []
+    found = dynamodb.Table('Users').query(IndexName='language_index', KeyConditionExpression=Key('language').eq('de'))
+    assert [item["identity"] for item in found["Items"]] == ["1"]
+
+
+def test_dead_letters_leave_the_retry_index():
+    db = Database.__wrapped__(backend="memory")
+    # As the server dead-lettered them before the index
+    db.OutboundMessages.put_item(Item={"id": "1", "service": "bot", "context": "{}", "status": "dead", "attempts": 10,
+                                       "last_error": "status 500", "next_attempt_at": db.now().isoformat()})
+    db.OutboundMessages.put_item(Item={"id": "2", "service": "bot", "context": "{}", "status": "pending",
+                                       "attempts": 1, "last_error": "status 500", "next_attempt_at": db.now().isoformat()})
+
+    assert migrate_dead_letters(db.dynamodb, 1000) == 1
+    assert migrate_dead_letters(db.dynamodb, 2000) == 0
+    dead = db.OutboundMessages.get_item(Key={"id": "1"})["Item"]
+    assert "next_attempt_at" not in dead and dead["expires_at"] == 1000
+
+    async def due():
+        return [item["id"] async for item in db.iter_due_outbound()]
+
+    assert asyncio.run(due()) == ["2"]
+    assert enable_time_to_live(db.dynamodb, "OutboundMessages", "expires_at") is True
+    assert enable_time_to_live(db.dynamodb, "OutboundMessages", "expires_at") is False
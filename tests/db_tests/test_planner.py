@@ -0,0 +1,72 @@
+from db.planner import Target, plan_targets, index_values
+from decimal import Decimal
+import asyncio
+
+
+class FakeDatabase:
+    def __init__(self, indexes):
+        self.indexes = indexes
+        self.described = 0
+
+    async def users_table_stats(self):
+        self.described += 1
+        return {"items": 1000, "bytes": 1000 * 800, "indexes": {
+            index: {"items": items, "bytes": items * 80, "status": "ACTIVE"} for index, items in self.indexes.items()
+        }}
+
+
+def plan(targets, indexes=None, **kwargs):
+    db = FakeDatabase(indexes or {"language_index": 1000, "via_instance_index": 1000})
+    return asyncio.run(plan_targets(db, targets, **kwargs)), db
+
+
+def test_most_selective_index_is_queried():
+    targets = [Target("language", False, "=", "en"), Target("via_instance", False, "=", "bot"),
+               Target("type", False, ">", 1)]
+    result, _ = plan(targets, {"language_index": 1000, "via_instance_index": 50})
+    assert result.index == "via_instance_index"
+    assert result.values == ["bot"]
+    assert result.estimated_items == 50
+    assert result.estimated_read_units < 1
+    # Rest of the conditions filter the query
+    assert result.condition.get_expression()["operator"] == "AND"
+
+
+def test_in_condition_queries_each_value():
+    result, db = plan([Target("language", False, "{", ["en", "de"])])
+    assert result.index == "language_index"
+    assert [condition.get_expression()["values"][1] for condition in result.key_conditions()] == ["en", "de"]
+    # Size of the whole index is the upper bound
+    assert result.estimated_items == 1000
+    assert result.condition is None
+
+
+def test_same_size_prefers_fewer_queries():
+    result, db = plan([Target("language", False, "{", ["en", "de"]), Target("via_instance", False, "=", "bot")])
+    assert result.index == "via_instance_index" and db.described == 1
+
+
+def test_scan_when_no_index_helps():
+    # Inverted condition, attribute without index, filter on attribute that isn't copied to the index
+    for targets in ([Target("language", True, "=", "en")],
+                    [Target("first_name", False, "=", "Bob")],
+                    [Target("language", False, "=", "en"), Target("answers", False, "}", "yes")]):
+        result, db = plan(targets)
+        assert result.index is None
+        assert result.estimated_items == 1000
+    assert "full scan" in result.describe()
+
+
+def test_saved_plan_is_not_estimated_again():
+    result, db = plan([Target("permission_level", False, "=", Decimal(1))], estimate=False, key="permission_level")
+    assert result.index == "permission_level_index"
+    assert not db.described
+    result, db = plan([Target("permission_level", False, "=", 1)], estimate=False, key=None)
+    assert result.index is None
+
+
+def test_index_values_check_types():
+    assert index_values(Target("type", False, "=", "1")) is None
+    assert index_values(Target("type", False, "=", True)) is None
+    assert index_values(Target("language", False, "{", ["en", 1])) is None
+    assert index_values(Target("language", False, "=", "en")) == ["en"]
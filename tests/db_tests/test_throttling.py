@@ -0,0 +1,113 @@
+from db.throttling import AdaptiveRateLimiter, ThrottledClient
+from db.executor import DatabaseExecutor
+from botocore.exceptions import ClientError
+from db import Database
+import asyncio
+import pytest
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.now += seconds
+
+
+def throttle_error(code="ProvisionedThroughputExceededException"):
+    return ClientError({"Error": {"Code": code, "Message": "Rate exceeded"}}, "PutItem")
+
+
+class FakeTable:
+    """Throttles the first `throttle` calls, reports 1 unit per put"""
+    name = "Users"
+
+    def __init__(self, throttle=0, error="ProvisionedThroughputExceededException"):
+        self.throttle = throttle
+        self.error = error
+        self.calls = list()
+
+    def put_item(self, Item, **kwargs):
+        self.calls.append(kwargs)
+        if self.throttle:
+            self.throttle -= 1
+            raise throttle_error(self.error)
+        return {"ConsumedCapacity": {"TableName": "Users", "CapacityUnits": 1.0}}
+
+
+def test_rate_limit_is_aimd():
+    clock = Clock()
+    limiter = AdaptiveRateLimiter(clock=clock, sleep=clock.sleep)
+
+    async def main():
+        # Not limited at first: 20 requests in the same moment
+        for _ in range(20):
+            await limiter.acquire()
+        assert clock.now == 0
+        limiter.throttled()
+        assert limiter.rate == 10
+        # Requests in flight throttled together cut it only once
+        limiter.throttled()
+        assert limiter.rate == 10
+        for _ in range(10):
+            await limiter.acquire()
+        assert clock.now == pytest.approx(0.9)
+        limiter.succeeded()
+        assert limiter.rate == pytest.approx(10.1)
+        for _ in range(2000):
+            limiter.succeeded()
+        # Grew back over twice the throttled rate
+        assert limiter.rate is None
+
+    asyncio.run(main())
+
+
+def test_throttled_calls_are_retried():
+    clock = Clock()
+    client = ThrottledClient(DatabaseExecutor(2), retries=3, clock=clock, sleep=clock.sleep)
+    table = FakeTable(throttle=2)
+
+    async def main():
+        await client.run(table.put_item, Item={"identity": "1"})
+        await client.run(table.put_item, Item={"identity": "2"})
+
+    asyncio.run(main())
+    assert len(table.calls) == 4 and table.calls[0] == {"ReturnConsumedCapacity": "TOTAL"}
+    clock.now = 2
+    operations = client.metrics()["Users"]["operations"]["put_item"]
+    assert (operations["calls"], operations["throttled"], operations["retries"], operations["units"]) == (4, 2, 2, 2)
+    assert operations["units_per_second"] == 1
+    # Table was slowed down to the rate it throttled at, then the successful calls lifted the limit
+    assert client.limiters["Users"].ceiling == 1 and client.metrics()["Users"]["rate_limit"] is None
+
+
+def test_other_errors_are_raised():
+    clock = Clock()
+    client = ThrottledClient(DatabaseExecutor(2), retries=2, clock=clock, sleep=clock.sleep)
+
+    with pytest.raises(ClientError):
+        asyncio.run(client.run(FakeTable(throttle=1, error="ValidationException").put_item, Item={}))
+    table = FakeTable(throttle=5)
+    with pytest.raises(ClientError):
+        asyncio.run(client.run(table.put_item, Item={}))
+    # First attempt and 2 retries
+    assert len(table.calls) == 3
+    assert client.metrics()["Users"]["operations"]["put_item"]["failed"] == 1
+
+
+def test_handled_errors_are_logged_and_counted(caplog):
+    db = Database.__wrapped__(backend="memory")
+
+    class BrokenTable:
+        name = "WebCredentials"
+
+        def get_item(self, **kwargs):
+            raise ClientError({"Error": {"Code": "ValidationException", "Message": "Bad key"}}, "GetItem")
+
+    db.WebCredentials = BrokenTable()
+    assert asyncio.run(db.verify_creds("admin", "token")) is False
+    assert "WebCredentials.get_item failed: ValidationException: Bad key" in caplog.text
+    assert db.metrics()["tables"]["WebCredentials"]["operations"]["get_item"]["errors"] == 1
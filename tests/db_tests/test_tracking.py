@@ -0,0 +1,58 @@
+from db.tracking import changes, update_expression
+from db import Database
+from decimal import Decimal
+import asyncio
+import copy
+
+
+def test_only_changes_are_found():
+    old = {"identity": "1", "language": "en", "states": ["A", "B"], "flag": 1,
+           "answers": {"qa": {"curr_q": "q1", "history": ["q0"]}, "other": {"x": 1}}, "context": {"tmp": 1}}
+    new = copy.deepcopy(old)
+    new["states"].append("C")
+    new["flag"] = True
+    new["answers"]["qa"]["curr_q"] = "q2"
+    new["answers"]["qa"]["history"] = ["q1"]
+    del new["context"]["tmp"]
+    new["files"] = {}
+    assert changes(old, new) == [
+        ("APPEND", ("states",), ["C"]),
+        ("SET", ("flag",), True),
+        ("SET", ("answers", "qa", "curr_q"), "q2"),
+        ("SET", ("answers", "qa", "history"), ["q1"]),
+        ("REMOVE", ("context", "tmp"), None),
+        ("SET", ("files",), {})
+    ]
+    assert changes(old, copy.deepcopy(old)) == []
+
+
+def test_update_expression():
+    expression, names, values = update_expression([
+        ("SET", ("answers", "qa"), "q2"),
+        ("APPEND", ("states",), ["C"]),
+        ("REMOVE", ("answers", "old"), None)
+    ])
+    assert expression == "SET #a0.#a1 = :v0, #a2 = list_append(#a2, :v1) REMOVE #a0.#a3"
+    assert names == {"#a0": "answers", "#a1": "qa", "#a2": "states", "#a3": "old"}
+    assert values == {":v0": "q2", ":v1": ["C"]}
+
+
+def test_saved_changes_match_the_user():
+    db = Database.__wrapped__(backend="memory")
+
+    async def main():
+        await db.create_user({"identity": "1", "language": "en", "type": 0, "states": ["A"],
+                              "answers": {"qa": {"curr_q": "q1"}}, "context": {"name": "x"}})
+        user = await db.get_user("1")
+        stored = copy.deepcopy(user)
+        assert not await db.save_user(user, stored)
+        user["states"].append("B")
+        user["answers"]["qa"]["curr_q"] = "q2"
+        user["context"].clear()
+        # Index keys can't be null
+        user["language"] = None
+        assert await db.save_user(user, stored)
+        assert await db.get_user("1") == user
+        assert user["type"] == Decimal(0)
+
+    asyncio.run(main())
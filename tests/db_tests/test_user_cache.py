@@ -0,0 +1,114 @@
+from db.user_cache import UserCache
+from .helpers import memory_database, user
+import asyncio
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def cached_database(ttl=30, write_behind=0):
+    db = memory_database()
+    db.user_cache = UserCache(100, ttl)
+    db.write_behind = write_behind
+    return db
+
+
+def test_lru_and_ttl():
+    clock = Clock()
+    cache = UserCache(2, 10, clock)
+    cache.put("1", {"identity": "1"})
+    cache.put("2", {"identity": "2"})
+    assert cache.get("1") == {"identity": "1"}
+    # "2" is the least recently used now
+    cache.put("3", {"identity": "3"})
+    assert cache.get("2") is None and cache.get("3") is not None
+    clock.now = 10
+    assert cache.get("1") is None
+    cache.put("1", {"identity": "1"})
+    cache.invalidate("1")
+    cache.update("1", {"identity": "1"})
+    assert cache.get("1") is None
+    metrics = cache.metrics()
+    assert (metrics["hits"], metrics["misses"], metrics["evictions"], metrics["expired"]) == (2, 3, 1, 1)
+    assert metrics["hit_rate"] == 0.4 and metrics["size"] == 1
+
+
+def test_disabled():
+    cache = UserCache(10, 0)
+    cache.put("1", {"identity": "1"})
+    assert cache.get("1") is None and cache.metrics()["size"] == 0
+
+
+def test_database_reads_once():
+    db = cached_database()
+
+    async def main():
+        await db.create_user(user("1"))
+        first = await db.get_user("1")
+        # Changes of the caller don't leak into the cache
+        first["states"].append("QAState")
+        assert (await db.get_user("1"))["states"] == ["ENDState"]
+        await db.save_user(first, await db.get_user("1"))
+        assert (await db.get_user("1"))["states"] == ["ENDState", "QAState"]
+        assert db.user_reads.stats["requests"] == 0
+
+        # Arbitrary update (reminders, permissions of the other user) invalidates the user
+        await db.update_user("1", "SET permission_level = :p", {":p": 2})
+        assert (await db.get_user("1"))["permission_level"] == 2
+        assert db.user_reads.stats["requests"] == 1
+
+    asyncio.run(main())
+
+
+def test_read_during_update_is_not_cached():
+    db = cached_database()
+    run = db.client.run
+
+    async def read_during_update(method, **kwargs):
+        if method == db.Users.update_item:
+            # Another message of the user reads it while the update is in flight
+            assert (await db.get_user("1"))["permission_level"] == 0
+        return await run(method, **kwargs)
+
+    async def main():
+        await db.create_user(user("1"))
+        db.client.run = read_during_update
+        await db.update_user("1", "SET permission_level = :p", {":p": 2})
+        assert (await db.get_user("1"))["permission_level"] == 2
+
+    asyncio.run(main())
+
+
+def test_write_behind_merges_writes():
+    db = cached_database(write_behind=60)
+
+    async def main():
+        await db.create_user(user("1"))
+        for state in ("QAState", "ENDState"):
+            current = await db.get_user("1")
+            stored = await db.get_user("1")
+            current["states"].append(state)
+            assert await db.save_user(current, stored)
+        # Not written yet, but this process sees it
+        assert db.Users.get_item(Key={"identity": "1"})["Item"]["states"] == ["ENDState"]
+        assert (await db.get_user("1"))["states"] == ["ENDState", "QAState", "ENDState"]
+        assert db.metrics()["user_cache"]["pending_writes"] == 1
+
+        # Held back changes go before an arbitrary update
+        await db.update_user("1", "SET states = list_append(states, :s)", {":s": ["CheckbackState"]})
+        assert db.Users.get_item(Key={"identity": "1"})["Item"]["states"] == \
+            ["ENDState", "QAState", "ENDState", "CheckbackState"]
+
+        current = await db.get_user("1")
+        current["language"] = "de"
+        await db.save_user(current, await db.get_user("1"))
+        await db.flush_users()
+        assert db.Users.get_item(Key={"identity": "1"})["Item"]["language"] == "de"
+        assert db.pending_users == {}
+
+    asyncio.run(main())
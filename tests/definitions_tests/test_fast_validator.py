@@ -0,0 +1,68 @@
+from server_logic.definitions.context import fast_validate, schema_validate
+from copy import deepcopy
+import pytest
+
+
+VALID = {"security_token": "XXX", "via_instance": "UNIQUE_ID", "service_in": "WhatsApp",
+         "user": {"user_id": 1232131}, "chat": {"chat_id": 2131321}}
+
+
+def with_changes(**changes):
+    data = deepcopy(VALID)
+    for path, value in changes.items():
+        *parents, key = path.split("__")
+        target = data
+        for parent in parents:
+            target = target[parent]
+        target[key] = value
+    return data
+
+
+CASES = [
+    VALID,
+    with_changes(message={"text": "hello", "message_id": 5}),
+    with_changes(buttons=[{"text": "yes"}, {"text": "no", "value": None}]),
+    with_changes(file=[{"payload": "http://x/y.png", "extension": "png"}]),
+    # Invalid ones
+    {"nothing": "lel"},
+    [VALID],
+    (VALID, ),
+    "VALID",
+    with_changes(security_token=1),
+    with_changes(user="user"),
+    with_changes(user={}),
+    with_changes(user__user_id=None),
+    with_changes(user__user_id=True),
+    with_changes(chat__chat_id=[1]),
+    with_changes(forward={"is_bot": "no"}),
+    with_changes(message={"text": 5}),
+    with_changes(has_file="yes"),
+    with_changes(file=[{"payload": 1}]),
+    with_changes(file={"payload": "x"}),
+    with_changes(buttons=["yes"]),
+    with_changes(cache=[]),
+]
+
+
+@pytest.mark.parametrize("data", CASES)
+def test_same_result_as_jsonschema(data):
+    fast_data = deepcopy(data)
+    schema_data = deepcopy(data)
+
+    fast_error = fast_validate(fast_data)
+    schema_error = schema_validate(schema_data)
+
+    assert fast_error == schema_error
+    # Defaults are filled the same way
+    if schema_error is None:
+        assert fast_data == schema_data
+
+
+def test_defaults_are_not_shared():
+    first = deepcopy(VALID)
+    second = deepcopy(VALID)
+    fast_validate(first)
+    fast_validate(second)
+
+    first["message"]["text"] = "changed"
+    assert second["message"]["text"] is None
@@ -0,0 +1,46 @@
+from server_logic.definitions import Snapshot, freeze
+from strings.items import TextPromise
+
+
+def request():
+    return {"chat": {"chat_id": 1, "name": None}, "message": {"text": "hi"}, "buttons": [{"text": "ok"}]}
+
+
+def test_snapshot_is_not_affected_by_later_changes():
+    source = request()
+    first = freeze(source)
+    source["chat"]["chat_id"] = 2
+    source["buttons"].append({"text": "cancel"})
+    second = freeze(source, first)
+
+    assert first == request()
+    assert second["chat"]["chat_id"] == 2
+    assert len(second["buttons"]) == 2
+    assert isinstance(second, Snapshot)
+
+
+def test_unchanged_parts_are_shared():
+    source = request()
+    first = freeze(source)
+    source["chat"]["chat_id"] = 2
+    second = freeze(source, first)
+
+    assert second is not first
+    assert second["chat"] is not first["chat"]
+    assert second["message"] is first["message"]
+    assert second["buttons"] is first["buttons"]
+    # Nothing changed -> the very same snapshot (and its serialized form)
+    assert freeze(source, second) is second
+
+
+def test_type_change_is_not_shared():
+    first = freeze({"value": 1})
+    second = freeze({"value": True}, first)
+    assert second["value"] is True
+
+
+def test_promise_is_kept_to_be_filled_later():
+    promise = TextPromise("key")
+    snapshot = freeze({"message": {"text": promise}})
+    promise.fill("filled")
+    assert str(snapshot["message"]["text"]) == "filled"
@@ -0,0 +1,34 @@
+from fsm.admission import Admission
+from settings import MAX_QUEUE_SIZE, MAX_INSTANCE_QUEUE_SIZE, RETRY_AFTER
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    admission = Admission(MAX_QUEUE_SIZE, MAX_INSTANCE_QUEUE_SIZE, RETRY_AFTER)
+    # Spread over the instances, so none of them hits its own quota first
+    instances = MAX_QUEUE_SIZE // MAX_INSTANCE_QUEUE_SIZE + 1
+    for i in range(MAX_QUEUE_SIZE):
+        assert admission.admit(f"bot{i % instances}")
+    assert not admission.admit("other")
+    assert admission.rejection(message="too many requests") == \
+        {"status": 429, "message": "too many requests", "retry_after": RETRY_AFTER}
+    assert admission.headers() == {"Retry-After": str(RETRY_AFTER)}
+
+    # Place is freed once the message is handled
+    admission.release("bot0")
+    assert admission.admit("other")
+    stats = admission.stats()
+    assert stats["queue_depth"] == MAX_QUEUE_SIZE and stats["rejected"] == {"other": 1}
+
+
+def test_instance_quota():
+    admission = Admission(MAX_QUEUE_SIZE, MAX_INSTANCE_QUEUE_SIZE, RETRY_AFTER)
+    for _ in range(MAX_INSTANCE_QUEUE_SIZE):
+        assert admission.admit("busy")
+    assert not admission.admit("busy")
+    # One busy frontend doesn't take the whole queue
+    assert admission.admit("quiet")
+    for _ in range(MAX_INSTANCE_QUEUE_SIZE):
+        admission.release("busy")
+    stats = admission.stats()
+    assert stats["instance_depth"] == {"quiet": 1} and stats["rejected_total"] == 1
+    assert admission.rejection(results=[]) == {"status": 429, "results": [], "retry_after": RETRY_AFTER}
@@ -0,0 +1,120 @@
+from server_logic.definitions import freeze
+from fsm.broadcast import Broadcast
+from db import QueryPlan
+from http_client import http
+import asyncio
+import time
+
+
+class FakeDatabase:
+    def __init__(self, users):
+        self.users = users
+
+    async def iter_users_pages(self, condition, projection, segment, total_segments, page_size):
+        async for page in self.pages(self.users[segment::total_segments], page_size):
+            yield page
+
+    async def iter_users_index_pages(self, index, key_condition, condition, projection, page_size):
+        key, value = key_condition.get_expression()["values"]
+        users = [user for user in self.users if user[key.name] == value]
+        async for page in self.pages(users, page_size):
+            yield page
+
+    async def pages(self, users, page_size):
+        for start in range(0, len(users), page_size):
+            await asyncio.sleep(0)
+            yield users[start:start + page_size]
+
+
+class BrokenDatabase(FakeDatabase):
+    """Reading the targets fails after the first page"""
+    async def pages(self, users, page_size):
+        yield users[:page_size]
+        await asyncio.sleep(0.01)
+        raise ConnectionError("scan failed")
+
+
+class FakeOutbox:
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.sent = list()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def send(self, task, session):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.001)
+        self.in_flight -= 1
+        self.sent.append(task)
+        return task.context['chat']['chat_id'] not in self.failing
+
+
+def message():
+    return freeze({"chat": {"chat_id": 0, "name": None}, "message": {"text": "hello"}})
+
+
+def run(users, outbox, plan=None, **kwargs):
+    reports = list()
+
+    async def progress(job):
+        reports.append((job.sent, job.failed, job.done))
+
+    async def main():
+        job = Broadcast(FakeDatabase(users), outbox, plan or QueryPlan(None, [], None, 0, 0), message(), progress,
+                        **kwargs)
+        await job.start()
+        await http.close()
+        return job
+
+    return asyncio.run(main()), reports
+
+
+def test_every_target_gets_message_once():
+    users = [{"user_id": str(i), "via_instance": f"bot{i % 2}"} for i in range(250)]
+    outbox = FakeOutbox(failing={7})
+    job, reports = run(users, outbox, rate=100000, concurrency=8)
+
+    assert sorted(task.context['chat']['chat_id'] for task in outbox.sent) == list(range(250))
+    assert all(task.service == f"bot{task.context['chat']['chat_id'] % 2}" for task in outbox.sent)
+    # Everything but the chat is shared
+    assert all(task.context['message'] is job.message['message'] for task in outbox.sent)
+    assert (job.found, job.sent, job.failed) == (250, 249, 1)
+    assert reports[-1] == (249, 1, True) and job.outcome() == "partial"
+    assert 1 < outbox.max_in_flight <= 8
+    assert not Broadcast.running
+
+
+def test_targets_are_queried_by_index():
+    users = [{"user_id": str(i), "via_instance": f"bot{i % 3}"} for i in range(30)]
+    outbox = FakeOutbox()
+    job, _ = run(users, outbox, QueryPlan("via_instance", ["bot0", "bot2"], None, 20, 1), rate=100000)
+    assert sorted(task.context['chat']['chat_id'] for task in outbox.sent) == [i for i in range(30) if i % 3 != 1]
+
+
+def test_sending_is_paced():
+    users = [{"user_id": str(i), "via_instance": "bot"} for i in range(20)]
+    start = time.monotonic()
+    job, _ = run(users, FakeOutbox(), rate=100, concurrency=4)
+    assert job.sent == 20
+    # 20 messages at 100/s can't take less than ~0.19s
+    assert time.monotonic() - start >= 0.18
+
+
+def test_broken_scan_is_not_reported_complete():
+    users = [{"user_id": str(i), "via_instance": "bot"} for i in range(10)]
+    reports = list()
+
+    async def progress(job):
+        reports.append(job.outcome())
+
+    async def main():
+        job = Broadcast(BrokenDatabase(users), FakeOutbox(), QueryPlan(None, [], None, 0, 0), message(), progress,
+                        rate=100000)
+        await job.start()
+        await http.close()
+        return job
+
+    job = asyncio.run(main())
+    assert job.done and job.error == repr(ConnectionError("scan failed"))
+    assert reports == ["failed"]
@@ -0,0 +1,77 @@
+from server_logic.definitions import SenderTask
+from fsm.channels import ChannelRegistry
+from fsm.delivery import DeliveryQueue
+from settings import tokens, Config
+from aiohttp import ClientSession
+from .test_delivery import FakeDatabase, start_frontend
+import asyncio
+import json
+
+
+class FakeWebsocket:
+    """Frontend side of the websocket, answers each delivery with `status` (or doesn't, if None)"""
+
+    def __init__(self, registry, name, status=200):
+        self.registry = registry
+        self.name = name
+        self.status = status
+        self.sent = list()
+
+    async def send(self, data):
+        message = json.loads(data)
+        self.sent.append(message)
+        if self.status is not None:
+            channel = self.registry.get(self.name)
+            asyncio.get_event_loop().call_soon(channel.ack, message["id"], self.status)
+
+
+def test_acknowledged_message_is_not_sent_over_http():
+    async def main():
+        registry = ChannelRegistry()
+        ws = FakeWebsocket(registry, "channel_bot")
+        registry.open("channel_bot", ws)
+        # Nothing listens there, http would fail
+        tokens["channel_bot"] = Config("TOKEN", "http://127.0.0.1:9/")
+        queue = DeliveryQueue(FakeDatabase(), registry)
+        async with ClientSession() as session:
+            assert await queue.send(SenderTask("channel_bot", {"text": "hi"}), session)
+        return queue, ws
+
+    queue, ws = asyncio.run(main())
+    assert [message["payload"] for message in ws.sent] == [{"text": "hi"}]
+    assert queue.stats["channel_bot"] == {"websocket": 1, "delivered": 1}
+
+
+def test_unacknowledged_message_falls_back_to_http():
+    async def main():
+        runner, url, received = await start_frontend([200])
+        registry = ChannelRegistry()
+        channel = registry.open("channel_mute_bot", FakeWebsocket(registry, "channel_mute_bot", status=None))
+        channel.ACK_TIMEOUT = 0.05
+        tokens["channel_mute_bot"] = Config("TOKEN", url)
+        queue = DeliveryQueue(FakeDatabase(), registry)
+        async with ClientSession() as session:
+            assert await queue.send(SenderTask("channel_mute_bot", {"text": "hi"}), session)
+        await runner.cleanup()
+        return queue, received
+
+    queue, received = asyncio.run(main())
+    assert received == [{"text": "hi"}]
+    assert queue.stats["channel_mute_bot"] == {"websocket_failed": 1, "delivered": 1}
+
+
+def test_reconnect_replaces_old_channel():
+    async def main():
+        registry = ChannelRegistry()
+        old = registry.open("channel_bot", FakeWebsocket(registry, "channel_bot", status=None))
+        pending = asyncio.ensure_future(old.deliver('{"text": "hi"}'))
+        await asyncio.sleep(0)
+        new = registry.open("channel_bot", FakeWebsocket(registry, "channel_bot"))
+        # Closing stale connection must not drop the new one
+        registry.close("channel_bot", old)
+        return registry, new, await pending
+
+    registry, new, error = asyncio.run(main())
+    assert error is not None
+    assert registry.get("channel_bot") is new
+    assert registry.metrics()["connected"] == ["channel_bot"]
@@ -0,0 +1,130 @@
+from server_logic.definitions import SenderTask
+from settings import tokens, Config
+from fsm.delivery import DeliveryQueue
+from aiohttp import web, ClientSession
+import datetime
+import asyncio
+import json
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.items = dict()
+
+    async def create_outbound(self, service, context, error, retry_in):
+        id_ = str(len(self.items))
+        self.items[id_] = {"id": id_, "service": service, "context": json.dumps(context),
+                           "status": "pending", "attempts": 1, "last_error": error}
+
+    async def remove_outbound(self, item):
+        del self.items[item["id"]]
+
+    async def reschedule_outbound(self, item, error, retry_in):
+        self.items[item["id"]]["attempts"] += 1
+
+    async def dead_letter_outbound(self, item, error):
+        self.items[item["id"]]["status"] = "dead"
+
+
+async def start_frontend(statuses):
+    received = list()
+
+    async def handle(request):
+        received.append(await request.json())
+        return web.Response(status=statuses.pop(0))
+
+    app = web.Application()
+    app.router.add_post("/", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/", received
+
+
+def test_failed_message_is_retried_until_delivered():
+    async def main():
+        runner, url, received = await start_frontend([500, 502, 200])
+        tokens["delivery_test_bot"] = Config("TOKEN", url)
+        db = FakeDatabase()
+        queue = DeliveryQueue(db)
+        async with ClientSession() as session:
+            assert not await queue.send(SenderTask("delivery_test_bot", {"text": "hi"}), session)
+            assert len(db.items) == 1
+            for _ in range(2):
+                await queue.retry(dict(next(iter(db.items.values()))), session)
+        await runner.cleanup()
+        return queue, db, received
+
+    queue, db, received = asyncio.run(main())
+    assert received == [{"text": "hi"}] * 3
+    assert not db.items
+    assert queue.stats["delivery_test_bot"] == {"failed": 2, "queued": 1, "delivered": 1, "retried": 1}
+
+
+def test_connection_error_does_not_raise_and_dead_letters():
+    async def main():
+        # Nothing listens there
+        tokens["delivery_down_bot"] = Config("TOKEN", "http://127.0.0.1:9/")
+        db = FakeDatabase()
+        queue = DeliveryQueue(db)
+        queue.MAX_ATTEMPTS = 2
+        async with ClientSession() as session:
+            assert not await queue.send(SenderTask("delivery_down_bot", {"text": "hi"}), session)
+            await queue.retry(dict(next(iter(db.items.values()))), session)
+        return queue, db
+
+    queue, db = asyncio.run(main())
+    assert [item["status"] for item in db.items.values()] == ["dead"]
+    assert queue.stats["delivery_down_bot"]["dead"] == 1
+
+
+def test_turn_is_sent_in_one_request_to_bulk_frontend():
+    async def main():
+        bulk_runner, bulk_url, bulk_received = await start_frontend([200])
+        old_runner, old_url, old_received = await start_frontend([200, 200])
+        tokens["delivery_bulk_bot"] = Config("TOKEN", bulk_url, bulk=True)
+        tokens["delivery_old_bot"] = Config("TOKEN", old_url)
+        queue = DeliveryQueue(FakeDatabase())
+        tasks = [
+            SenderTask("delivery_bulk_bot", {"text": "1"}),
+            SenderTask("delivery_bulk_bot", {"text": "2"}),
+            SenderTask("delivery_old_bot", {"text": "3"}),
+            SenderTask("delivery_old_bot", {"text": "4"}),
+        ]
+        async with ClientSession() as session:
+            results = await queue.send_all(tasks, session)
+        await bulk_runner.cleanup()
+        await old_runner.cleanup()
+        return queue, results, bulk_received, old_received
+
+    queue, results, bulk_received, old_received = asyncio.run(main())
+    assert results == [True] * 4
+    assert bulk_received == [{"messages": [{"text": "1"}, {"text": "2"}]}]
+    assert old_received == [{"text": "3"}, {"text": "4"}]
+    assert queue.stats["delivery_bulk_bot"] == {"bulk_requests": 1, "delivered": 2}
+
+
+def test_failed_bulk_request_queues_each_message():
+    async def main():
+        runner, url, received = await start_frontend([503])
+        tokens["delivery_bulk_down_bot"] = Config("TOKEN", url, bulk=True)
+        db = FakeDatabase()
+        queue = DeliveryQueue(db)
+        tasks = [SenderTask("delivery_bulk_down_bot", {"text": str(i)}) for i in range(3)]
+        async with ClientSession() as session:
+            results = await queue.send_all(tasks, session)
+        await runner.cleanup()
+        return results, db
+
+    results, db = asyncio.run(main())
+    assert results == [False] * 3
+    assert sorted(json.loads(item["context"])["text"] for item in db.items.values()) == ["0", "1", "2"]
+
+
+def test_backoff_grows_and_is_capped():
+    queue = DeliveryQueue(FakeDatabase())
+    assert queue.retry_delay(1) <= datetime.timedelta(seconds=queue.BASE_DELAY)
+    assert queue.retry_delay(4) >= datetime.timedelta(seconds=queue.BASE_DELAY * 8 * 0.5)
+    assert queue.retry_delay(100) <= datetime.timedelta(seconds=queue.MAX_DELAY)
@@ -0,0 +1,76 @@
+from fsm.executor import KeyedExecutor
+import asyncio
+
+
+async def record(log, key, value, delay):
+    log.append((key, value, "start"))
+    await asyncio.sleep(delay)
+    log.append((key, value, "end"))
+
+
+def test_same_key_is_serialized():
+    log = list()
+
+    async def main():
+        executor = KeyedExecutor()
+        # First job is the slowest, but must still finish before the second one starts
+        executor.submit("user1", record(log, "user1", 1, 0.02))
+        executor.submit("user1", record(log, "user1", 2, 0))
+        executor.submit("user1", record(log, "user1", 3, 0.01))
+        await executor.join()
+
+    asyncio.run(main())
+    assert log == [
+        ("user1", 1, "start"), ("user1", 1, "end"),
+        ("user1", 2, "start"), ("user1", 2, "end"),
+        ("user1", 3, "start"), ("user1", 3, "end"),
+    ]
+
+
+def test_different_keys_run_concurrently():
+    log = list()
+
+    async def main():
+        executor = KeyedExecutor()
+        executor.submit("user1", record(log, "user1", 1, 0.02))
+        executor.submit("user2", record(log, "user2", 1, 0))
+        await executor.join()
+
+    asyncio.run(main())
+    # user2 finished while user1 was still running
+    assert log.index(("user2", 1, "end")) < log.index(("user1", 1, "end"))
+
+
+def test_in_flight_keys_are_bounded():
+    peak = 0
+
+    async def job(executor):
+        nonlocal peak
+        peak = max(peak, executor.in_flight)
+        await asyncio.sleep(0.005)
+
+    async def main():
+        executor = KeyedExecutor(max_keys=2)
+        for i in range(6):
+            executor.submit(i, job(executor))
+        await executor.join()
+        assert executor.pending == 0
+
+    asyncio.run(main())
+    assert peak == 2
+
+
+def test_failing_job_does_not_block_key():
+    log = list()
+
+    async def fail():
+        raise RuntimeError("broken state")
+
+    async def main():
+        executor = KeyedExecutor()
+        executor.submit("user1", fail())
+        executor.submit("user1", record(log, "user1", 1, 0))
+        await executor.join()
+
+    asyncio.run(main())
+    assert log == [("user1", 1, "start"), ("user1", 1, "end")]
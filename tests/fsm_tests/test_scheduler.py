@@ -0,0 +1,58 @@
+from fsm.scheduler import CheckbackScheduler
+import datetime
+import asyncio
+import pytz
+
+
+def now():
+    return datetime.datetime.now(pytz.utc)
+
+
+def checkback(id_, seconds):
+    return {"id": id_, "send_at": (now() + datetime.timedelta(seconds=seconds)).isoformat()}
+
+
+def test_fires_in_order_at_send_at():
+    fired = list()
+
+    async def fire(item):
+        fired.append((item["id"], now()))
+
+    async def main():
+        scheduler = CheckbackScheduler(fire, now)
+        runner = asyncio.ensure_future(scheduler.run())
+        late = checkback("late", 0.06)
+        scheduler.add(late)
+        await asyncio.sleep(0.01)
+        # Earlier checkback added while scheduler already sleeps for the later one
+        early = checkback("early", 0.02)
+        scheduler.add(early)
+        # Same checkback scheduled twice (e.g. also loaded from database) is fired once
+        scheduler.add(dict(early))
+        await asyncio.sleep(0.1)
+        runner.cancel()
+        return early, late
+
+    early, late = asyncio.run(main())
+    assert [id_ for id_, _ in fired] == ["early", "late"]
+    for (_, fired_at), item in zip(fired, (early, late)):
+        delay = (fired_at - datetime.datetime.fromisoformat(item["send_at"])).total_seconds()
+        assert 0 <= delay < 0.02
+
+
+def test_overdue_fires_immediately():
+    fired = list()
+
+    async def fire(item):
+        fired.append(item["id"])
+
+    async def main():
+        scheduler = CheckbackScheduler(fire, now)
+        scheduler.add(checkback("overdue", -60))
+        runner = asyncio.ensure_future(scheduler.run())
+        await asyncio.sleep(0.01)
+        runner.cancel()
+        assert len(scheduler) == 0
+
+    asyncio.run(main())
+    assert fired == ["overdue"]
@@ -0,0 +1,102 @@
+from fsm.unit_of_work import UnitOfWork
+from db.tracking import changes
+from collections import namedtuple
+import asyncio
+import copy
+
+
+# Same as the statuses of `fsm.states.base_state` (importing it needs a database)
+OK = namedtuple("OK", ["commit"], defaults=[True])
+GO_TO_STATE = namedtuple("GO_TO_STATE", ["next_state", "commit"], defaults=[True])
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.writes = list()
+
+    async def save_user(self, user, stored):
+        if stored is None:
+            self.writes.append(("put", copy.deepcopy(user)))
+            return True
+        actions = changes(stored, user)
+        if actions:
+            self.writes.append(("update", actions))
+        return bool(actions)
+
+
+def user():
+    return {"identity": "1", "via_instance": "bot", "states": ["ENDState"], "answers": {}, "context": {}}
+
+
+def run_chain(work, steps):
+    """Each step changes the user like a state would and returns its status"""
+    async def main():
+        for step in steps:
+            work.record(step(work.user))
+        await work.complete()
+    asyncio.run(main())
+
+
+def test_chain_is_written_once():
+    db = FakeDatabase()
+    work = UnitOfWork(db, user())
+
+    def start(u):
+        u["states"].append("LanguageDetectionState")
+        return GO_TO_STATE("LanguageDetectionState")
+
+    def language(u):
+        u["language"] = "de"
+        u["states"].append("QAState")
+        return GO_TO_STATE("QAState")
+
+    def qa(u):
+        u["answers"]["qa"] = {"curr_q": "q1"}
+        return OK()
+
+    run_chain(work, [start, language, qa])
+    # Only what changed
+    assert db.writes == [("update", [
+        ("APPEND", ("states",), ["LanguageDetectionState", "QAState"]),
+        ("SET", ("answers", "qa"), {"curr_q": "q1"}),
+        ("SET", ("language",), "de")
+    ])]
+
+
+def test_failed_state_rolls_back_the_chain():
+    db = FakeDatabase()
+    work = UnitOfWork(db, user())
+
+    def start(u):
+        u["states"].append("QAState")
+        u["context"]["step"] = 1
+        return GO_TO_STATE("QAState")
+
+    def failed(u):
+        u["answers"]["half"] = True
+        return OK(commit=False)
+
+    run_chain(work, [start, failed])
+    assert db.writes == []
+    # Same (shared) object is restored
+    assert work.user == user()
+
+
+def test_registration_is_kept_when_states_fail():
+    db = FakeDatabase()
+    work = UnitOfWork(db, user(), new=True)
+    work.checkpoint()
+
+    def failed(u):
+        u["states"].append("StartState")
+        return OK(commit=False)
+
+    run_chain(work, [failed])
+    assert db.writes == [("put", user())]
+
+
+def test_nothing_to_write():
+    db = FakeDatabase()
+    run_chain(UnitOfWork(db, user()), [])
+    run_chain(UnitOfWork(db, user()), [lambda u: OK()])
+    assert db.writes == []
@@ -0,0 +1,50 @@
+from http_client import HttpClient
+from aiohttp import web
+import asyncio
+
+
+async def start_server():
+    async def handle(request):
+        return web.json_response({"ok": True})
+
+    app = web.Application()
+    app.router.add_get("/", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/"
+
+
+def test_connections_are_reused():
+    async def main():
+        runner, url = await start_server()
+        client = HttpClient()
+        try:
+            for _ in range(3):
+                async with client.session("frontend").get(url) as resp:
+                    assert (await resp.json())["ok"]
+            assert client.session("frontend") is client.session("frontend")
+        finally:
+            await client.close()
+            await runner.cleanup()
+        return client.metrics()
+
+    metrics = asyncio.run(main())
+    assert metrics["frontend"]["requests"] == 3
+    assert metrics["frontend"]["new_connections"] == 1
+    assert metrics["frontend"]["reused_connections"] == 2
+    assert metrics["frontend"]["reuse_rate"] == 2 / 3
+
+
+def test_session_is_recreated_in_new_loop():
+    client = HttpClient()
+
+    async def get_session():
+        return client.session("media")
+
+    first = asyncio.run(get_session())
+    second = asyncio.run(get_session())
+    assert first is not second
+    asyncio.run(client.close())
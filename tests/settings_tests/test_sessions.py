@@ -0,0 +1,43 @@
+from settings.sessions import SessionRegistry, Config
+import asyncio
+
+
+def test_lookup_by_name_and_url():
+    registry = SessionRegistry("SERVER")
+    registry["bot1"] = Config("TOKEN1", "https://bot1")
+
+    assert registry["server"] == "SERVER"
+    assert registry["bot1"].token == "TOKEN1"
+    assert registry.by_url("https://bot1") == "bot1"
+    assert "bot1" in registry and "server" in registry and "bot2" not in registry
+    assert list(registry) == ["server", "bot1"]
+
+
+def test_changed_url_is_reindexed():
+    registry = SessionRegistry("SERVER")
+    registry["bot1"] = Config("TOKEN1", "https://old")
+    registry["bot1"] = Config("TOKEN1", "https://new")
+
+    assert registry.by_url("https://old") is None
+    assert registry.by_url("https://new") == "bot1"
+
+
+def test_miss_reloads_from_loader_once():
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        return [{"name": "bot2", "token": "TOKEN2", "url": "https://bot2"}]
+
+    async def main():
+        registry = SessionRegistry("SERVER", min_interval=60)
+        registry.set_loader(loader)
+        # Concurrent misses share a single reload
+        found = await asyncio.gather(registry.ensure("bot2"), registry.ensure(url="https://bot2"),
+                                     registry.ensure("missing"))
+        assert found == [True, True, False]
+        assert registry["bot2"] == Config("TOKEN2", "https://bot2")
+
+    asyncio.run(main())
+    assert calls == 1
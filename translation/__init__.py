@@ -1,5 +1,6 @@
 from settings import CLOUD_TRANSLATION_API_KEY
 from aiohttp import ClientSession
+from http_client import http
 import logging
 import asyncio
 import ujson
@@ -18,13 +19,9 @@ class Translator:
         self.key = CLOUD_TRANSLATION_API_KEY
 
     async def __get_json(self, url: str, data: dict, headers: dict, session: ClientSession):
-        if session:
-            async with session.post(url, json=data, headers=headers) as response:
-                return await response.json()
-        else:
-            async with ClientSession() as session:
-                async with session.post(url, json=data, headers=headers) as response:
-                    return await response.json()
+        session = session or http.session("translator")
+        async with session.post(url, json=data, headers=headers) as response:
+            return await response.json()
 
     async def detect_language(self,
                               text: str,
@@ -55,13 +52,12 @@ class Translator:
 
     async def translate_dict(self, target: str, texts: dict, from_lang: str = 'en'):
         new_texts = dict()
-        async with ClientSession() as session:
-            for key, each_text in texts.items():
-                new_text: str = await self.translate_text(each_text, target, session)
-                #:< Hacks
-                new_text = new_text.replace("& deg;", "°")
-                #
-                new_texts[key] = new_text
+        for key, each_text in texts.items():
+            new_text: str = await self.translate_text(each_text, target)
+            #:< Hacks
+            new_text = new_text.replace("& deg;", "°")
+            #
+            new_texts[key] = new_text
         return new_texts
 
     async def translate_multiple_languages_dict(self, languages: list, source_dict: dict, from_lang: str = 'en'):
@@ -1,3 +1,4 @@
+from http_client import http
 from . import Translator
 import argparse
 import asyncio
@@ -21,4 +22,5 @@ if __name__ == "__main__":
             args.output_file
         )
     )
+    asyncio.get_event_loop().run_until_complete(http.close())
     # [EXAMPLE]: python -m translation strings/json/strings.json en de ru es fr uk strings/json/all_strings.json
\ No newline at end of file